@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""Measure the AddressbookManager URI index with a large number of contacts, against scanning all contacts"""
+
+import random
+import sys
+
+from time import perf_counter
+
+from application.notification import NotificationCenter, NotificationData
+
+from sipsimple.addressbook import AddressbookManager, normalize_uri
+
+
+class ContactURI(object):
+    def __init__(self, uri):
+        self.uri = uri
+
+
+class Contact(object):
+    """Stands in for an addressbook Contact, of which the manager only uses the id and the URIs"""
+
+    def __init__(self, id, uris):
+        self.id = id
+        self.uris = [ContactURI(uri) for uri in uris]
+
+
+def contact_uris(index):
+    return ['sip:user%d@example.com' % index, 'tel:+31%07d' % index]
+
+
+def caller_uri(index):
+    # the way the URI of a caller shows up in a request, which is not how it was stored
+    return '"User %d" <sip:user%d@EXAMPLE.com:5061;transport=tls>' % (index, index)
+
+
+def scan(manager, uri):
+    key = normalize_uri(uri)
+    return [contact for contact in manager.get_contacts() if any(normalize_uri(contact_uri.uri) == key for contact_uri in contact.uris)]
+
+
+def main(count=50000, lookups=10000, scans=100):
+    random.seed(0)
+    notification_center = NotificationCenter()
+    manager = AddressbookManager()
+    contacts = [Contact('id%d' % index, contact_uris(index)) for index in range(count)]
+
+    start = perf_counter()
+    for contact in contacts:
+        notification_center.post_notification('AddressbookContactWasActivated', sender=contact)
+    print('activating %d contacts: %.2f s' % (count, perf_counter() - start))
+
+    indexes = [random.randrange(count) for i in range(lookups)]
+    start = perf_counter()
+    for index in indexes:
+        found = manager.find_contacts(caller_uri(index))
+        assert [contact.id for contact in found] == ['id%d' % index], found
+    print('find_contacts: %.1f us per lookup' % ((perf_counter() - start) / lookups * 1e6))
+
+    start = perf_counter()
+    for index in indexes[:scans]:
+        found = scan(manager, caller_uri(index))
+        assert [contact.id for contact in found] == ['id%d' % index], found
+    print('scanning all contacts: %.1f ms per lookup' % ((perf_counter() - start) / scans * 1e3))
+
+    start = perf_counter()
+    for index in indexes:
+        contact = contacts[index]
+        contact.uris = [ContactURI('sip:changed%d@example.com' % index)]
+        notification_center.post_notification('AddressbookContactDidChange', sender=contact, data=NotificationData(modified={'uris': None}))
+    print('changing the URIs of a contact: %.1f us' % ((perf_counter() - start) / lookups * 1e6))
+    index = indexes[-1]
+    assert not manager.find_contacts(caller_uri(index)) and manager.find_contacts('sip:changed%d@example.com' % index) == [contacts[index]]
+
+    start = perf_counter()
+    for contact in contacts:
+        notification_center.post_notification('AddressbookContactWasDeleted', sender=contact)
+    print('deleting %d contacts: %.2f s' % (count, perf_counter() - start))
+    assert not manager._contact_uri_index and not manager._contact_uri_keys, 'deleted contacts were left in the index'
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:4]))
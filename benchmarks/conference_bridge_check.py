@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+"""
+Check the connections made by ConferenceBridge against a fake mixer, so that
+it can be run without the SIP core: every consumer must hear exactly the other
+producers, while ports join and leave at random.
+"""
+
+import random
+import sys
+import types
+
+from zope.interface import implementer
+
+
+class FakeMixer(object):
+    def __init__(self):
+        self.connections = set()
+        self.next_slot = 1
+
+    def allocate_slot(self):
+        slot = self.next_slot
+        self.next_slot += 1
+        return slot
+
+    def connect_slots(self, src_slot, dst_slot):
+        self.connections.add((src_slot, dst_slot))
+
+    def disconnect_slots(self, src_slot, dst_slot):
+        self.connections.discard((src_slot, dst_slot))
+
+    def remove_slot(self, slot):
+        self.connections = {connection for connection in self.connections if slot not in connection}
+
+
+class FakeMixerPort(object):
+    def __init__(self, mixer):
+        self.mixer = mixer
+        self.slot = None
+
+    def start(self):
+        self.slot = self.mixer.allocate_slot()
+
+    def stop(self):
+        self.mixer.remove_slot(self.slot)
+        self.slot = None
+
+
+# ConferenceBridge only needs MixerPort from the core
+core = types.ModuleType('sipsimple.core')
+core.MixerPort = FakeMixerPort
+core.MemoryPlayer = core.RecordingWaveFile = core.WaveFile = core.read_wave_file = None
+core.SIPCoreError = Exception
+sys.modules['sipsimple.core'] = core
+
+from sipsimple.audio import ConferenceBridge, IAudioPort
+
+
+@implementer(IAudioPort)
+class Port(object):
+    def __init__(self, mixer):
+        self.mixer = mixer
+        self.producer_slot = self.consumer_slot = mixer.allocate_slot()
+
+
+def check(mixer, bridge, ports):
+    buses = {group.bus.slot for group in bridge.groups if group.bus is not None}
+    for port in ports:
+        heard = set()
+        for source, destination in mixer.connections:
+            if destination == port.consumer_slot:
+                if source in buses:
+                    heard.update(bus_source for bus_source, bus in mixer.connections if bus == source)
+                else:
+                    heard.add(source)
+        expected = {other.producer_slot for other in ports if other is not port}
+        if heard != expected:
+            raise AssertionError('port %d hears %r, expected %r' % (port.consumer_slot, sorted(heard), sorted(expected)))
+
+
+def main(seed=None):
+    seed = random.randrange(2**32) if seed is None else seed
+    random.seed(seed)
+    print('%6s  %10s  %11s  %9s' % ('ports', 'groups', 'connections', 'full-mesh'))
+    for count in (10, 50, 200):
+        mixer = FakeMixer()
+        bridge = ConferenceBridge(mixer)
+        ports = [Port(mixer) for i in range(count)]
+        for port in ports:
+            bridge.add(port)
+        check(mixer, bridge, ports)
+        print('%6d  %10d  %11d  %9d' % (count, len(bridge.groups), len(mixer.connections), count * (count - 1)))
+        for port in random.sample(ports, count // 3):
+            bridge.remove(port)
+            ports.remove(port)
+        check(mixer, bridge, ports)
+        for i in range(5):
+            port = Port(mixer)
+            bridge.add(port)
+            ports.append(port)
+        check(mixer, bridge, ports)
+
+    # random joins and leaves with small groups, until everybody left
+    mixer = FakeMixer()
+    bridge = ConferenceBridge(mixer, group_size=4)
+    ports = [Port(mixer) for i in range(40)]
+    for port in ports:
+        bridge.add(port)
+    while ports:
+        port = random.choice(ports)
+        bridge.remove(port)
+        ports.remove(port)
+        check(mixer, bridge, ports)
+        if random.random() < 0.3:
+            port = Port(mixer)
+            bridge.add(port)
+            ports.append(port)
+            check(mixer, bridge, ports)
+    assert not bridge.groups and not mixer.connections, 'connections were left behind'
+
+    # a port that goes away without being removed
+    mixer = FakeMixer()
+    bridge = ConferenceBridge(mixer, group_size=2)
+    ports = [Port(mixer) for i in range(3)]
+    for port in ports:
+        bridge.add(port)
+    del port
+    port = ports.pop()
+    mixer.remove_slot(port.producer_slot)
+    del port
+    assert len(bridge.groups) == 1 and bridge.groups[0].bus is None, 'the groups were not merged back'
+    check(mixer, bridge, ports)
+    print('ok (seed %d)' % seed)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""Compare the CPU used by the audio mixer for conferences connected by RootAudioBridge and by ConferenceBridge"""
+
+import sys
+
+from threading import Event
+from time import process_time, sleep
+
+from application.notification import IObserver, NotificationCenter
+from zope.interface import implementer
+
+from sipsimple.audio import ConferenceBridge, IAudioPort, RootAudioBridge
+from sipsimple.core import AudioMixer, Engine, MixerPort
+
+
+@implementer(IObserver)
+class EngineObserver(object):
+    def __init__(self):
+        self.started = Event()
+        self.failed = False
+
+    def handle_notification(self, notification):
+        self.failed = notification.name == 'SIPEngineDidFail'
+        self.started.set()
+
+
+@implementer(IAudioPort)
+class Participant(object):
+    """Stands in for the audio stream of a call, which is both a producer and a consumer"""
+
+    def __init__(self, mixer):
+        self.mixer = mixer
+        self.port = MixerPort(mixer)
+        self.port.start()
+
+    @property
+    def consumer_slot(self):
+        return self.port.slot
+
+    @property
+    def producer_slot(self):
+        return self.port.slot
+
+
+def measure(mixer, bridge_class, count, duration):
+    participants = [Participant(mixer) for i in range(count)]
+    bridge = bridge_class(mixer)
+    for participant in participants:
+        bridge.add(participant)
+    connections = len(mixer.connected_slots)
+    sleep(1)
+    start = process_time()
+    sleep(duration)
+    cpu = (process_time() - start) / duration
+    for participant in participants:
+        bridge.remove(participant)
+        participant.port.stop()
+    return connections, cpu
+
+
+def main(duration=5):
+    observer = EngineObserver()
+    engine = Engine()
+    notification_center = NotificationCenter()
+    notification_center.add_observer(observer, name='SIPEngineDidStart', sender=engine)
+    notification_center.add_observer(observer, name='SIPEngineDidFail', sender=engine)
+    engine.start(udp_port=0, tcp_port=None, tls_port=None)
+    try:
+        observer.started.wait()
+        if observer.failed:
+            raise SystemExit('The SIP engine failed to start')
+        # without input and output devices the mixer is clocked by a null port
+        mixer = AudioMixer(None, None, 16000, 0, 254)
+        idle = measure(mixer, RootAudioBridge, 0, duration)[1]
+        print('idle mixer: %.1f%% CPU' % (idle * 100))
+        print('%12s  %16s  %11s  %6s' % ('participants', 'bridge', 'connections', 'CPU'))
+        for count in (10, 50, 200):
+            for bridge_class in (RootAudioBridge, ConferenceBridge):
+                connections, cpu = measure(mixer, bridge_class, count, duration)
+                print('%12d  %16s  %11d  %5.1f%%' % (count, bridge_class.__name__, connections, cpu * 100))
+        del mixer
+    finally:
+        engine.stop()
+        engine.join()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
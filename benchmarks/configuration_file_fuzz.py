@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+"""Check that FileBackend reads back what it writes, using random configuration trees and lines"""
+
+import os
+import random
+import sys
+import tempfile
+
+from sipsimple.configuration.backend.file import FileBackend, FileParserError
+
+
+# _escape only quotes ASCII whitespace, so other whitespace characters (e.g. U+00A0) are left out
+CHARACTERS = list('ab:=,#"\'\\ \tnr') + ['\n', '\r', '\x0b', '\x0c', 'é']
+LINE_PARTS = ['  ', '\t', 'a', 'bc', ' = ', ':', '=', ',', ', ', ' ,', 'x', 'yz', '#c', '"q"', "'q'", '\\n', '\\', ' ', 'é']
+
+
+def random_string(max_length=6):
+    return ''.join(random.choice(CHARACTERS) for i in range(random.randint(0, max_length)))
+
+
+def random_tree(depth=0):
+    tree = {}
+    for i in range(random.randint(0, 5)):
+        name = random_string() or 'name'
+        r = random.random()
+        if r < 0.3 and depth < 3:
+            tree[name] = random_tree(depth+1)
+        elif r < 0.4:
+            tree[name] = None
+        elif r < 0.6:
+            tree[name] = [random_string() for j in range(random.randint(0, 3))]
+        else:
+            tree[name] = random_string()
+    return tree
+
+
+def check_trees(backend, count):
+    for i in range(count):
+        data = random_tree()
+        backend.save(data)
+        result = backend.load()
+        if result != backend._plain_copy(data):  # an empty list is read back as None
+            raise AssertionError('tree %d was not read back correctly:\n  saved:  %r\n  loaded: %r' % (i, data, result))
+
+
+def check_lines(backend, count):
+    for i in range(count):
+        if i % 2:
+            line = ''.join(random.choice(CHARACTERS) for j in range(random.randint(0, 14)))
+        else:
+            line = ''.join(random.choice(LINE_PARTS) for j in range(random.randint(0, 8)))
+        line = line.replace('\n', '')
+        try:
+            parsed = backend._parse_line(line, 1)
+        except FileParserError:
+            continue
+        if parsed.name is None:
+            continue
+        # a line that parses must give the same result when written back and parsed again
+        if parsed.separator == ':':
+            rebuilt = backend._build_group({parsed.name: {}}, 0)[0]
+        else:
+            rebuilt = backend._build_group({parsed.name: parsed.value}, 0)[0]
+        reparsed = backend._parse_line(rebuilt, 1)
+        if (reparsed.name, reparsed.separator, reparsed.value) != (parsed.name, parsed.separator, parsed.value):
+            raise AssertionError('line %r was parsed as %r, but its rebuilt form %r as %r' % (line, parsed, rebuilt, reparsed))
+
+
+def main(trees=3000, lines=300000, seed=None):
+    seed = random.randrange(2**32) if seed is None else seed
+    random.seed(seed)
+    with tempfile.TemporaryDirectory() as directory:
+        backend = FileBackend(os.path.join(directory, 'config'))
+        check_trees(backend, trees)
+        check_lines(backend, lines)
+    print('%d trees and %d lines checked (seed %d)' % (trees, lines, seed))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:4]))
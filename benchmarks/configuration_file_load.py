@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""Measure how long FileBackend takes to load the configuration at startup, for a growing number of accounts"""
+
+import os
+import sys
+import tempfile
+
+from time import perf_counter
+
+from sipsimple.configuration.backend.file import FileBackend
+
+
+def account(index):
+    return {
+        'enabled': 'true',
+        'display_name': 'User %d' % index,
+        'auth': {'username': 'user%d' % index, 'password': 'secret "%d"' % index},
+        'sip': {'outbound_proxy': 'sip:proxy.example.com:5061;transport=tls', 'register': 'true', 'register_interval': '3600',
+                'always_use_my_proxy': 'false', 'publish_interval': '3600', 'subscribe_interval': '3600'},
+        'rtp': {'audio_codec_list': ['opus', 'G722', 'speex', 'PCMA', 'PCMU'], 'video_codec_list': ['H264', 'VP8'],
+                'encryption': {'enabled': 'true', 'key_negotiation': 'opportunistic'}},
+        'nat_traversal': {'use_ice': 'false', 'stun_server_list': None, 'msrp_relay': None, 'use_msrp_relay_for_outbound': 'false'},
+        'presence': {'enabled': 'true', 'disable_timezone': 'false'},
+        'xcap': {'enabled': 'true', 'discovered': 'false', 'xcap_root': 'https://xcap.example.com/xcap-root@example.com/'},
+        'message_summary': {'enabled': 'true', 'voicemail_uri': None},
+        'pstn': {'dial_plan': '# ^00 => +', 'prefix': None, 'strip_digits': '0'},
+        'sounds': {'audio_inbound': {'path': '/usr/share/sounds/ring "%d".wav' % index, 'volume': '100'}},
+    }
+
+
+def configuration(accounts):
+    return {
+        'Accounts': {'user%d@example.com' % index: account(index) for index in range(accounts)},
+        'SIPSimpleSettings': {'user_agent': 'sipsimple', 'audio': {'input_device': 'system_default', 'output_device': 'system_default'},
+                              'sip': {'transport_list': ['tls', 'tcp', 'udp'], 'udp_port': '0', 'tcp_port': '0'}},
+    }
+
+
+def measure(backend, repeat):
+    best = None
+    for i in range(repeat):
+        start = perf_counter()
+        backend.load()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(repeat=5):
+    print('%8s  %8s  %10s  %12s' % ('accounts', 'lines', 'text (ms)', 'snapshot (ms)'))
+    with tempfile.TemporaryDirectory() as directory:
+        for accounts in (1, 10, 100, 1000):
+            filename = os.path.join(directory, 'config-%d' % accounts)
+            backend = FileBackend(filename)
+            backend.save(configuration(accounts))
+            with open(filename, 'rb') as file:
+                lines = file.read().count(b'\n')
+            snapshot_backend = FileBackend(filename, snapshot=True)
+            snapshot_backend.load()  # write the snapshot
+            print('%8d  %8d  %10.2f  %12.2f' % (accounts, lines, measure(backend, repeat)*1000, measure(snapshot_backend, repeat)*1000))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+"""
+Check that JournalBackend recovers from a crash while appending to the journal:
+after each save the journal is truncated in the middle of the new record, and
+loading must give the data from before that save, while saving again must not
+be affected by the incomplete record.
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from sipsimple.configuration.backend.journal import JournalBackend
+
+
+VALUES = ['a', 'b c', 'x"y', 'é', '', 'q\\n', 'it\'s', 'a,b']
+
+
+def random_account():
+    return {'display_name': random.choice(VALUES), 'codecs': random.sample(VALUES, random.randint(1, 3)), 'proxy': None,
+            'sip': {'register': random.choice(['true', 'false']), 'interval': str(random.randint(60, 3600))}}
+
+
+def change(data):
+    name = 'account%d' % random.randint(0, 20)
+    accounts = data.setdefault('Accounts', {})
+    if name in accounts and random.random() < 0.3:
+        del accounts[name]
+    elif name in accounts and random.random() < 0.5:
+        accounts[name]['sip']['interval'] = str(random.randint(60, 3600))
+        return ('Accounts', name, 'sip', 'interval')
+    else:
+        accounts[name] = random_account()
+    return ('Accounts', name)
+
+
+def crash_copy(directory, filename, journal_size):
+    """Copy the configuration, keeping journal_size bytes of the journal as if the process died while writing it"""
+    copy = os.path.join(directory, 'crash', 'config')
+    shutil.rmtree(os.path.dirname(copy), ignore_errors=True)
+    os.makedirs(os.path.dirname(copy))
+    if os.path.exists(filename):
+        shutil.copyfile(filename, copy)
+    with open(filename + '.journal', 'rb') as source, open(copy + '.journal', 'wb') as destination:
+        destination.write(source.read(journal_size))
+    return copy
+
+
+def main(saves=500, seed=None):
+    seed = random.randrange(2**32) if seed is None else seed
+    random.seed(seed)
+    checked = 0
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'config')
+        backend = JournalBackend(filename, compaction_size=4096)
+        data = {}
+        for i in range(saves):
+            before = JournalBackend(filename).load()
+            journal_size = os.path.getsize(filename + '.journal') if os.path.exists(filename + '.journal') else 0
+            key = change(data)
+            backend.save_changes(data, [key])
+            after = JournalBackend(filename).load()
+            if not os.path.exists(filename + '.journal') or os.path.getsize(filename + '.journal') <= journal_size:
+                continue  # the journal was compacted into a new snapshot
+            new_size = os.path.getsize(filename + '.journal')
+            copy = crash_copy(directory, filename, random.randint(journal_size + 1, new_size - 1))
+            crashed = JournalBackend(copy)
+            result = crashed.load()
+            if result != before:
+                raise AssertionError('save %d: an incomplete record changed the data:\n  expected: %r\n  loaded:   %r' % (i, before, result))
+            # the next save must not be appended to the incomplete record
+            crashed.save_changes(data, [key])
+            result = JournalBackend(copy).load()
+            if result != after:
+                raise AssertionError('save %d: saving after a crash gave:\n  expected: %r\n  loaded:   %r' % (i, after, result))
+            checked += 1
+    print('%d saves, %d of them interrupted (seed %d)' % (saves, checked, seed))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
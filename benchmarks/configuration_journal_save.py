@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+"""Compare the time taken to save a single modified setting with FileBackend and JournalBackend, for a growing number of accounts"""
+
+import os
+import random
+import sys
+import tempfile
+
+from time import perf_counter
+
+from sipsimple.configuration.backend.file import FileBackend
+from sipsimple.configuration.backend.journal import JournalBackend
+
+from configuration_file_load import configuration
+
+
+def modify(data, accounts):
+    name = 'user%d@example.com' % random.randrange(accounts)
+    data['Accounts'][name]['sip']['register_interval'] = str(random.randint(60, 3600))
+    return ('Accounts', name, 'sip', 'register_interval')
+
+
+def measure_file(filename, data, accounts, saves):
+    backend = FileBackend(filename)
+    backend.save(data)
+    start = perf_counter()
+    for i in range(saves):
+        modify(data, accounts)
+        backend.save(data)
+    return (perf_counter() - start) / saves
+
+
+def measure_journal(filename, data, accounts, saves):
+    backend = JournalBackend(filename)
+    backend.save(data)
+    start = perf_counter()
+    for i in range(saves):
+        key = modify(data, accounts)
+        backend.save_changes(data, [key])
+    return (perf_counter() - start) / saves
+
+
+def main(saves=200):
+    random.seed(0)
+    print('%8s  %13s  %16s' % ('accounts', 'file (ms)', 'journal (ms)'))
+    with tempfile.TemporaryDirectory() as directory:
+        for accounts in (1, 10, 100, 1000):
+            data = configuration(accounts)
+            file_time = measure_file(os.path.join(directory, 'file-%d' % accounts), data, accounts, saves)
+            journal_time = measure_journal(os.path.join(directory, 'journal-%d' % accounts), data, accounts, saves)
+            print('%8d  %13.3f  %16.3f' % (accounts, file_time * 1000, journal_time * 1000))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+"""Compare the cost of eager and lazy conversion of the headers of a received SIP message"""
+
+import sys
+
+from threading import Event
+
+from application.notification import IObserver, NotificationCenter
+from zope.interface import implementer
+
+from sipsimple.core import Engine
+from sipsimple.core._core import _time_message_headers
+
+
+MESSAGE = '\r\n'.join([
+    'SIP/2.0 200 OK',
+    'Via: SIP/2.0/UDP 10.0.0.1:5060;branch=z9hG4bK776asdhds;received=192.0.2.1;rport=5060',
+    'Via: SIP/2.0/UDP 10.0.0.2:5060;branch=z9hG4bKnashds8',
+    'Via: SIP/2.0/TLS 10.0.0.3:5061;branch=z9hG4bK74bf9',
+    'Record-Route: <sip:proxy1.example.com;lr>',
+    'Record-Route: <sip:proxy2.example.com;lr>',
+    'From: "Alice" <sip:alice@example.com>;tag=1928301774',
+    'To: "Bob" <sip:bob@example.com>;tag=a6c85cf',
+    'Call-ID: a84b4c76e66710@pc33.example.com',
+    'CSeq: 314159 INVITE',
+    'Contact: <sip:bob@192.0.2.4:5060;transport=udp>;expires=3600',
+    'Expires: 3600',
+    'Allow: INVITE, ACK, CANCEL, OPTIONS, BYE, REFER, NOTIFY, MESSAGE, SUBSCRIBE, INFO',
+    'Supported: replaces, norefersub, gruu',
+    'Server: Example/1.0',
+    'Content-Length: 0',
+    '', '']).encode()
+
+
+@implementer(IObserver)
+class EngineObserver(object):
+    def __init__(self):
+        self.started = Event()
+        self.failed = False
+
+    def handle_notification(self, notification):
+        self.failed = notification.name == 'SIPEngineDidFail'
+        self.started.set()
+
+
+def main(iterations=10000):
+    observer = EngineObserver()
+    engine = Engine()
+    notification_center = NotificationCenter()
+    notification_center.add_observer(observer, name='SIPEngineDidStart', sender=engine)
+    notification_center.add_observer(observer, name='SIPEngineDidFail', sender=engine)
+    engine.start(udp_port=0, tcp_port=None, tls_port=None)
+    try:
+        observer.started.wait()
+        if observer.failed:
+            raise SystemExit('The SIP engine failed to start')
+        results = _time_message_headers(MESSAGE, iterations, ('Contact', 'To', 'Expires'))
+    finally:
+        engine.stop()
+        engine.join()
+    print('eager conversion of all headers:             %7.2f us/message' % (results['eager'] * 1e6))
+    print('copying the headers without converting:      %7.2f us/message' % (results['copy'] * 1e6))
+    print('lazy conversion of Contact, To and Expires:  %7.2f us/message' % (results['lazy'] * 1e6))
+    print('lazy conversion of all headers:              %7.2f us/message' % (results['lazy_all'] * 1e6))
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+"""
+Exercise RTPTransportPool with fake transports, DNS lookups and reactor, so
+that it can be run without the SIP core.
+"""
+
+import importlib.util
+import os
+import sys
+import types
+
+from application.notification import NotificationCenter, NotificationData
+
+import sipsimple
+
+
+class Settings(object):
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+
+settings = Settings(rtp=Settings(transport_pool_size=2, transport_pool_max_age=60, port_range=None))
+
+
+class Account(object):
+    def __init__(self, domain, use_ice, key_negotiation):
+        self.enabled = True
+        self.id = Settings(domain=domain)
+        self.nat_traversal = Settings(use_ice=use_ice, stun_server_list=[])
+        self.rtp = Settings(encryption=Settings(enabled=key_negotiation is not None, key_negotiation=key_negotiation))
+
+
+class BonjourAccount(object):
+    pass
+
+
+class AccountManager(object):
+    accounts = []
+
+    def iter_accounts(self):
+        return iter(self.accounts)
+
+
+class SIPCoreError(Exception):
+    pass
+
+
+class RTPTransport(object):
+    created = []
+
+    def __init__(self, encryption=None, use_ice=False, ice_stun_address=None, ice_stun_port=None):
+        self.args = encryption, use_ice, ice_stun_address, ice_stun_port
+        self.state = 'NULL'
+        self.created.append(self)
+
+    def __repr__(self):
+        return 'RTPTransport%r' % (self.args,)
+
+    def set_INIT(self):
+        self.state = 'WAIT_STUN' if self.args[1] else 'INIT'
+
+
+class DNSLookup(object):
+    lookups = []
+
+    def lookup_service(self, uri, service):
+        self.lookups.append(self)
+
+
+class DelayedCall(object):
+    def __init__(self, delay, function, args):
+        self.delay = delay
+        self.function = function
+        self.args = args
+        self.cancelled = False
+
+    def active(self):
+        return not self.cancelled
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Reactor(object):
+    def __init__(self):
+        self.calls = []
+
+    def callLater(self, delay, function, *args):
+        call = DelayedCall(delay, function, args)
+        self.calls.append(call)
+        return call
+
+    def run_pending(self):
+        calls, self.calls = [call for call in self.calls if call.delay == 0 and not call.cancelled], [call for call in self.calls if call.delay != 0]
+        for call in calls:
+            call.function(*call.args)
+
+
+class Clock(object):
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def module(name, **attributes):
+    result = types.ModuleType(name)
+    result.__dict__.update(attributes)
+    sys.modules[name] = result
+    return result
+
+
+def load_pool():
+    # RTPTransportPool is loaded on its own, as the sipsimple.streams package needs the SIP core
+    module('sipsimple.account', Account=Account, AccountManager=AccountManager, BonjourAccount=BonjourAccount)
+    module('sipsimple.configuration.settings', SIPSimpleSettings=lambda: settings)
+    module('sipsimple.core', RTPTransport=RTPTransport, SIPCoreError=SIPCoreError, SIPURI=lambda host: host)
+    module('sipsimple.lookup', DNSLookup=DNSLookup)
+    module('sipsimple.threading', call_in_twisted_thread=lambda function, *args, **kw: function(*args, **kw), run_in_twisted_thread=lambda function: function)
+    filename = os.path.join(os.path.dirname(sipsimple.__file__), 'streams', 'rtp', 'pool.py')
+    spec = importlib.util.spec_from_file_location('sipsimple.streams.rtp.pool', filename)
+    pool = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(pool)
+    pool.reactor = Reactor()
+    pool.monotonic = Clock()
+    return pool
+
+
+def post(name, sender, **data):
+    NotificationCenter().post_notification(name, sender=sender, data=NotificationData(**data))
+
+
+def main():
+    pool_module = load_pool()
+    reactor = pool_module.reactor
+    clock = pool_module.monotonic
+    ice_account = Account('example.com', use_ice=True, key_negotiation='opportunistic')
+    plain_account = Account('example.org', use_ice=False, key_negotiation=None)
+    AccountManager.accounts = [ice_account]
+    ice_key = 'zrtp', True, 'example.com'
+
+    pool = pool_module.RTPTransportPool()
+    pool.start()
+    pool.start()
+    assert len(DNSLookup.lookups) == 1 and not RTPTransport.created, 'the pool did not look up the STUN servers once'
+
+    # the STUN servers are tried in order
+    post('DNSLookupDidSucceed', DNSLookup.lookups[0], result=[('stun1', 3478), ('stun2', 3478)])
+    assert [transport.args for transport in RTPTransport.created] == [('zrtp', True, b'stun1', 3478)] * 2
+    post('RTPTransportDidFail', RTPTransport.created[0], reason='failed')
+    assert RTPTransport.created[2].args == ('zrtp', True, b'stun2', 3478), 'the next STUN server was not tried'
+    for transport in RTPTransport.created[1:]:
+        transport.state = 'INIT'
+        post('RTPTransportDidInitialize', transport)
+    assert len(pool._transports[ice_key]) == 2
+
+    # get does not create transports, the refill runs on a later reactor iteration
+    transport = pool.get(ice_account, 'zrtp', True)
+    assert transport is RTPTransport.created[1]
+    assert len(DNSLookup.lookups) == 1, 'get created the replacement inline'
+    reactor.run_pending()
+    assert len(DNSLookup.lookups) == 2, 'the pool was not refilled'
+
+    # combinations are learned from the streams that ask for them
+    count = len(RTPTransport.created)
+    assert pool.get(plain_account, 'sdes_optional', False) is None
+    assert len(RTPTransport.created) == count
+    reactor.run_pending()
+    assert [transport.args for transport in RTPTransport.created[count:]] == [('sdes_optional', False, None, None)] * 2
+
+    # transports are replaced at 3/4 of the maximum age and discarded at the maximum age
+    clock.now = 50
+    pool._maintain()
+    assert len(DNSLookup.lookups) == 3, 'aging transports were not replaced'
+    clock.now = 61
+    pool._discard_expired()
+    assert not pool._transports[ice_key], 'expired transports were kept'
+
+    # a network change discards everything, including pending work
+    pending = set(pool._lookups) | set(pool._pending)
+    post('NetworkConditionsDidChange', None)
+    assert not pending & (set(pool._lookups) | set(pool._pending)) and not any(pool._transports.values())
+
+    # the pool can be restarted after it was stopped
+    pool.stop()
+    assert pool.get(ice_account, 'zrtp', True) is None
+    lookups = len(DNSLookup.lookups)
+    pool.start()
+    assert pool.state == 'started' and len(DNSLookup.lookups) == lookups + 1, 'the pool was not restarted'
+    pool.stop()
+    print('ok')
+
+
+if __name__ == '__main__':
+    main()
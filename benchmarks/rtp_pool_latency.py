@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+"""
+Measure the time from the start of RTP stream initialization to a ready local
+SDP, with and without a pre-initialized RTP transport from the pool.
+
+This follows the two paths of RTPStream.initialize: without the pool, an
+RTPTransport is created and initialized, and the stream waits for the
+RTPTransportDidInitialize notification; with the pool, this was done ahead
+of time. In both cases, the AudioTransport is then created and the local
+SDP media built, which is what is needed to answer or send the INVITE.
+"""
+
+import sys
+
+from threading import Event
+from time import perf_counter
+
+from application.notification import IObserver, NotificationCenter
+from zope.interface import implementer
+
+from sipsimple.core import AudioMixer, AudioTransport, Engine, RTPTransport
+
+
+@implementer(IObserver)
+class Observer(object):
+    def __init__(self):
+        self.event = Event()
+        self.failed = False
+
+    def handle_notification(self, notification):
+        self.failed = notification.name in ('SIPEngineDidFail', 'RTPTransportDidFail')
+        self.event.set()
+
+    def wait(self):
+        self.event.wait()
+        self.event.clear()
+        if self.failed:
+            raise SystemExit('failed to initialize')
+
+
+def initialize_transport(encryption, use_ice):
+    observer = Observer()
+    transport = RTPTransport(encryption=encryption, use_ice=use_ice)
+    notification_center = NotificationCenter()
+    notification_center.add_observer(observer, name='RTPTransportDidInitialize', sender=transport)
+    notification_center.add_observer(observer, name='RTPTransportDidFail', sender=transport)
+    transport.set_INIT()
+    observer.wait()
+    notification_center.remove_observer(observer, name='RTPTransportDidInitialize', sender=transport)
+    notification_center.remove_observer(observer, name='RTPTransportDidFail', sender=transport)
+    return transport
+
+
+def local_media(mixer, transport):
+    audio_transport = AudioTransport(mixer, transport, codecs=[b'opus', b'G722', b'PCMU', b'PCMA'])
+    return audio_transport, audio_transport.get_local_media(None, 0, b'sendrecv')
+
+
+def measure(mixer, encryption, use_ice, repeat):
+    cold = pooled = 0
+    for i in range(repeat):
+        start = perf_counter()
+        transport = initialize_transport(encryption, use_ice)
+        result = local_media(mixer, transport)
+        cold += perf_counter() - start
+        del result, transport
+
+        transport = initialize_transport(encryption, use_ice)  # done by the pool ahead of time
+        start = perf_counter()
+        result = local_media(mixer, transport)
+        pooled += perf_counter() - start
+        del result, transport
+    return cold / repeat, pooled / repeat
+
+
+def main(repeat=50):
+    observer = Observer()
+    engine = Engine()
+    notification_center = NotificationCenter()
+    notification_center.add_observer(observer, name='SIPEngineDidStart', sender=engine)
+    notification_center.add_observer(observer, name='SIPEngineDidFail', sender=engine)
+    engine.start(udp_port=0, tcp_port=None, tls_port=None)
+    try:
+        observer.wait()
+        mixer = AudioMixer(None, None, 16000, 0)
+        print('%15s  %5s  %13s  %11s' % ('encryption', 'ICE', 'no pool (ms)', 'pooled (ms)'))
+        for encryption in (None, 'sdes_optional', 'zrtp'):
+            for use_ice in (False, True):
+                cold, pooled = measure(mixer, encryption, use_ice, repeat)
+                print('%15s  %5s  %13.2f  %11.2f' % (encryption, use_ice, cold * 1000, pooled * 1000))
+        del mixer
+    finally:
+        engine.stop()
+        engine.join()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+"""Fill the RTP port range with transports and measure how long allocating a port pair takes"""
+
+import sys
+
+from threading import Event
+from time import perf_counter, sleep
+
+from application.notification import IObserver, NotificationCenter
+from zope.interface import implementer
+
+from sipsimple.core import Engine, RTPTransport, SIPCoreError
+
+
+@implementer(IObserver)
+class EngineObserver(object):
+    def __init__(self):
+        self.started = Event()
+        self.failed = False
+
+    def handle_notification(self, notification):
+        self.failed = notification.name == 'SIPEngineDidFail'
+        self.started.set()
+
+
+def fill(count):
+    transports = []
+    elapsed = 0
+    for i in range(count):
+        transport = RTPTransport()
+        start = perf_counter()
+        try:
+            transport.set_INIT()
+        except SIPCoreError:
+            break
+        elapsed += perf_counter() - start
+        transports.append(transport)
+    return transports, elapsed
+
+
+def main(pairs=5000, quarantine=2):
+    observer = EngineObserver()
+    engine = Engine()
+    notification_center = NotificationCenter()
+    notification_center.add_observer(observer, name='SIPEngineDidStart', sender=engine)
+    notification_center.add_observer(observer, name='SIPEngineDidFail', sender=engine)
+    engine.start(udp_port=0, tcp_port=None, tls_port=None, rtp_port_range=(40000, 40000 + 2*pairs), rtp_port_quarantine=quarantine)
+    try:
+        observer.started.wait()
+        if observer.failed:
+            raise SystemExit('The SIP engine failed to start')
+
+        transports, elapsed = fill(pairs)
+        statistics = engine.rtp_port_statistics
+        ports = [transport.local_rtp_port for transport in transports]
+        print('filled %d of %d pairs in %.1f us per transport (%d bind failures)' % (len(transports), pairs, elapsed / max(len(transports), 1) * 1e6, statistics['bind_failures']))
+        assert len(set(ports)) == len(ports), 'a port was allocated twice'
+        assert all(port % 2 == 0 for port in ports), 'an odd port was allocated'
+        assert statistics['used'] == len(transports), statistics
+
+        # with the range full, the quarantined pairs are the only ones that can be used
+        released = set(ports[::50])
+        transports = [transport for transport in transports if transport.local_rtp_port not in released]
+        statistics = engine.rtp_port_statistics
+        assert statistics['quarantined'] >= len(released), statistics
+        reused, elapsed = fill(len(released))
+        assert {transport.local_rtp_port for transport in reused} <= released, 'a pair was allocated twice'
+        print('reused %d quarantined pairs in %.1f us per transport' % (len(reused), elapsed / max(len(reused), 1) * 1e6))
+
+        # once the quarantine expired, a released pair is not used again while other pairs are free
+        del reused
+        sleep(quarantine + 0.1)
+        statistics = engine.rtp_port_statistics
+        assert statistics['quarantined'] == 0 and statistics['free'] >= len(released), statistics
+        port = transports.pop().local_rtp_port
+        extra, elapsed = fill(1)
+        assert extra and extra[0].local_rtp_port != port, 'a quarantined pair was used while other pairs were free'
+        print(engine.rtp_port_statistics)
+        del extra
+        del transports
+    finally:
+        engine.stop()
+        engine.join()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
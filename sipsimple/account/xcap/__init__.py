@@ -14,15 +14,18 @@ import gevent
 
 from io import StringIO
 from collections import OrderedDict
+from copy import deepcopy
 from datetime import datetime
 from itertools import chain
 from operator import attrgetter
 from urllib.error import URLError
+from xml.sax.saxutils import escape, quoteattr
 
 from application.notification import IObserver, NotificationCenter, NotificationData
 from application.python import Null
 from eventlib import api, coros, proc
 from eventlib.green.httplib import BadStatusLine
+from lxml import etree
 from twisted.internet.error import ConnectionLost
 from xcaplib.client import XCAPClient
 from xcaplib.error import HTTPError
@@ -30,6 +33,7 @@ from zope.interface import implementer
 
 from sipsimple import log
 from sipsimple.account.subscription import Subscriber, Content
+from sipsimple.account.xcap.patch import PatchError, apply_patch, apply_element_change, apply_attribute_change
 from sipsimple.account.xcap.storage import IXCAPStorage, XCAPStorageError
 from sipsimple.configuration.datatypes import SIPAddress
 from sipsimple.configuration.settings import SIPSimpleSettings
@@ -46,6 +50,53 @@ class XCAPError(Exception): pass
 class FetchRequiredError(XCAPError): pass
 
 
+class NodeSelector(object):
+    """
+    Selects an element or an attribute of an XCAP document. The steps lead
+    from the root element to the selected element and are either element
+    classes or (element class, id) tuples, the latter matching the element
+    by the value of its XMLElementID attribute.
+    """
+
+    def __init__(self, document, steps, attribute=None):
+        prefixes = dict((namespace, prefix) for prefix, namespace in document.payload_type.nsmap.items())
+        namespaces = {}
+        path_components = []
+        xpath_components = []
+        self.variables = {}
+        for index, step in enumerate(chain([document.payload_type.root_element], steps)):
+            cls, id = step if isinstance(step, tuple) else (step, None)
+            prefix = prefixes[cls._xml_namespace]
+            namespaces[prefix] = cls._xml_namespace
+            path_component = cls._xml_tag if cls._xml_namespace == document.default_namespace else '%s:%s' % (prefix, cls._xml_tag)
+            xpath_component = '%s:%s' % (prefix, cls._xml_tag)
+            if id is not None:
+                variable = 'id%d' % index
+                path_component += '[@%s=%s]' % (cls._xml_id.xmlname, quoteattr(id))
+                xpath_component += '[@%s=$%s]' % (cls._xml_id.xmlname, variable)
+                self.variables[variable] = id
+            path_components.append(path_component)
+            xpath_components.append(xpath_component)
+        if attribute is not None:
+            path_components.append('@' + attribute)
+            xpath_components.append('@' + attribute)
+        self.attribute = attribute
+        self.path = '/' + '/'.join(path_components)
+        self.xpath = '/' + '/'.join(xpath_components)
+        self.namespaces = namespaces
+        selector_namespaces = sorted((prefix, namespace) for prefix, namespace in namespaces.items() if namespace != document.default_namespace)
+        self.node = self.path + ('?' + ''.join('xmlns(%s=%s)' % item for item in selector_namespaces) if selector_namespaces else '')
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.node)
+
+    def contains(self, other):
+        return other.path.startswith(self.path + '/')
+
+    def select(self, element):
+        return element.xpath(self.xpath, namespaces=self.namespaces, **self.variables)
+
+
 class Document(object):
     name               = None
     application        = None
@@ -54,11 +105,14 @@ class Document(object):
     global_tree        = None
     filename           = None
     cached             = True
+    partial_updates    = False
+    max_node_updates   = 10
 
     def __init__(self, manager):
         self.manager = weakref.proxy(manager)
         self.content = None
         self.etag = None
+        self.changes = []
         self.fetch_time = datetime.fromtimestamp(0)
         self.update_time = datetime.fromtimestamp(0)
         self.dirty = False
@@ -98,6 +152,7 @@ class Document(object):
             self.etag = None
             self.content = None
             self.dirty = False
+        self.changes = []
         self.fetch_time = datetime.utcnow()
 
     def initialize(self, server_caps):
@@ -113,8 +168,25 @@ class Document(object):
                 pass
         self.content = None
         self.etag = None
+        self.changes = []
         self.dirty = False
 
+    def record_change(self, *steps, attribute=None):
+        """
+        Record that the element selected by steps (or its attribute) has been
+        added, modified or removed, so that the document can be updated on the
+        server using XCAP element and attribute requests.
+        """
+        if not self.partial_updates or self.changes is None:
+            return
+        self.changes.append(NodeSelector(self, steps, attribute))
+        if len(self.changes) > 10 * self.max_node_updates:
+            self.changes = None
+
+    def require_full_update(self):
+        """Make the next update replace the whole document on the server"""
+        self.changes = None
+
     def fetch(self):
         notification_center = NotificationCenter()
 
@@ -124,6 +196,7 @@ class Document(object):
             document = self.manager.client.get(self.application, etagnot=self.etag, globaltree=self.global_tree, headers={'Accept': self.payload_type.content_type}, filename=self.filename)
             self.content = self.payload_type.parse(document)
             self.etag = document.etag
+            self.changes = []
             self.__dict__['dirty'] = False
         except (BadStatusLine, ConnectionLost, URLError, TimeoutError, socket.error) as e:
             notification_data = NotificationData(method='GET', url=self.url, application=self.application, result='failure', reason=str(e), code=408, etag=self.etag)
@@ -163,6 +236,57 @@ class Document(object):
                     notification_data = NotificationData(method='GET', url=self.url, application=self.application, result='failed', reason='storage failure: %s' % str(e), code=500, etag=self.etag, size=len(document))
                     notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
 
+    def patch(self, document_diff, node_diffs):
+        """
+        Apply the changes notified by a xcap-diff document entry (XML patch
+        operations or body-not-changed) and by the xcap-diff element and
+        attribute entries for this document to the current content, instead
+        of fetching it again. Returns False if the changes cannot be applied,
+        in which case the document needs to be fetched.
+        """
+        if self.content is None or self.dirty or self.etag is None or document_diff.new_etag is None or document_diff.previous_etag != self.etag:
+            return False
+        operation_tags = {'{%s}%s' % (xcapdiff.namespace, name) for name in ('add', 'replace', 'remove')}
+        operations = [child for child in document_diff.element if child.tag in operation_tags]
+        if not operations and not node_diffs and not document_diff.empty_body:
+            return False
+
+        notification_center = NotificationCenter()
+        root = deepcopy(self.content.element)
+        try:
+            apply_patch(root, operations)
+            for diff in node_diffs:
+                if isinstance(diff, xcapdiff.Element):
+                    content = next((child for child in diff.element if isinstance(child.tag, str)), None)
+                    apply_element_change(root, diff.selector.node, diff.element.nsmap, self.default_namespace, diff.exists, content)
+                else:
+                    apply_attribute_change(root, diff.selector.node, diff.element.nsmap, self.default_namespace, diff.exists, diff.element.text)
+            etree.cleanup_namespaces(root)
+            if self.payload_type.schema is not None:
+                self.payload_type.schema.assertValid(root)
+            content = self.payload_type.root_element.from_element(root, xml_document=self.payload_type)
+        except (PatchError, ParserError, etree.DocumentInvalid) as e:
+            notification_data = NotificationData(method='PATCH', url=self.url, application=self.application, result='failure', reason=str(e), code=500, etag=self.etag)
+            notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
+            return False
+
+        self.content = content
+        self.etag = document_diff.new_etag
+        self.changes = []
+        self.__dict__['dirty'] = False
+        self.fetch_time = datetime.utcnow()
+        data = etree.tostring(root, encoding=self.payload_type.encoding, xml_declaration=True)
+        notification_data = NotificationData(method='PATCH', url=self.url, application=self.application, result='success', reason='changed', code=200, etag=self.etag, size=len(data))
+        notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
+
+        if self.cached:
+            try:
+                self.manager.storage.save(self.name, self.etag + os.linesep + data.decode())
+            except XCAPStorageError as e:
+                notification_data = NotificationData(method='PATCH', url=self.url, application=self.application, result='failed', reason='storage failure: %s' % str(e), code=500, etag=self.etag, size=len(data))
+                notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
+        return True
+
     def update(self):
         if not self.dirty:
             return
@@ -171,13 +295,37 @@ class Document(object):
         data = self.content.toxml() if self.content is not None else None
         method = 'PUT' if data is not None else 'DELETE'
 
+        if data is None or not self.partial_updates or not self.changes or self.etag is None or self.__dict__['dirty']:
+            self._update_document(data)
+        elif not self._update_nodes():
+            self._update_document(data)
+
+        self.changes = []
+        self.dirty = False
+        self.update_time = datetime.utcnow()
+        if self.cached:
+            try:
+                if data is not None:
+                    document = self.etag + os.linesep
+                    document += data.decode() if isinstance(data, bytes) else data
+                    self.manager.storage.save(self.name, document)
+                else:
+                    self.manager.storage.delete(self.name)
+            except XCAPStorageError as e:
+                notification_data = NotificationData(method=method, url=self.url, application=self.application, result='failed', reason='storage failure: %s' % str(e), code=500, etag=self.etag, size=len(data))
+                notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
+
+    def _update_document(self, data):
+        notification_center = NotificationCenter()
+        method = 'PUT' if data is not None else 'DELETE'
+
         try:
             kw = dict(etag=self.etag) if self.etag is not None else dict(etagnot='*')
             if data is not None:
                 response = self.manager.client.put(self.application, data, globaltree=self.global_tree, filename=self.filename, headers={'Content-Type': self.payload_type.content_type}, **kw)
             else:
                 response = self.manager.client.delete(self.application, data, globaltree=self.global_tree, filename=self.filename, **kw)
-        except (BadStatusLine, ConnectionLost, URLError) as e:
+        except (BadStatusLine, ConnectionLost, URLError, TimeoutError, socket.error) as e:
             notification_data = NotificationData(method=method, url=self.url, application=self.application, result='failure', reason=str(e), code=408, etag=self.etag)
             notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
             raise XCAPError("failed to update %s document: %s" % (self.name, e))
@@ -198,19 +346,65 @@ class Document(object):
         notification_data = NotificationData(method=method, url=self.url, application=self.application, result='success', reason='changed', code=200, etag=self.etag, size=len(data) if data else 0)
         notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
 
-        self.dirty = False
-        self.update_time = datetime.utcnow()
-        if self.cached:
+    def _update_nodes(self):
+        """
+        Send the recorded changes to the server as XCAP element and attribute
+        PUT and DELETE requests. The content of the nodes is taken from the
+        current document (which must have been built already), so a node that
+        was added and then modified is only sent once and one that no longer
+        exists is deleted. Returns False if the document has to be replaced
+        as a whole instead, which is also the case if the server rejects any
+        of the requests with something else than 412 (Precondition Failed).
+        """
+        notification_center = NotificationCenter()
+
+        selectors = list(OrderedDict((selector.path, selector) for selector in self.changes).values())
+        selectors = [selector for selector in selectors if not any(other.contains(selector) for other in selectors)]
+        if len(selectors) > self.max_node_updates:
+            return False
+        requests = []
+        for selector in selectors:
+            nodes = selector.select(self.content.element)
+            if len(nodes) > 1:
+                return False
+            requests.append((selector, nodes[0] if nodes else None))
+        self.changes = selectors
+
+        for selector, node in requests:
+            url = self.manager.client.get_url(self.application, selector.node, globaltree=self.global_tree, filename=self.filename)
+            if node is None:
+                method, data, content_type = 'DELETE', None, None
+            elif selector.attribute is not None:
+                method, data, content_type = 'PUT', escape(node, {'"': '&quot;'}).encode('utf-8'), 'application/xcap-att+xml'
+            else:
+                method, data, content_type = 'PUT', etree.tostring(node, encoding='UTF-8', with_tail=False), 'application/xcap-el+xml'
             try:
                 if data is not None:
-                    document = self.etag + os.linesep
-                    document += data.decode() if isinstance(data, bytes) else data
-                    self.manager.storage.save(self.name, document)
+                    response = self.manager.client.put(self.application, data, node=selector.node, etag=self.etag, globaltree=self.global_tree, filename=self.filename, headers={'Content-Type': content_type})
                 else:
-                    self.manager.storage.delete(self.name)
-            except XCAPStorageError as e:
-                notification_data = NotificationData(method=method, url=self.url, application=self.application, result='failed', reason='storage failure: %s' % str(e), code=500, etag=self.etag, size=len(data))
+                    response = self.manager.client.delete(self.application, selector.node, etag=self.etag, globaltree=self.global_tree, filename=self.filename)
+            except (BadStatusLine, ConnectionLost, URLError, TimeoutError, socket.error) as e:
+                notification_data = NotificationData(method=method, url=url, application=self.application, result='failure', reason=str(e), code=408, etag=self.etag)
                 notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
+                raise XCAPError("failed to update %s document: %s" % (self.name, e))
+            except HTTPError as e:
+                if e.status == 412: # Precondition Failed
+                    notification_data = NotificationData(method=method, url=url, application=self.application, result='failure', reason='document modified by others', code=e.status, etag=self.etag)
+                    notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
+                    raise FetchRequiredError("document %s was modified externally" % self.name)
+                elif e.status == 404 and data is None: # the node didn't exist on the server either, so the document is unchanged
+                    notification_data = NotificationData(method=method, url=url, application=self.application, result='failure', reason='non-existent node', code=e.status, etag=self.etag)
+                    notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
+                else:
+                    notification_data = NotificationData(method=method, url=url, application=self.application, result='failure', reason=str(e), code=e.status, etag=self.etag)
+                    notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
+                    return False
+            else:
+                self.etag = response.etag
+                notification_data = NotificationData(method=method, url=url, application=self.application, result='success', reason='changed', code=200, etag=self.etag, size=len(data) if data else 0)
+                notification_center.post_notification('XCAPTrace', sender=self, data=notification_data)
+            self.changes.remove(selector)
+        return True
 
 
 class DialogRulesDocument(Document):
@@ -238,6 +432,10 @@ class ResourceListsDocument(Document):
     default_namespace  = resourcelists.namespace
     global_tree        = False
     filename           = 'index'
+    partial_updates    = True
+
+    def record_addressbook_change(self, *steps, attribute=None):
+        self.record_change((resourcelists.List, 'sipsimple_addressbook'), *steps, attribute=attribute)
 
     def update(self):
         if self.content is not None:
@@ -249,6 +447,7 @@ class ResourceListsDocument(Document):
 
             for group, missing_id in ((group, missing_id) for group in groups for missing_id in [id for id in group.contacts if id not in contacts]):
                 group.contacts.remove(missing_id)
+                self.record_addressbook_change((addressbook.Group, group.id), addressbook.ContactList)
 
             if any(item.__dirty__ for item in chain(contacts, policies)):
                 oma_grantedcontacts = self.content['oma_grantedcontacts']
@@ -284,21 +483,27 @@ class ResourceListsDocument(Document):
                 if allowed_presence_uris != set(entry.uri for entry in oma_grantedcontacts):
                     oma_grantedcontacts.clear()
                     oma_grantedcontacts.update(resourcelists.Entry(uri) for uri in allowed_presence_uris)
+                    self.record_change((resourcelists.List, 'oma_grantedcontacts'))
                 if blocked_presence_uris != set(entry.uri for entry in oma_blockedcontacts):
                     oma_blockedcontacts.clear()
                     oma_blockedcontacts.update(resourcelists.Entry(uri) for uri in blocked_presence_uris)
+                    self.record_change((resourcelists.List, 'oma_blockedcontacts'))
                 if allowed_dialog_uris != set(entry.uri for entry in dialog_grantedcontacts):
                     dialog_grantedcontacts.clear()
                     dialog_grantedcontacts.update(resourcelists.Entry(uri) for uri in allowed_dialog_uris)
+                    self.record_change((resourcelists.List, 'dialog_grantedcontacts'))
                 if blocked_dialog_uris != set(entry.uri for entry in dialog_blockedcontacts):
                     dialog_blockedcontacts.clear()
                     dialog_blockedcontacts.update(resourcelists.Entry(uri) for uri in blocked_dialog_uris)
+                    self.record_change((resourcelists.List, 'dialog_blockedcontacts'))
                 if subscribe_presence_uris != set(entry.uri for entry in sipsimple_presence_rls):
                     sipsimple_presence_rls.clear()
                     sipsimple_presence_rls.update(resourcelists.Entry(uri) for uri in subscribe_presence_uris)
+                    self.record_change((resourcelists.List, 'sipsimple_presence_rls'))
                 if subscribe_dialog_uris != set(entry.uri for entry in sipsimple_dialog_rls):
                     sipsimple_dialog_rls.clear()
                     sipsimple_dialog_rls.update(resourcelists.Entry(uri) for uri in subscribe_dialog_uris)
+                    self.record_change((resourcelists.List, 'sipsimple_dialog_rls'))
         super(ResourceListsDocument, self).update()
 
 
@@ -511,6 +716,19 @@ class Addressbook(object):
         equal = self.__eq__(other)
         return NotImplemented if equal is NotImplemented else not equal
 
+    def changes_since(self, previous):
+        """
+        Return the contacts, groups and policies that were added or modified
+        and the ones that were removed since the previous addressbook.
+        """
+        return NotificationData(previous=previous,
+                                contacts=[contact for contact in self.contacts if previous.contacts.get(contact.id) != contact],
+                                groups=[group for group in self.groups if previous.groups.get(group.id) != group],
+                                policies=[policy for policy in self.policies if previous.policies.get(policy.id) != policy],
+                                removed_contacts=[contact for contact in previous.contacts if contact.id not in self.contacts],
+                                removed_groups=[group for group in previous.groups if group.id not in self.groups],
+                                removed_policies=[policy for policy in previous.policies if policy.id not in self.policies])
+
     @classmethod
     def from_payload(cls, payload):
         def payload_to_contact(payload):
@@ -737,6 +955,7 @@ class XCAPManager(object):
         self.last_fetch_time = datetime.fromtimestamp(0)
         self.last_update_time = datetime.fromtimestamp(0)
         self.not_executed_fetch = None
+        self.addressbook = None
         self.state = 'stopped'
         self.timer = None
         self.transaction_level = 0
@@ -1095,6 +1314,26 @@ class XCAPManager(object):
             self.journal.insert(0, NormalizeOperation())
         self.command_channel.send(Command('update', command.event))
 
+    def _CH_patch(self, command):
+        if self.state != 'insync':
+            self.command_channel.send(Command('fetch', documents=set(command.diffs)))
+            return
+        patched_documents = set()
+        failed_documents = set()
+        for document in (doc for doc in self.documents if doc.name in command.diffs and doc.supported):
+            if document.patch(*command.diffs[document.name]):
+                patched_documents.add(document.name)
+            else:
+                failed_documents.add(document.name)
+        if failed_documents:
+            # use the timestamp of this command, so that the patched documents are reloaded even if nothing else changed
+            self.command_channel.send(Command('fetch', documents=failed_documents, timestamp=command.timestamp))
+        elif patched_documents:
+            self.state = 'updating'
+            if not self.journal or type(self.journal[0]) is not NormalizeOperation:
+                self.journal.insert(0, NormalizeOperation())
+            self.command_channel.send(Command('update'))
+
     def _CH_update(self, command):
         if self.state not in ('insync', 'updating'):
             return
@@ -1266,6 +1505,9 @@ class XCAPManager(object):
             sipsimple_dialog_rls.clear()
             sipsimple_dialog_rls.update(resourcelists.Entry(uri) for uri in subscribe_dialog_uris)
 
+        if self.resource_lists.dirty:
+            self.resource_lists.require_full_update()
+
         # Normalize rls-services
         #
         if self.rls_services.content is None:
@@ -1523,6 +1765,7 @@ class XCAPManager(object):
         xml_contact.uris.default = contact.uris.default
         xml_contact.attributes = addressbook.Contact.attributes.type(contact.attributes)
         sipsimple_addressbook.add(xml_contact)
+        self.resource_lists.record_addressbook_change((addressbook.Contact, contact.id))
 
     def _OH_UpdateContactOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
@@ -1530,33 +1773,46 @@ class XCAPManager(object):
             contact = sipsimple_addressbook[addressbook.Contact, operation.contact.id]
         except KeyError:
             return
+        contact_step = (addressbook.Contact, contact.id)
         attributes = dict(operation.attributes)
         attributes.pop('id', None) # id is never modified
         attributes.pop('uris', None) # uris are modified using dedicated methods
         if 'name' in attributes:
             contact.name = attributes.pop('name')
+            self.resource_lists.record_addressbook_change(contact_step, addressbook.Name)
         if 'uris.default' in attributes:
             contact.uris.default = attributes.pop('uris.default')
+            self.resource_lists.record_addressbook_change(contact_step, addressbook.ContactURIList, attribute=addressbook.ContactURIList.default.xmlname)
         if 'presence.policy' in attributes:
             contact.presence.policy = attributes.pop('presence.policy')
+            self.resource_lists.record_addressbook_change(contact_step, addressbook.PresenceHandling)
         if 'presence.subscribe' in attributes:
             contact.presence.subscribe = attributes.pop('presence.subscribe')
+            self.resource_lists.record_addressbook_change(contact_step, addressbook.PresenceHandling)
         if 'dialog.policy' in attributes:
             contact.dialog.policy = attributes.pop('dialog.policy')
+            self.resource_lists.record_addressbook_change(contact_step, addressbook.DialogHandling)
         if 'dialog.subscribe' in attributes:
             contact.dialog.subscribe = attributes.pop('dialog.subscribe')
+            self.resource_lists.record_addressbook_change(contact_step, addressbook.DialogHandling)
         if contact.attributes is None:
             contact.attributes = addressbook.Contact.attributes.type()
-        contact.attributes.update(attributes)
+            self.resource_lists.record_addressbook_change(contact_step, addressbook.ElementAttributes)
+        if attributes:
+            contact.attributes.update(attributes)
+            self.resource_lists.record_addressbook_change(contact_step, addressbook.ElementAttributes)
 
     def _OH_RemoveContactOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
         for group in (group for group in sipsimple_addressbook[addressbook.Group, IterateItems] if operation.contact.id in group.contacts):
             group.contacts.remove(operation.contact.id)
+            self.resource_lists.record_addressbook_change((addressbook.Group, group.id), addressbook.ContactList)
         try:
             del sipsimple_addressbook[addressbook.Contact, operation.contact.id]
         except KeyError:
             pass
+        else:
+            self.resource_lists.record_addressbook_change((addressbook.Contact, operation.contact.id))
 
     def _OH_AddContactURIOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
@@ -1567,6 +1823,7 @@ class XCAPManager(object):
         uri = addressbook.ContactURI(operation.uri.id, operation.uri.uri, operation.uri.type)
         uri.attributes = addressbook.ContactURI.attributes.type(operation.uri.attributes)
         contact.uris.add(uri)
+        self.resource_lists.record_addressbook_change((addressbook.Contact, contact.id), addressbook.ContactURIList, (addressbook.ContactURI, uri.id))
 
     def _OH_UpdateContactURIOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
@@ -1575,15 +1832,21 @@ class XCAPManager(object):
             uri = contact.uris[operation.uri.id]
         except KeyError:
             return
+        uri_steps = ((addressbook.Contact, contact.id), addressbook.ContactURIList, (addressbook.ContactURI, uri.id))
         attributes = dict(operation.attributes)
         attributes.pop('id', None) # id is never modified
         if 'uri' in attributes:
             uri.uri = attributes.pop('uri')
+            self.resource_lists.record_addressbook_change(*uri_steps, attribute=addressbook.ContactURI.uri.xmlname)
         if 'type' in attributes:
             uri.type = attributes.pop('type')
+            self.resource_lists.record_addressbook_change(*uri_steps, attribute=addressbook.ContactURI.type.xmlname)
         if uri.attributes is None:
             uri.attributes = addressbook.ContactURI.attributes.type()
-        uri.attributes.update(attributes)
+            self.resource_lists.record_addressbook_change(*uri_steps, addressbook.ElementAttributes)
+        if attributes:
+            uri.attributes.update(attributes)
+            self.resource_lists.record_addressbook_change(*uri_steps, addressbook.ElementAttributes)
 
     def _OH_RemoveContactURIOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
@@ -1592,12 +1855,15 @@ class XCAPManager(object):
             del contact.uris[operation.uri.id]
         except KeyError:
             pass
+        else:
+            self.resource_lists.record_addressbook_change((addressbook.Contact, contact.id), addressbook.ContactURIList, (addressbook.ContactURI, operation.uri.id))
 
     def _OH_AddGroupOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
         group = addressbook.Group(operation.group.id, operation.group.name, [contact.id for contact in operation.group.contacts])
         group.attributes = addressbook.Group.attributes.type(operation.group.attributes)
         sipsimple_addressbook.add(group)
+        self.resource_lists.record_addressbook_change((addressbook.Group, group.id))
 
     def _OH_UpdateGroupOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
@@ -1605,14 +1871,19 @@ class XCAPManager(object):
             group = sipsimple_addressbook[addressbook.Group, operation.group.id]
         except KeyError:
             return
+        group_step = (addressbook.Group, group.id)
         attributes = dict(operation.attributes)
         attributes.pop('id', None) # id is never modified
         attributes.pop('contacts', None) # contacts are added/removed using dedicated methods
         if 'name' in attributes:
             group.name = attributes.pop('name')
+            self.resource_lists.record_addressbook_change(group_step, addressbook.Name)
         if group.attributes is None:
             group.attributes = addressbook.Group.attributes.type()
-        group.attributes.update(attributes)
+            self.resource_lists.record_addressbook_change(group_step, addressbook.ElementAttributes)
+        if attributes:
+            group.attributes.update(attributes)
+            self.resource_lists.record_addressbook_change(group_step, addressbook.ElementAttributes)
 
     def _OH_RemoveGroupOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
@@ -1620,6 +1891,8 @@ class XCAPManager(object):
             del sipsimple_addressbook[addressbook.Group, operation.group.id]
         except KeyError:
             pass
+        else:
+            self.resource_lists.record_addressbook_change((addressbook.Group, operation.group.id))
 
     def _OH_AddGroupMemberOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
@@ -1630,6 +1903,7 @@ class XCAPManager(object):
         if operation.contact.id in group.contacts:
             return
         group.contacts.add(operation.contact.id)
+        self.resource_lists.record_addressbook_change((addressbook.Group, group.id), addressbook.ContactList)
 
     def _OH_RemoveGroupMemberOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
@@ -1638,6 +1912,7 @@ class XCAPManager(object):
             group.contacts.remove(operation.contact.id)
         except KeyError:
             return
+        self.resource_lists.record_addressbook_change((addressbook.Group, group.id), addressbook.ContactList)
 
     def _OH_AddPolicyOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
@@ -1646,6 +1921,7 @@ class XCAPManager(object):
         policy = addressbook.Policy(operation.policy.id, operation.policy.uri, operation.policy.name, presence_handling=presence_handling, dialog_handling=dialog_handling)
         policy.attributes = addressbook.Policy.attributes.type(operation.policy.attributes)
         sipsimple_addressbook.add(policy)
+        self.resource_lists.record_addressbook_change((addressbook.Policy, policy.id))
 
     def _OH_UpdatePolicyOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
@@ -1653,23 +1929,33 @@ class XCAPManager(object):
             policy = sipsimple_addressbook[addressbook.Policy, operation.policy.id]
         except KeyError:
             return
+        policy_step = (addressbook.Policy, policy.id)
         attributes = dict(operation.attributes)
         attributes.pop('id', None) # id is never modified
         if 'uri' in attributes:
             policy.uri = attributes.pop('uri')
+            self.resource_lists.record_addressbook_change(policy_step, attribute=addressbook.Policy.uri.xmlname)
         if 'name' in attributes:
             policy.name = attributes.pop('name')
+            self.resource_lists.record_addressbook_change(policy_step, addressbook.Name)
         if 'presence.policy' in attributes:
             policy.presence.policy = attributes.pop('presence.policy')
+            self.resource_lists.record_addressbook_change(policy_step, addressbook.PresenceHandling)
         if 'presence.subscribe' in attributes:
             policy.presence.subscribe = attributes.pop('presence.subscribe')
+            self.resource_lists.record_addressbook_change(policy_step, addressbook.PresenceHandling)
         if 'dialog.policy' in attributes:
             policy.dialog.policy = attributes.pop('dialog.policy')
+            self.resource_lists.record_addressbook_change(policy_step, addressbook.DialogHandling)
         if 'dialog.subscribe' in attributes:
             policy.dialog.subscribe = attributes.pop('dialog.subscribe')
+            self.resource_lists.record_addressbook_change(policy_step, addressbook.DialogHandling)
         if policy.attributes is None:
             policy.attributes = addressbook.Policy.attributes.type()
-        policy.attributes.update(attributes)
+            self.resource_lists.record_addressbook_change(policy_step, addressbook.ElementAttributes)
+        if attributes:
+            policy.attributes.update(attributes)
+            self.resource_lists.record_addressbook_change(policy_step, addressbook.ElementAttributes)
 
     def _OH_RemovePolicyOperation(self, operation):
         sipsimple_addressbook = self.resource_lists.content['sipsimple_addressbook']
@@ -1677,6 +1963,8 @@ class XCAPManager(object):
             del sipsimple_addressbook[addressbook.Policy, operation.policy.id]
         except KeyError:
             pass
+        else:
+            self.resource_lists.record_addressbook_change((addressbook.Policy, operation.policy.id))
 
     def _OH_SetStatusIconOperation(self, operation):
         if not self.status_icon.supported:
@@ -1789,6 +2077,8 @@ class XCAPManager(object):
                 self.command_channel.send(Command('fetch', documents=set(self.document_names)))
             else:
                 changed_etags = {}
+                document_diffs = {}
+                node_diffs = {}
                 for child in xcap_diff:
                     if isinstance(child, xcapdiff.Document):
                         try:
@@ -1805,12 +2095,16 @@ class XCAPManager(object):
                                                    'auid': child.selector.auid,
                                                    'url': url
                                                    }
+                        document_diffs[child.selector.auid] = child
+                    else:
+                        node_diffs.setdefault(child.selector.auid, []).append(child)
 
-                applications = set(child.selector.auid for child in xcap_diff if isinstance(child, xcapdiff.Document))
-                documents = set(document.name for document in self.documents if document.application in applications and document.etag != changed_etags[name]['new_etag'])
+                diffs = dict((document.name, (document_diffs[document.application], node_diffs.get(document.application, []))) for document in self.documents
+                             if document.application in document_diffs and document.etag != document_diffs[document.application].new_etag)
+                documents = set(diffs)
 
-                if documents:
-                    self.command_channel.send(Command('fetch', documents=documents))
+                if diffs:
+                    self.command_channel.send(Command('patch', diffs=diffs))
 
                 notification_center = NotificationCenter()
                 notification_data = NotificationData(root=self.xcap_root, documents=documents, notified_etags=changed_etags)
@@ -1818,6 +2112,8 @@ class XCAPManager(object):
 
     def _load_data(self):
         addressbook = Addressbook.from_payload(self.resource_lists.content['sipsimple_addressbook'])
+        changes = addressbook.changes_since(self.addressbook) if self.addressbook is not None else None
+        self.addressbook = addressbook
 
         default_presence_rule = self.pres_rules.content.get('wp_prs_unlisted', None) or self.pres_rules.content.get('wp_prs_allow_unlisted', None)
         if self.dialog_rules.supported:
@@ -1840,7 +2136,7 @@ class XCAPManager(object):
         else:
             offline_status = None
 
-        data=NotificationData(addressbook=addressbook, presence_rules=presence_rules, dialog_rules=dialog_rules, status_icon=status_icon, offline_status=offline_status)
+        data=NotificationData(addressbook=addressbook, changes=changes, presence_rules=presence_rules, dialog_rules=dialog_rules, status_icon=status_icon, offline_status=offline_status)
         NotificationCenter().post_notification('XCAPManagerDidReloadData', sender=self, data=data)
 
     def _fetch_documents(self, documents):
@@ -0,0 +1,212 @@
+
+"""Apply the changes described by xcap-diff (RFC 5874) documents to XML trees"""
+
+__all__ = ['PatchError', 'apply_patch', 'apply_element_change', 'apply_attribute_change']
+
+
+from copy import deepcopy
+from urllib.parse import unquote
+
+from lxml import etree
+
+
+class PatchError(Exception): pass
+
+
+def _split_steps(selector):
+    """Split a selector into location steps, ignoring the slashes inside predicates"""
+    steps = []
+    start = depth = 0
+    quote = None
+    for index, char in enumerate(selector):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+        elif char == '/' and depth == 0:
+            steps.append(selector[start:index])
+            start = index + 1
+    steps.append(selector[start:])
+    return steps
+
+
+def _select(root, steps, nsmap, default_namespace):
+    namespaces = dict((prefix, namespace) for prefix, namespace in nsmap.items() if prefix is not None)
+    if default_namespace is not None:
+        namespaces['_default'] = default_namespace
+    qualified_steps = []
+    for step in steps:
+        name = step.partition('[')[0]
+        if default_namespace is not None and name and ':' not in name and name not in ('*', '.', '..') and not name.startswith('@') and not name.endswith(')'):
+            step = '_default:' + step
+        qualified_steps.append(step)
+    path = '/'.join(qualified_steps)
+    if not path.startswith('/'):
+        path = '/' + path
+    try:
+        return root.xpath(path, namespaces=namespaces)
+    except etree.XPathError as e:
+        raise PatchError("cannot evaluate selector %s: %s" % ('/'.join(steps), e))
+
+
+def _select_one(root, steps, nsmap, default_namespace):
+    nodes = _select(root, steps, nsmap, default_namespace)
+    if len(nodes) != 1:
+        raise PatchError("selector %s matched %d nodes instead of one" % ('/'.join(steps), len(nodes)))
+    return nodes[0]
+
+
+def _attribute_name(name, nsmap):
+    prefix, colon, local_name = name.rpartition(':')
+    if not colon:
+        return name
+    try:
+        return '{%s}%s' % (nsmap[prefix], local_name)
+    except KeyError:
+        raise PatchError("unknown namespace prefix in attribute name %s" % name)
+
+
+def _element_content(element):
+    if (element.text or '').strip() or any((child.tail or '').strip() for child in element):
+        raise PatchError("text content is not supported")
+    children = [deepcopy(child) for child in element if isinstance(child.tag, str)]
+    for child in children:
+        child.tail = None
+    return children
+
+
+def _add(root, operation):
+    target = _select_one(root, _split_steps(operation.get('sel')), operation.nsmap, operation.nsmap.get(None))
+    if not isinstance(target, etree._Element):
+        raise PatchError("can only add nodes to an element")
+    type = operation.get('type')
+    if type is not None:
+        if not type.startswith('@'):
+            raise PatchError("adding %s nodes is not supported" % type)
+        target.set(_attribute_name(type[1:], operation.nsmap), operation.text or '')
+        return
+    children = _element_content(operation)
+    position = operation.get('pos')
+    if position is None:
+        target.extend(children)
+    elif position == 'prepend':
+        target[0:0] = children
+    elif position in ('before', 'after'):
+        parent = target.getparent()
+        if parent is None:
+            raise PatchError("cannot add siblings to the root element")
+        index = parent.index(target) + (1 if position == 'after' else 0)
+        parent[index:index] = children
+    else:
+        raise PatchError("illegal position: %s" % position)
+
+
+def _replace(root, operation):
+    target = _select_one(root, _split_steps(operation.get('sel')), operation.nsmap, operation.nsmap.get(None))
+    if isinstance(target, etree._Element):
+        children = _element_content(operation)
+        parent = target.getparent()
+        if len(children) != 1:
+            raise PatchError("an element must be replaced by exactly one element")
+        if parent is None:
+            raise PatchError("cannot replace the root element")
+        parent.replace(target, children[0])
+    elif getattr(target, 'is_attribute', False):
+        target.getparent().set(target.attrname, operation.text or '')
+    elif getattr(target, 'is_text', False):
+        target.getparent().text = operation.text
+    elif getattr(target, 'is_tail', False):
+        target.getparent().tail = operation.text
+    else:
+        raise PatchError("cannot replace node selected by %s" % operation.get('sel'))
+
+
+def _remove(root, operation):
+    target = _select_one(root, _split_steps(operation.get('sel')), operation.nsmap, operation.nsmap.get(None))
+    if isinstance(target, etree._Element):
+        parent = target.getparent()
+        if parent is None:
+            raise PatchError("cannot remove the root element")
+        parent.remove(target)
+    elif getattr(target, 'is_attribute', False):
+        del target.getparent().attrib[target.attrname]
+    elif getattr(target, 'is_text', False):
+        target.getparent().text = None
+    elif getattr(target, 'is_tail', False):
+        target.getparent().tail = None
+    else:
+        raise PatchError("cannot remove node selected by %s" % operation.get('sel'))
+
+
+_operations = {'add': _add, 'replace': _replace, 'remove': _remove}
+
+
+def apply_patch(root, operations):
+    """
+    Apply the XML patch operations (RFC 5261) from a xcap-diff document
+    element to the tree rooted at root. The selectors are resolved using the
+    namespace declarations in scope for each operation element.
+    """
+    for operation in operations:
+        try:
+            handler = _operations[etree.QName(operation).localname]
+        except KeyError:
+            raise PatchError("unknown patch operation: %s" % operation.tag)
+        if operation.get('sel') is None:
+            raise PatchError("patch operation without selector")
+        handler(root, operation)
+
+
+def apply_element_change(root, selector, nsmap, default_namespace, exists, content=None):
+    """
+    Apply a xcap-diff element change to the tree rooted at root. The XCAP
+    node selector may be percent-encoded as it appears in the URI, it uses
+    default_namespace for unprefixed names and resolves prefixes using nsmap.
+    If content is None and exists is false the element is removed, otherwise
+    it is replaced with (or added as) content.
+    """
+    selector = unquote(selector)
+    steps = _split_steps(selector)
+    nodes = _select(root, steps, nsmap, default_namespace)
+    if len(nodes) > 1:
+        raise PatchError("selector %s matched %d nodes" % (selector, len(nodes)))
+    if content is None:
+        if exists is None or exists:
+            raise PatchError("the content of %s was not included" % selector)
+        if nodes:
+            if nodes[0].getparent() is None:
+                raise PatchError("cannot remove the root element")
+            nodes[0].getparent().remove(nodes[0])
+        return
+    element = deepcopy(content)
+    element.tail = None
+    if nodes:
+        if nodes[0].getparent() is None:
+            raise PatchError("cannot replace the root element")
+        nodes[0].getparent().replace(nodes[0], element)
+    else:
+        _select_one(root, steps[:-1], nsmap, default_namespace).append(element)
+
+
+def apply_attribute_change(root, selector, nsmap, default_namespace, exists, value=None):
+    """
+    Apply a xcap-diff attribute change to the tree rooted at root. If exists
+    is false the attribute is removed, otherwise it is set to value.
+    """
+    selector = unquote(selector)
+    steps = _split_steps(selector)
+    if not steps[-1].startswith('@'):
+        raise PatchError("%s does not select an attribute" % selector)
+    element = _select_one(root, steps[:-1], nsmap, default_namespace)
+    name = _attribute_name(steps[-1][1:], nsmap)
+    if exists is not None and not exists:
+        element.attrib.pop(name, None)
+    elif value is None:
+        raise PatchError("the value of %s was not included" % selector)
+    else:
+        element.set(name, value)
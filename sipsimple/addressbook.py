@@ -36,6 +36,30 @@ def recursive_getattr(obj, name):
     return reduce(getattr, name.split('.'), obj)
 
 
+def normalize_uri(uri):
+    """
+    Return the key under which a contact or policy URI is indexed: the user
+    and the lowercase host, without the scheme, port, parameters and headers.
+    The URI can be a string, a name-addr or a SIPURI/FrozenSIPURI object.
+    """
+    uri = uri.decode() if isinstance(uri, bytes) else str(uri)
+    uri = uri.strip()
+    if '<' in uri:
+        uri = uri.partition('<')[2].partition('>')[0].strip()
+    scheme, colon, remainder = uri.partition(':')
+    if colon and scheme.lower() in ('sip', 'sips', 'tel'):
+        uri = remainder
+    user, at, host = uri.rpartition('@')
+    host = host.partition('?')[0].partition(';')[0]
+    if host.startswith('['):
+        host = host[:host.find(']')+1]
+    elif at:
+        host = host.partition(':')[0]
+    if not at:
+        return host.lower()
+    return '%s@%s' % (user.partition(';')[0].partition(':')[0], host.lower())
+
+
 class Local(object, metaclass=MarkerType):
     pass
 
@@ -517,11 +541,13 @@ class Group(SettingsState):
             notification_center.post_notification('AddressbookGroupDidChange', sender=self, data=NotificationData(modified=modified_settings))
             modified_data = modified_settings
 
+        failure_data = NotificationData(object=self, operation='save', modified=modified_data)
         try:
-            configuration.save()
+            configuration.save(failure_data)
         except Exception as e:
             log.exception()
-            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=NotificationData(object=self, operation='save', modified=modified_data, exception=e))
+            failure_data.exception = e
+            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=failure_data)
 
     @run_in_thread('file-io')
     def _internal_delete(self, originator):
@@ -545,11 +571,13 @@ class Group(SettingsState):
 
         notification_center.post_notification('AddressbookGroupWasDeleted', sender=self)
 
+        failure_data = NotificationData(object=self, operation='delete')
         try:
-            configuration.save()
+            configuration.save(failure_data)
         except Exception as e:
             log.exception()
-            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=NotificationData(object=self, operation='delete', exception=e))
+            failure_data.exception = e
+            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=failure_data)
 
     def save(self):
         """
@@ -832,11 +860,13 @@ class Contact(SettingsState):
             notification_center.post_notification('AddressbookContactDidChange', sender=self, data=NotificationData(modified=modified_settings))
             modified_data = modified_settings
 
+        failure_data = NotificationData(object=self, operation='save', modified=modified_data)
         try:
-            configuration.save()
+            configuration.save(failure_data)
         except Exception as e:
             log.exception()
-            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=NotificationData(object=self, operation='save', modified=modified_data, exception=e))
+            failure_data.exception = e
+            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=failure_data)
 
     @run_in_thread('file-io')
     def _internal_delete(self, originator):
@@ -866,11 +896,13 @@ class Contact(SettingsState):
 
         notification_center.post_notification('AddressbookContactWasDeleted', sender=self)
 
+        failure_data = NotificationData(object=self, operation='delete')
         try:
-            configuration.save()
+            configuration.save(failure_data)
         except Exception as e:
             log.exception()
-            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=NotificationData(object=self, operation='delete', exception=e))
+            failure_data.exception = e
+            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=failure_data)
 
     def save(self):
         """
@@ -1021,11 +1053,13 @@ class Policy(SettingsState):
             notification_center.post_notification('AddressbookPolicyDidChange', sender=self, data=NotificationData(modified=modified_settings))
             modified_data = modified_settings
 
+        failure_data = NotificationData(object=self, operation='save', modified=modified_data)
         try:
-            configuration.save()
+            configuration.save(failure_data)
         except Exception as e:
             log.exception()
-            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=NotificationData(object=self, operation='save', modified=modified_data, exception=e))
+            failure_data.exception = e
+            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=failure_data)
 
     @run_in_thread('file-io')
     def _internal_delete(self, originator):
@@ -1049,11 +1083,13 @@ class Policy(SettingsState):
 
         notification_center.post_notification('AddressbookPolicyWasDeleted', sender=self)
 
+        failure_data = NotificationData(object=self, operation='delete')
         try:
-            configuration.save()
+            configuration.save(failure_data)
         except Exception as e:
             log.exception()
-            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=NotificationData(object=self, operation='delete', exception=e))
+            failure_data.exception = e
+            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=failure_data)
 
     def save(self):
         """
@@ -1110,13 +1146,20 @@ class AddressbookManager(object, metaclass=Singleton):
         self.groups = {}
         self.policies = {}
         self.__xcapaddressbook__ = None
+        self._uri_index_lock = Lock()
+        self._contact_uri_index = {}
+        self._contact_uri_keys = {}
+        self._policy_uri_index = {}
+        self._policy_uri_keys = {}
         notification_center = NotificationCenter()
         notification_center.add_observer(self, name='AddressbookContactWasActivated')
         notification_center.add_observer(self, name='AddressbookContactWasDeleted')
+        notification_center.add_observer(self, name='AddressbookContactDidChange')
         notification_center.add_observer(self, name='AddressbookGroupWasActivated')
         notification_center.add_observer(self, name='AddressbookGroupWasDeleted')
         notification_center.add_observer(self, name='AddressbookPolicyWasActivated')
         notification_center.add_observer(self, name='AddressbookPolicyWasDeleted')
+        notification_center.add_observer(self, name='AddressbookPolicyDidChange')
         notification_center.add_observer(self, name='SIPAccountDidDiscoverXCAPSupport')
         notification_center.add_observer(self, name='XCAPManagerDidReloadData')
 
@@ -1128,6 +1171,7 @@ class AddressbookManager(object, metaclass=Singleton):
         if 'Contacts' in configuration.data or 'ContactGroups' in configuration.data:
             account_manager = AccountManager()
             old_data = dict(contacts=configuration.data.pop('Contacts', {}), groups=configuration.data.pop('ContactGroups', {}))
+            configuration.modified_keys.update([('Contacts',), ('ContactGroups',)])
             if any(account.enabled and account.xcap.enabled and account.xcap.discovered for account in account_manager.get_accounts()):
                 self.__old_data = old_data
             else:
@@ -1171,6 +1215,40 @@ class AddressbookManager(object, metaclass=Singleton):
     def get_policies(self):
         return list(self.policies.values())
 
+    def find_contacts(self, uri):
+        """
+        Return the contacts that have a URI matching the given one. The URIs
+        are compared after being normalized with normalize_uri.
+        """
+        key = normalize_uri(uri)
+        with self._uri_index_lock:
+            ids = list(self._contact_uri_index.get(key, ()))
+        return [contact for contact in (self.contacts.get(id) for id in ids) if contact is not None]
+
+    def find_policies(self, uri):
+        """
+        Return the policies whose URI matches the given one. The URIs are
+        compared after being normalized with normalize_uri.
+        """
+        key = normalize_uri(uri)
+        with self._uri_index_lock:
+            ids = list(self._policy_uri_index.get(key, ()))
+        return [policy for policy in (self.policies.get(id) for id in ids) if policy is not None]
+
+    def _update_uri_index(self, index, index_keys, id, uris):
+        keys = set(normalize_uri(uri) for uri in uris if uri)
+        with self._uri_index_lock:
+            old_keys = index_keys.pop(id, set())
+            for key in old_keys - keys:
+                ids = index[key]
+                ids.discard(id)
+                if not ids:
+                    del index[key]
+            for key in keys - old_keys:
+                index.setdefault(key, set()).add(id)
+            if keys:
+                index_keys[id] = keys
+
     @classmethod
     def transaction(cls):
         account_manager = AccountManager()
@@ -1184,13 +1262,20 @@ class AddressbookManager(object, metaclass=Singleton):
     def _NH_AddressbookContactWasActivated(self, notification):
         contact = notification.sender
         self.contacts[contact.id] = contact
+        self._update_uri_index(self._contact_uri_index, self._contact_uri_keys, contact.id, [uri.uri for uri in contact.uris])
         notification.center.post_notification('AddressbookManagerDidAddContact', sender=self, data=NotificationData(contact=contact))
 
     def _NH_AddressbookContactWasDeleted(self, notification):
         contact = notification.sender
         del self.contacts[contact.id]
+        self._update_uri_index(self._contact_uri_index, self._contact_uri_keys, contact.id, [])
         notification.center.post_notification('AddressbookManagerDidRemoveContact', sender=self, data=NotificationData(contact=contact))
 
+    def _NH_AddressbookContactDidChange(self, notification):
+        contact = notification.sender
+        if 'uris' in notification.data.modified and contact.id in self.contacts:
+            self._update_uri_index(self._contact_uri_index, self._contact_uri_keys, contact.id, [uri.uri for uri in contact.uris])
+
     def _NH_AddressbookGroupWasActivated(self, notification):
         group = notification.sender
         self.groups[group.id] = group
@@ -1204,13 +1289,20 @@ class AddressbookManager(object, metaclass=Singleton):
     def _NH_AddressbookPolicyWasActivated(self, notification):
         policy = notification.sender
         self.policies[policy.id] = policy
+        self._update_uri_index(self._policy_uri_index, self._policy_uri_keys, policy.id, [policy.uri])
         notification.center.post_notification('AddressbookManagerDidAddPolicy', sender=self, data=NotificationData(policy=policy))
 
     def _NH_AddressbookPolicyWasDeleted(self, notification):
         policy = notification.sender
         del self.policies[policy.id]
+        self._update_uri_index(self._policy_uri_index, self._policy_uri_keys, policy.id, [])
         notification.center.post_notification('AddressbookManagerDidRemovePolicy', sender=self, data=NotificationData(policy=policy))
 
+    def _NH_AddressbookPolicyDidChange(self, notification):
+        policy = notification.sender
+        if 'uri' in notification.data.modified and policy.id in self.policies:
+            self._update_uri_index(self._policy_uri_index, self._policy_uri_keys, policy.id, [policy.uri])
+
     @run_in_thread('file-io')
     def _NH_SIPAccountDidDiscoverXCAPSupport(self, notification):
         xcap_manager = notification.sender.xcap_manager
@@ -1227,12 +1319,26 @@ class AddressbookManager(object, metaclass=Singleton):
         if notification.data.addressbook == self.__xcapaddressbook__:
             return
 
+        changes = notification.data.changes
+        if changes is not None and changes.previous == self.__xcapaddressbook__:
+            # only apply what changed since the addressbook we already applied
+            xcap_contacts = changes.contacts
+            xcap_groups = changes.groups
+            xcap_policies = changes.policies
+            removed_contact_ids = set(contact.id for contact in changes.removed_contacts)
+            removed_group_ids = set(group.id for group in changes.removed_groups)
+            removed_policy_ids = set(policy.id for policy in changes.removed_policies)
+        else:
+            xcap_contacts = notification.data.addressbook.contacts
+            xcap_groups = notification.data.addressbook.groups
+            xcap_policies = notification.data.addressbook.policies
+            removed_contact_ids = set(self.contacts).difference(xcap_contacts.ids())
+            removed_group_ids = set(self.groups).difference(xcap_groups.ids())
+            removed_policy_ids = set(self.policies).difference(xcap_policies.ids())
+
         self.__xcapaddressbook__ = notification.data.addressbook
 
         xcap_manager = notification.sender
-        xcap_contacts = notification.data.addressbook.contacts
-        xcap_groups = notification.data.addressbook.groups
-        xcap_policies = notification.data.addressbook.policies
 
         account_manager = AccountManager()
         xcap_accounts = [account for account in account_manager.get_accounts() if account.xcap.discovered]
@@ -1241,7 +1347,7 @@ class AddressbookManager(object, metaclass=Singleton):
         if hasattr(self, '_AddressbookManager__old_data'):
             old_data = self.__old_data
             del self.__old_data
-            if not xcap_contacts and not xcap_groups:
+            if not notification.data.addressbook.contacts and not notification.data.addressbook.groups:
                 self.__migrate_contacts(old_data)
                 return
 
@@ -1327,11 +1433,11 @@ class AddressbookManager(object, metaclass=Singleton):
                 policy._internal_save(originator=Remote(xcap_manager.account, xcap_policy))
 
             originator = Remote(xcap_manager.account, None)
-            for policy in (policy for policy in list(self.policies.values()) if policy.id not in xcap_policies):
+            for policy in (self.policies[id] for id in removed_policy_ids if id in self.policies):
                 policy._internal_delete(originator=originator)
-            for group in (group for group in list(self.groups.values()) if group.id not in xcap_groups):
+            for group in (self.groups[id] for id in removed_group_ids if id in self.groups):
                 group._internal_delete(originator=originator)
-            for contact in (contact for contact in list(self.contacts.values()) if contact.id not in xcap_contacts):
+            for contact in (self.contacts[id] for id in removed_contact_ids if id in self.contacts):
                 contact._internal_delete(originator=originator)
 
     def __migrate_contacts(self, old_data):
@@ -32,6 +32,7 @@ from sipsimple.configuration.settings import SIPSimpleSettings
 from sipsimple.core import AudioMixer, Engine, SIPCoreError, PJSIPError
 from sipsimple.lookup import DNSManager
 from sipsimple.session import SessionManager
+from sipsimple.streams.rtp.pool import RTPTransportPool
 from sipsimple.storage import ISIPSimpleStorage, ISIPSimpleApplicationDataStorage
 from sipsimple.threading import ThreadManager, run_in_thread, run_in_twisted_thread
 from sipsimple.threading.green import run_in_green_thread
@@ -270,6 +271,7 @@ class SIPApplication(object, metaclass=Singleton):
         account_manager.start()
         addressbook_manager.start()
         session_manager.start()
+        RTPTransportPool().start()
 
         notification_center.add_observer(self, name='CFGSettingsObjectDidChange')
         notification_center.add_observer(self, name='DNSNameserversDidChange')
@@ -293,6 +295,7 @@ class SIPApplication(object, metaclass=Singleton):
         self._timer = None
 
         # shutdown middleware components
+        RTPTransportPool().stop()
         dns_manager = DNSManager()
         account_manager = AccountManager()
         addressbook_manager = AddressbookManager()
@@ -307,6 +310,10 @@ class SIPApplication(object, metaclass=Singleton):
         self.engine.stop()
         self.engine.join(timeout=5)
 
+        # write the configuration changes delayed in write-behind mode before the file-io thread is stopped
+        configuration_manager = ConfigurationManager()
+        configuration_manager.wait_saved(timeout=5)
+
         # stop threads
         thread_manager = ThreadManager()
         thread_manager.stop()
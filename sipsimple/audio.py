@@ -3,22 +3,24 @@
 
 
 
-__all__ = ['IAudioPort', 'AudioDevice', 'AudioBridge', 'RootAudioBridge', 'AudioConference', 'WavePlayer', 'WavePlayerError', 'WaveRecorder']
+__all__ = ['IAudioPort', 'AudioDevice', 'AudioBridge', 'RootAudioBridge', 'ConferenceBridge', 'AudioConference', 'PromptCache', 'WavePlayer', 'WavePlayerError', 'WaveRecorder']
 
 import os
 import weakref
+from collections import OrderedDict
 from functools import partial
 from itertools import combinations
-from threading import RLock
+from threading import Lock, RLock
 
 from application.notification import IObserver, NotificationCenter, NotificationData, ObserverWeakrefProxy
+from application.python.types import Singleton
 from application.system import makedirs
 from eventlib import coros
 from twisted.internet import reactor
 from zope.interface import Attribute, Interface, implementer
 
-from sipsimple.core import MixerPort, RecordingWaveFile, SIPCoreError, WaveFile
-from sipsimple.threading import run_in_twisted_thread
+from sipsimple.core import MemoryPlayer, MixerPort, RecordingWaveFile, SIPCoreError, WaveFile, read_wave_file
+from sipsimple.threading import run_in_thread, run_in_twisted_thread
 from sipsimple.threading.green import Command, run_in_green_thread, run_in_waitable_green_thread
 
 
@@ -349,11 +351,186 @@ class RootAudioBridge(object):
                 self.ports.discard(portwr)
 
 
+class ConferenceGroup(object):
+    """A group of ports in a ConferenceBridge and the MixerPort carrying their audio to the other groups"""
+
+    def __init__(self):
+        self.ports = set()
+        self.bus = None
+
+
+@implementer(IObserver)
+class ConferenceBridge(object):
+    """
+    A ConferenceBridge is a container for objects providing the IAudioPort
+    interface. Like the RootAudioBridge, it connects them such that all audio
+    producers are heard by all consumers (except their own), but it avoids the
+    full-mesh of connections which makes the work done by the mixer for each
+    frame grow with the square of the number of ports.
+
+    The ports are split in groups of at most group_size ports. Ports in the
+    same group are connected to each other directly, while the audio produced
+    by a group is mixed once into a MixerPort which is connected to all the
+    consumers in the other groups. Adding or removing a port only changes the
+    connections of that port, of which there are at most group_size plus the
+    number of groups, and the total number of connections stays close to
+    n * (group_size + n / group_size) instead of n * n. The audio coming from
+    the other groups is delayed by one frame while passing through their
+    MixerPort. As long as there is a single group, no MixerPort is used and
+    the ports are connected in a full-mesh.
+    """
+
+    def __init__(self, mixer, group_size=16):
+        if group_size < 1:
+            raise ValueError("group_size must be a positive integer")
+        self.mixer = mixer
+        self.group_size = group_size
+        self.ports = set()
+        self.groups = []
+        self._port_groups = {}
+        self._lock = RLock()
+        notification_center = NotificationCenter()
+        notification_center.add_observer(ObserverWeakrefProxy(self), name='AudioPortDidChangeSlots')
+
+    def __del__(self):
+        for port in (wr() for wr in list(self.ports)):
+            if port is None:
+                continue
+            group = self._port_groups[weakref.ref(port)]
+            if port.producer_slot is not None:
+                for slot in self._producer_destinations(group, port):
+                    self.mixer.disconnect_slots(port.producer_slot, slot)
+            if port.consumer_slot is not None:
+                for slot in self._consumer_sources(group, port):
+                    self.mixer.disconnect_slots(slot, port.consumer_slot)
+        for group in self.groups:
+            if group.bus is not None:
+                group.bus.stop()
+        self.ports.clear()
+        self.groups = []
+        self._port_groups.clear()
+
+    def __contains__(self, port):
+        return weakref.ref(port) in self.ports
+
+    def add(self, port):
+        with self._lock:
+            if not IAudioPort.providedBy(port):
+                raise TypeError("expected object implementing IAudioPort, got %s" % port.__class__.__name__)
+            if port.mixer is not self.mixer:
+                raise ValueError("expected port with Mixer %r, got %r" % (self.mixer, port.mixer))
+            if weakref.ref(port) in self.ports:
+                return
+            try:
+                group = next(group for group in self.groups if len(group.ports) < self.group_size)
+            except StopIteration:
+                group = self._add_group()
+            if port.producer_slot is not None:
+                for slot in self._producer_destinations(group, port):
+                    self.mixer.connect_slots(port.producer_slot, slot)
+            if port.consumer_slot is not None:
+                for slot in self._consumer_sources(group, port):
+                    self.mixer.connect_slots(slot, port.consumer_slot)
+            # See AudioBridge.add for why the callback only references us weakly
+            portwr = weakref.ref(port, partial(self._remove_port, weakref.ref(self)))
+            self.ports.add(portwr)
+            group.ports.add(portwr)
+            self._port_groups[portwr] = group
+
+    def remove(self, port):
+        with self._lock:
+            if weakref.ref(port) not in self.ports:
+                raise ValueError("port %r is not part of this bridge" % port)
+            group = self._port_groups[weakref.ref(port)]
+            if port.producer_slot is not None:
+                for slot in self._producer_destinations(group, port):
+                    self.mixer.disconnect_slots(port.producer_slot, slot)
+            if port.consumer_slot is not None:
+                for slot in self._consumer_sources(group, port):
+                    self.mixer.disconnect_slots(slot, port.consumer_slot)
+            self._discard_port(weakref.ref(port))
+
+    def handle_notification(self, notification):
+        with self._lock:
+            if weakref.ref(notification.sender) not in self.ports:
+                return
+            group = self._port_groups[weakref.ref(notification.sender)]
+            if notification.data.consumer_slot_changed:
+                for slot in self._consumer_sources(group, notification.sender):
+                    if notification.data.old_consumer_slot is not None:
+                        self.mixer.disconnect_slots(slot, notification.data.old_consumer_slot)
+                    if notification.data.new_consumer_slot is not None:
+                        self.mixer.connect_slots(slot, notification.data.new_consumer_slot)
+            if notification.data.producer_slot_changed:
+                for slot in self._producer_destinations(group, notification.sender):
+                    if notification.data.old_producer_slot is not None:
+                        self.mixer.disconnect_slots(notification.data.old_producer_slot, slot)
+                    if notification.data.new_producer_slot is not None:
+                        self.mixer.connect_slots(notification.data.new_producer_slot, slot)
+
+    def _producer_destinations(self, group, port):
+        slots = [other.consumer_slot for other in (wr() for wr in group.ports) if other is not None and other is not port and other.consumer_slot is not None]
+        if group.bus is not None:
+            slots.append(group.bus.slot)
+        return slots
+
+    def _consumer_sources(self, group, port):
+        slots = [other.producer_slot for other in (wr() for wr in group.ports) if other is not None and other is not port and other.producer_slot is not None]
+        slots.extend(other_group.bus.slot for other_group in self.groups if other_group is not group and other_group.bus is not None)
+        return slots
+
+    def _add_group(self):
+        group = ConferenceGroup()
+        self.groups.append(group)
+        if len(self.groups) == 2:
+            self._start_bus(self.groups[0])
+        if len(self.groups) > 1:
+            self._start_bus(group)
+        return group
+
+    def _start_bus(self, group):
+        group.bus = MixerPort(self.mixer)
+        group.bus.start()
+        for port in (wr() for wr in self.ports):
+            if port is None:
+                continue
+            if weakref.ref(port) in group.ports:
+                if port.producer_slot is not None:
+                    self.mixer.connect_slots(port.producer_slot, group.bus.slot)
+            elif port.consumer_slot is not None:
+                self.mixer.connect_slots(group.bus.slot, port.consumer_slot)
+
+    def _stop_bus(self, group):
+        # stopping the MixerPort also removes all its connections
+        group.bus.stop()
+        group.bus = None
+
+    def _discard_port(self, portwr):
+        self.ports.discard(portwr)
+        group = self._port_groups.pop(portwr, None)
+        if group is None:
+            return
+        group.ports.discard(portwr)
+        if not group.ports:
+            self.groups.remove(group)
+            if group.bus is not None:
+                self._stop_bus(group)
+            if len(self.groups) == 1:
+                self._stop_bus(self.groups[0])
+
+    @staticmethod
+    def _remove_port(selfwr, portwr):
+        self = selfwr()
+        if self is not None:
+            with self._lock:
+                self._discard_port(portwr)
+
+
 class AudioConference(object):
     def __init__(self):
         from sipsimple.application import SIPApplication
         mixer = SIPApplication.voice_audio_mixer
-        self.bridge = RootAudioBridge(mixer)
+        self.bridge = ConferenceBridge(mixer)
         self.device = AudioDevice(mixer)
         self.on_hold = False
         self.streams = []
@@ -389,6 +566,115 @@ class AudioConference(object):
             self.on_hold = False
 
 
+class PromptCache(object, metaclass=Singleton):
+    """
+    A process wide cache of the audio played by WavePlayer objects. WAV files
+    are decoded and resampled to the rate of the mixer in the file-io thread
+    the first time they are played, while that play reads the file from disk,
+    and the following plays use a MemoryPlayer instead of opening and decoding
+    the file again.
+
+    The cache holds at most max_size bytes of audio and the least recently
+    played prompts are evicted first. Files with more than max_prompt_size
+    bytes of audio are not cached and are played from disk. Evicting a prompt
+    does not affect the players which are using it, as they keep a reference
+    to its data until they finish.
+    """
+
+    def __init__(self):
+        self.__dict__['max_size'] = 32*1024*1024
+        self.max_prompt_size = 4*1024*1024
+        self.size = 0
+        self._prompts = OrderedDict()
+        self._uncacheable = {}
+        self._pending = {}
+        self._lock = Lock()
+
+    @property
+    def max_size(self):
+        return self.__dict__['max_size']
+
+    @max_size.setter
+    def max_size(self, value):
+        with self._lock:
+            self.__dict__['max_size'] = value
+            self._evict_excess()
+
+    def get(self, filename, sample_rate):
+        """
+        Return the audio of the WAV file as 16 bit mono PCM samples at the
+        given sample rate or None if it is not cached. In the latter case the
+        file is decoded in the background, unless it cannot be cached, so
+        that it is available for the following plays.
+        """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return None
+        key = (filename, sample_rate)
+        signature = (stat.st_mtime, stat.st_size)
+        with self._lock:
+            try:
+                prompt_signature, data = self._prompts[key]
+            except KeyError:
+                pass
+            else:
+                if prompt_signature == signature:
+                    self._prompts.move_to_end(key)
+                    return data
+                self._remove(key)
+            if self._uncacheable.get(key) == signature or key in self._pending:
+                return None
+            self._pending[key] = signature
+            max_prompt_size = min(self.max_prompt_size, self.max_size)
+        self._load(key, signature, max_prompt_size)
+        return None
+
+    def evict(self, filename=None):
+        """Remove the given file (or all files if it is None) from the cache"""
+        with self._lock:
+            for key in [key for key in self._prompts if filename is None or key[0] == filename]:
+                self._remove(key)
+            for key in [key for key in self._uncacheable if filename is None or key[0] == filename]:
+                del self._uncacheable[key]
+            for key in [key for key in self._pending if filename is None or key[0] == filename]:
+                del self._pending[key]
+
+    @run_in_thread('file-io')
+    def _load(self, key, signature, max_prompt_size):
+        filename, sample_rate = key
+        try:
+            data = read_wave_file(filename, sample_rate, max_prompt_size)
+        except ValueError:
+            data = None
+        except SIPCoreError:
+            with self._lock:
+                if self._pending.get(key) == signature:
+                    del self._pending[key]
+            return
+        with self._lock:
+            # the file was evicted while it was being decoded
+            if self._pending.get(key) != signature:
+                return
+            del self._pending[key]
+            if data is None:
+                self._uncacheable[key] = signature
+                return
+            if key in self._prompts:
+                self._remove(key)
+            self._prompts[key] = signature, data
+            self.size += len(data)
+            self._evict_excess()
+
+    def _remove(self, key):
+        signature, data = self._prompts.pop(key)
+        self.size -= len(data)
+
+    def _evict_excess(self):
+        while self.size > self.max_size:
+            self._remove(next(iter(self._prompts)))
+
+
 @implementer(IAudioPort, IObserver)
 class WavePlayer(object):
     """
@@ -421,6 +707,10 @@ class WavePlayer(object):
     def producer_slot(self):
         return self._wave_file.slot if self._wave_file else None
 
+    @property
+    def _finished_notification(self):
+        return 'MemoryPlayerDidFinishPlaying' if isinstance(self._wave_file, MemoryPlayer) else 'WaveFileDidFinishPlaying'
+
     def start(self):
         self.play()
 
@@ -450,8 +740,12 @@ class WavePlayer(object):
             while True:
                 command = self._channel.wait()
                 if command.name == 'play':
-                    self._wave_file = WaveFile(self.mixer, self.filename)
-                    notification_center.add_observer(self, sender=self._wave_file, name='WaveFileDidFinishPlaying')
+                    data = PromptCache().get(self.filename, self.mixer.sample_rate)
+                    if data is not None:
+                        self._wave_file = MemoryPlayer(self.mixer, data, self.mixer.sample_rate)
+                    else:
+                        self._wave_file = WaveFile(self.mixer, self.filename)
+                    notification_center.add_observer(self, sender=self._wave_file, name=self._finished_notification)
                     self._wave_file.volume = self.volume
                     try:
                         self._wave_file.start()
@@ -465,7 +759,7 @@ class WavePlayer(object):
                                                                                                                             old_producer_slot=None, new_producer_slot=self._wave_file.slot))
                 elif command.name == 'reschedule':
                     self._current_loop += 1
-                    notification_center.remove_observer(self, sender=self._wave_file, name='WaveFileDidFinishPlaying')
+                    notification_center.remove_observer(self, sender=self._wave_file, name=self._finished_notification)
                     self._wave_file = None
                     notification_center.post_notification('AudioPortDidChangeSlots', sender=self, data=NotificationData(consumer_slot_changed=False, producer_slot_changed=True,
                                                                                                                         old_producer_slot=None, new_producer_slot=None))
@@ -476,7 +770,7 @@ class WavePlayer(object):
                         break
                 elif command.name == 'stop':
                     if self._wave_file is not None:
-                        notification_center.remove_observer(self, sender=self._wave_file, name='WaveFileDidFinishPlaying')
+                        notification_center.remove_observer(self, sender=self._wave_file, name=self._finished_notification)
                         self._wave_file.stop()
                         self._wave_file = None
                         notification_center.post_notification('AudioPortDidChangeSlots', sender=self, data=NotificationData(consumer_slot_changed=False, producer_slot_changed=True,
@@ -9,7 +9,7 @@ __all__ = ['ConfigurationManager', 'ConfigurationError', 'ObjectNotFoundError',
 from abc import ABCMeta, abstractmethod
 from itertools import chain
 from operator import attrgetter
-from threading import Lock
+from threading import Event, Lock, Timer
 from weakref import WeakSet
 
 from application.notification import NotificationCenter, NotificationData
@@ -18,7 +18,7 @@ from application.python.types import Singleton
 from application.python.weakref import weakobjectmap
 
 from sipsimple import log
-from sipsimple.threading import run_in_thread
+from sipsimple.threading import call_in_thread, run_in_thread, schedule_in_thread
 from functools import reduce
 
 
@@ -49,11 +49,24 @@ class ConfigurationManager(object, metaclass=Singleton):
     Singleton class used for storing and retrieving options, organized in
     sections. A section contains a list of objects, each with an assigned name
     which allows access to the object.
+
+    By default save() writes the data to the backend right away. If save_delay
+    is set to a number of seconds, the manager works in write-behind mode: the
+    saves requested within that window are merged into a single backend write
+    performed in the 'file-io' thread.
     """
 
     def __init__(self):
         self.backend = None
         self.data = None
+        self.modified_keys = set()
+        self.save_delay = None
+        self._save_lock = Lock()
+        self._save_pending = False
+        self._save_timer = None
+        self._save_failure_data = []
+        self._saved = Event()
+        self._saved.set()
 
     def start(self):
         """
@@ -84,6 +97,7 @@ class ConfigurationManager(object, metaclass=Singleton):
         if not key:
             raise KeyError("key cannot be empty")
         self._update(self.data, list(key), data)
+        self.modified_keys.add(tuple(key))
 
     def rename(self, old_key, new_key):
         """
@@ -99,6 +113,7 @@ class ConfigurationManager(object, metaclass=Singleton):
         except KeyError:
             raise ObjectNotFoundError("object %s does not exist" % '/'.join(old_key))
         self._insert(self.data, list(new_key), data)
+        self.modified_keys.update([tuple(old_key), tuple(new_key)])
 
     def delete(self, key):
         """
@@ -113,6 +128,8 @@ class ConfigurationManager(object, metaclass=Singleton):
             self._pop(self.data, list(key))
         except KeyError:
             pass
+        else:
+            self.modified_keys.add(tuple(key))
 
     def get(self, key):
         """
@@ -144,13 +161,91 @@ class ConfigurationManager(object, metaclass=Singleton):
         except KeyError:
             return []
 
-    def save(self):
+    def save(self, failure_data=None):
         """
         Flush the modified objects. Cannot be called before start().
+
+        In write-behind mode the data is only marked as modified and this
+        method returns immediately. If the delayed write fails, a
+        CFGManagerSaveFailed notification is posted for every save merged into
+        it, using failure_data (a NotificationData instance to which the
+        exception is added) when provided. Otherwise the data is written right
+        away and errors are raised to the caller.
         """
         if self.backend is None:
             raise RuntimeError("ConfigurationManager cannot be used unless started")
-        self.backend.save(self.data)
+        if self.save_delay is None:
+            self._save_data()
+            return
+        with self._save_lock:
+            if failure_data is not None:
+                self._save_failure_data.append(failure_data)
+            if self._save_pending:
+                return
+            self._save_pending = True
+            self._saved.clear()
+            if self.save_delay > 0:
+                self._save_timer = Timer(self.save_delay, call_in_thread, args=('file-io', self._flush))
+                self._save_timer.daemon = True
+                self._save_timer.start()
+            else:
+                schedule_in_thread('file-io', self._flush)
+
+    def flush(self):
+        """
+        Start writing the changes delayed in write-behind mode without waiting
+        for save_delay to expire. The write is performed in the 'file-io'
+        thread, use wait_saved() to wait for it to complete.
+        """
+        with self._save_lock:
+            if not self._save_pending:
+                return
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+        call_in_thread('file-io', self._flush)
+
+    def wait_saved(self, timeout=None):
+        """
+        Flush the changes delayed in write-behind mode and wait until they are
+        written. Returns False if the timeout expired before that.
+        """
+        self.flush()
+        return self._saved.wait(timeout)
+
+    def _flush(self):
+        with self._save_lock:
+            if not self._save_pending:
+                return
+            self._save_pending = False
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            failure_data, self._save_failure_data = self._save_failure_data, []
+        try:
+            self._save_data()
+        except Exception as e:
+            log.exception()
+            notification_center = NotificationCenter()
+            for data in failure_data or [NotificationData(object=None, operation='save', modified=None)]:
+                data.exception = e
+                notification_center.post_notification('CFGManagerSaveFailed', sender=self, data=data)
+        finally:
+            with self._save_lock:
+                if not self._save_pending:
+                    self._saved.set()
+
+    def _save_data(self):
+        from sipsimple.configuration.backend import IIncrementalConfigurationBackend
+        modified_keys, self.modified_keys = self.modified_keys, set()
+        try:
+            if IIncrementalConfigurationBackend.providedBy(self.backend):
+                self.backend.save_changes(self.data, list(modified_keys))
+            else:
+                self.backend.save(self.data)
+        except:
+            self.modified_keys.update(modified_keys)
+            raise
 
     def _get(self, data_tree, key):
         subtree_key = key.pop(0)
@@ -937,11 +1032,13 @@ class SettingsObject(SettingsState, metaclass=SettingsObjectMeta):
                 modified_data['__id__'] = modified_id
             notification_center.post_notification('CFGSettingsObjectDidChange', sender=self, data=NotificationData(modified=modified_data))
 
+        failure_data = NotificationData(object=self, operation='save', modified=modified_data)
         try:
-            configuration.save()
+            configuration.save(failure_data)
         except Exception as e:
             log.exception()
-            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=NotificationData(object=self, operation='save', modified=modified_data, exception=e))
+            failure_data.exception = e
+            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=failure_data)
 
     @run_in_thread('file-io')
     def delete(self):
@@ -958,11 +1055,13 @@ class SettingsObject(SettingsState, metaclass=SettingsObjectMeta):
         notification_center = NotificationCenter()
         configuration.delete(self.__oldkey__) # we need the key that wasn't yet saved
         notification_center.post_notification('CFGSettingsObjectWasDeleted', sender=self)
+        failure_data = NotificationData(object=self, operation='delete')
         try:
-            configuration.save()
+            configuration.save(failure_data)
         except Exception as e:
             log.exception()
-            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=NotificationData(object=self, operation='delete', exception=e))
+            failure_data.exception = e
+            notification_center.post_notification('CFGManagerSaveFailed', sender=configuration, data=failure_data)
 
     def clone(self, new_id):
         """
@@ -1,7 +1,7 @@
 
 """Base definitions for concrete implementations of configuration backends"""
 
-__all__ = ['ConfigurationBackendError', 'IConfigurationBackend']
+__all__ = ['ConfigurationBackendError', 'IConfigurationBackend', 'IIncrementalConfigurationBackend']
 
 
 from zope.interface import Interface
@@ -35,3 +35,18 @@ class IConfigurationBackend(Interface):
         """
 
 
+class IIncrementalConfigurationBackend(IConfigurationBackend):
+    """
+    Interface describing a configuration backend which is able to store only
+    the parts of the configuration data that changed since the last save.
+    """
+    def save_changes(data, keys):
+        """
+        Given a dictionary conforming to the definition in IConfigurationBackend
+        and a list of key paths (tuples of strings) that were modified since the
+        last save, save the changes using whatever means employed by the backend
+        implementation. A key path that no longer exists in data indicates that
+        the corresponding entry was removed.
+        """
+
+
@@ -4,10 +4,14 @@
 __all__ = ["FileParserError", "FileBuilderError", "FileBackend"]
 
 import errno
+import hashlib
+import marshal
 import os
 import re
 import platform
 import random
+import struct
+import sys
 from collections import deque
 
 from application.system import makedirs, openfile, unlink
@@ -54,16 +58,30 @@ class FileBackend(object):
 
 
     escape_characters_re = re.compile(r"""[,"'=: #\\\t\x0b\x0c\n\r]""")
+    simple_line_re = re.compile(r"""(\s*)([^\s"'\\#:=]+)\s*([:=])(?:\s*((?:[^\s"'\\#,]+\s*,\s*)*[^\s"'\\#,]+)(\s*,)?)?""")
+    whitespace_re = re.compile(r"\s*")
+    name_characters_re = re.compile(r"""[^\s"'\\#:=]+""")
+    value_characters_re = re.compile(r"""[^\s"'\\#,]+""")
+    quoted_characters_re = {'"': re.compile(r'[^"\\]+'), "'": re.compile(r"[^'\\]+")}
+    escaped_characters = {'n': '\n', 'r': '\r'}
 
-    def __init__(self, filename, encoding='utf-8'):
+    snapshot_magic = b'SIPSIMPLE-CONFIG-SNAPSHOT\0'
+
+    def __init__(self, filename, encoding='utf-8', snapshot=False):
         """
         Initialize the configuration backend with the specified file.
 
         The file is not read at this time, but rather each time the load method
         is called.
+
+        If snapshot is True, a binary copy of the parsed data is kept in a file
+        with the same name and a .snapshot suffix. The load method uses it
+        instead of parsing the text file as long as the checksum recorded in it
+        matches the content of the text file, and regenerates it otherwise.
         """
         self.filename = filename
         self.encoding = encoding
+        self.snapshot_filename = filename + '.snapshot' if snapshot else None
 
     def load(self):
         """
@@ -78,11 +96,19 @@ class FileBackend(object):
                 return {}
             else:
                 raise ConfigurationBackendError("failed to read configuration file: %s" % str(e))
+        with file:
+            content = file.read()
+
+        if self.snapshot_filename is not None:
+            checksum = hashlib.sha1(content).digest()
+            data = self._load_snapshot(checksum)
+            if data is not None:
+                return data
+        content = content.decode()
 
         state_stack = deque()
         state_stack.appendleft(GroupState(-1))
-        for lineno, line in enumerate(file, 1):
-            line = line.decode()
+        for lineno, line in enumerate(content.split('\n'), 1):
             line = self._parse_line(line, lineno)
             if not line.name:
                 continue
@@ -96,7 +122,10 @@ class FileBackend(object):
             elif line.separator == '=':
                 state_stack[0].data[line.name] = line.value
 
-        return state_stack[-1].data
+        data = state_stack[-1].data
+        if self.snapshot_filename is not None:
+            self._save_snapshot(data, checksum)
+        return data
 
     def save(self, data):
         """
@@ -105,13 +134,14 @@ class FileBackend(object):
         in a format suitable to be read back using load().
         """
         lines = self._build_group(data, 0)
+        content = (os.linesep.join(lines)+os.linesep).encode(self.encoding)
         config_directory = os.path.dirname(self.filename)
         tmp_filename = '%s.%d.%08X' % (self.filename, os.getpid(), random.getrandbits(32))
         try:
             if config_directory:
                 makedirs(config_directory)
             file = openfile(tmp_filename, 'wb', permissions=0o600)
-            file.write((os.linesep.join(lines)+os.linesep).encode(self.encoding))
+            file.write(content)
             file.close()
             if platform.system() == 'Windows':
                 # os.rename does not work on Windows if the destination file already exists.
@@ -120,76 +150,93 @@ class FileBackend(object):
             os.rename(tmp_filename, self.filename)
         except (IOError, OSError) as e:
             raise ConfigurationBackendError("failed to write configuration file: %s" % str(e))
+        if self.snapshot_filename is not None:
+            self._save_snapshot(self._plain_copy(data), hashlib.sha1(content).digest())
 
-    def _parse_line(self, line, lineno):
-        def advance_to_next_token(line):
-            counter = 0
-            while line and line[0].isspace():
-                line.popleft()
-                counter += 1
-            if line and line[0] == '#':
-                line.clear()
-            return counter
-        def token_iterator(line, delimiter=''):
-            quote_char = None
-            while line:
-                if quote_char is None and line[0] in delimiter:
-                    break
-                char = line.popleft()
-                if char in "'\"":
-                    if quote_char is None:
-                        quote_char = char
-                        continue
-                    elif quote_char == char:
-                        quote_char = None
-                        continue
-                    else:
-                        yield char
-                elif char == '\\':
-                    if not line:
-                        raise FileParserError("unexpected `\\' at end of line %d" % lineno)
-                    char = line.popleft()
-                    if char == 'n':
-                        yield '\n'
-                    elif char == 'r':
-                        yield '\r'
-                    else:
-                        yield char
-                elif quote_char is None and char == '#':
-                    line.clear()
-                    break
-                elif quote_char is None and char.isspace():
-                    break
-                else:
-                    yield char
-            if quote_char is not None:
-                raise FileParserError("missing ending quote at line %d" % lineno)
+    def _snapshot_header(self, checksum):
+        # marshal is specific to the interpreter version, so that is part of the header as well
+        return self.snapshot_magic + struct.pack('<II', marshal.version, sys.hexversion) + checksum
+
+    def _load_snapshot(self, checksum):
+        header = self._snapshot_header(checksum)
+        try:
+            with open(self.snapshot_filename, 'rb') as file:
+                snapshot = file.read()
+        except (IOError, OSError):
+            return None
+        if not snapshot.startswith(header):
+            return None
+        try:
+            data = marshal.loads(memoryview(snapshot)[len(header):])
+        except (EOFError, ValueError, TypeError):
+            return None
+        return data if type(data) is dict else None
+
+    def _save_snapshot(self, data, checksum):
+        # The snapshot is only a cache, failing to write it must not affect loading or saving the configuration
+        tmp_filename = '%s.%d.%08X' % (self.snapshot_filename, os.getpid(), random.getrandbits(32))
+        try:
+            snapshot = self._snapshot_header(checksum) + marshal.dumps(data)
+            file = openfile(tmp_filename, 'wb', permissions=0o600)
+            file.write(snapshot)
+            file.close()
+            if platform.system() == 'Windows':
+                unlink(self.snapshot_filename)
+            os.rename(tmp_filename, self.snapshot_filename)
+        except (IOError, OSError, ValueError):
+            try:
+                unlink(tmp_filename)
+            except (IOError, OSError):
+                pass
+
+    def _plain_copy(self, data):
+        # marshal only handles the exact builtin types, while keys may be str subclasses (PersistentKey).
+        # Values are normalized the way they are read back from the text format, where an empty list
+        # is written as an empty value.
+        if type(data) is dict:
+            return {str(name): self._plain_copy(value) for name, value in data.items()}
+        elif type(data) is list:
+            return [str(item) for item in data] or None
+        elif data is None:
+            return None
+        else:
+            return str(data)
 
-        line = deque(line.rstrip())
-        indentation = advance_to_next_token(line)
-        if not line:
+    def _parse_line(self, line, lineno):
+        line = line.rstrip()
+        match = self.simple_line_re.fullmatch(line)
+        if match is not None and (match.group(3) == '=' or match.group(4) is None):
+            # fast path for lines without quotes, escapes or comments
+            indentation, name, separator, value, list_end = match.groups()
+            if value is not None and (list_end is not None or ',' in value):
+                value = [item.strip() for item in value.split(',')]
+            return Line(len(indentation), name, separator, value)
+        length = len(line)
+        position = indentation = self.whitespace_re.match(line).end()
+        if position < length and line[position] == '#':
+            position = length
+        if position == length:
             return Line(indentation, None, None, None)
-        name = ''.join(token_iterator(line, delimiter=':='))
-        advance_to_next_token(line)
-        if not line or line[0] not in ':=':
+        name, position = self._parse_token(line, position, self.name_characters_re, ':=', lineno)
+        position = self._skip_whitespace(line, position)
+        if position == length or line[position] not in ':=':
             raise FileParserError("expected one of `:' or `=' at line %d" % lineno)
         if not name:
             raise FileParserError("missing setting/section name at line %d" % lineno)
-        separator = line.popleft()
-        advance_to_next_token(line)
-        if not line:
+        separator = line[position]
+        position = self._skip_whitespace(line, position+1)
+        if position == length:
             return Line(indentation, name, separator, None)
         elif separator == ':':
             raise FileParserError("unexpected characters after `:' at line %d" % lineno)
         value = None
         value_list = None
-        while line:
-            value = ''.join(token_iterator(line, delimiter=','))
-            advance_to_next_token(line)
-            if line:
-                if line[0] == ',':
-                    line.popleft()
-                    advance_to_next_token(line)
+        while position < length:
+            value, position = self._parse_token(line, position, self.value_characters_re, ',', lineno)
+            position = self._skip_whitespace(line, position)
+            if position < length:
+                if line[position] == ',':
+                    position = self._skip_whitespace(line, position+1)
                     if value_list is None:
                         value_list = []
                 else:
@@ -199,6 +246,51 @@ class FileBackend(object):
         value = value_list if value_list is not None else value
         return Line(indentation, name, separator, value)
 
+    def _skip_whitespace(self, line, position):
+        """Return the position of the next token, or the end of the line if a comment follows"""
+        position = self.whitespace_re.match(line, position).end()
+        if position < len(line) and line[position] == '#':
+            return len(line)
+        return position
+
+    def _parse_token(self, line, position, characters_re, delimiter, lineno):
+        """Parse the token starting at position and return it together with the position after it"""
+        length = len(line)
+        chunks = []
+        quote_char = None
+        while position < length:
+            if quote_char is None:
+                match = characters_re.match(line, position)
+            else:
+                match = self.quoted_characters_re[quote_char].match(line, position)
+            if match is not None:
+                chunks.append(match.group())
+                position = match.end()
+                continue
+            char = line[position]
+            if quote_char is None and char in delimiter:
+                break
+            position += 1
+            if char in "'\"":
+                if quote_char is None:
+                    quote_char = char
+                elif quote_char == char:
+                    quote_char = None
+            elif char == '\\':
+                if position == length:
+                    raise FileParserError("unexpected `\\' at end of line %d" % lineno)
+                char = line[position]
+                position += 1
+                chunks.append(self.escaped_characters.get(char, char))
+            elif char == '#':
+                position = length
+                break
+            else:  # whitespace outside quotes ends the token
+                break
+        if quote_char is not None:
+            raise FileParserError("missing ending quote at line %d" % lineno)
+        return ''.join(chunks), position
+
     def _build_group(self, group, indentation):
         setting_lines = []
         group_lines = []
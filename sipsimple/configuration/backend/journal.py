@@ -0,0 +1,152 @@
+
+"""Configuration backend for storing settings as a snapshot and an append-only journal of changes"""
+
+__all__ = ["JournalBackend"]
+
+import errno
+import json
+import os
+
+from application.system import makedirs, openfile, unlink
+from zope.interface import implementer
+
+from sipsimple.configuration.backend import IIncrementalConfigurationBackend, ConfigurationBackendError
+from sipsimple.configuration.backend.file import FileBackend
+
+
+@implementer(IIncrementalConfigurationBackend)
+class JournalBackend(object):
+    """
+    Implementation of a configuration backend that keeps a snapshot of the
+    data in the plain text format used by FileBackend and records subsequent
+    changes in an append-only journal, one JSON record per line.
+
+    Each record replaces or removes the entry found under a key path, so only
+    the modified objects are written when settings are saved. Once the journal
+    grows larger than the snapshot (and at least compaction_size bytes), the
+    data is compacted into a new snapshot and the journal is truncated. An
+    incomplete record at the end of the journal, left behind by a crash while
+    appending, is ignored when loading.
+    """
+
+    def __init__(self, filename, encoding='utf-8', compaction_size=1048576, sync=False):
+        """
+        Initialize the configuration backend with the specified snapshot file.
+        The journal is kept in a file with the same name and a .journal suffix.
+        If sync is True, the journal is flushed to disk after each save.
+        """
+        self.filename = filename
+        self.journal_filename = filename + '.journal'
+        self.encoding = encoding
+        self.compaction_size = compaction_size
+        self.sync = sync
+        self.snapshot_backend = FileBackend(filename, encoding)
+        self._snapshot_size = 0
+        self._journal_size = 0
+
+    def load(self):
+        """
+        Read the snapshot and replay the journal on top of it, returning a
+        dictionary conforming to the IConfigurationBackend specification.
+        """
+        data = self.snapshot_backend.load()
+        try:
+            self._snapshot_size = os.path.getsize(self.filename)
+        except OSError:
+            self._snapshot_size = 0
+        try:
+            file = open(self.journal_filename, 'rb')
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                self._journal_size = 0
+                return data
+            else:
+                raise ConfigurationBackendError("failed to read configuration journal: %s" % str(e))
+        with file:
+            journal = file.read()
+        self._journal_size = 0
+        for lineno, line in enumerate(journal.splitlines(True), 1):
+            if not line.endswith(b'\n'):
+                break  # incomplete record written during a crash
+            try:
+                record = json.loads(line.decode(self.encoding))
+                self._apply_record(data, record)
+            except (ValueError, KeyError, TypeError) as e:
+                raise ConfigurationBackendError("invalid configuration journal record at line %d: %s" % (lineno, str(e)))
+            self._journal_size += len(line)
+        if self._journal_size < len(journal):
+            # drop the incomplete record, otherwise the next one would be appended to it
+            try:
+                with open(self.journal_filename, 'r+b') as file:
+                    file.truncate(self._journal_size)
+            except (IOError, OSError) as e:
+                raise ConfigurationBackendError("failed to truncate configuration journal: %s" % str(e))
+        return data
+
+    def save(self, data):
+        """
+        Given a dictionary conforming to the IConfigurationBackend
+        specification, write a new snapshot of the data and clear the journal.
+        """
+        self.snapshot_backend.save(data)
+        try:
+            unlink(self.journal_filename)
+        except (IOError, OSError) as e:
+            raise ConfigurationBackendError("failed to clear configuration journal: %s" % str(e))
+        try:
+            self._snapshot_size = os.path.getsize(self.filename)
+        except OSError:
+            self._snapshot_size = 0
+        self._journal_size = 0
+
+    def save_changes(self, data, keys):
+        """
+        Append a record for each of the modified key paths to the journal and
+        compact it into a new snapshot if it became too large.
+        """
+        records = []
+        for key in sorted(set(tuple(key) for key in keys)):
+            subtree = data
+            for index, name in enumerate(key):
+                if type(subtree) is not dict or name not in subtree:
+                    records.append(dict(key=list(key[:index+1]), deleted=True))
+                    break
+                subtree = subtree[name]
+            else:
+                records.append(dict(key=list(key), value=subtree))
+        if not records:
+            return
+        journal = ''.join(json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n' for record in records).encode(self.encoding)
+        try:
+            config_directory = os.path.dirname(self.journal_filename)
+            if config_directory:
+                makedirs(config_directory)
+            with openfile(self.journal_filename, 'ab', permissions=0o600) as file:
+                file.write(journal)
+                if self.sync:
+                    file.flush()
+                    os.fsync(file.fileno())
+        except (IOError, OSError) as e:
+            raise ConfigurationBackendError("failed to write configuration journal: %s" % str(e))
+        self._journal_size += len(journal)
+        if self._journal_size >= max(self.compaction_size, self._snapshot_size):
+            self.save(data)
+
+    def _apply_record(self, data, record):
+        key = record['key']
+        if not key:
+            raise ValueError("empty key")
+        parent = data
+        for name in key[:-1]:
+            subtree = parent.get(name)
+            if type(subtree) is not dict:
+                if record.get('deleted', False):
+                    return
+                subtree = parent[name] = {}
+            parent = subtree
+        if record.get('deleted', False):
+            parent.pop(key[-1], None)
+        else:
+            parent[key[-1]] = record['value']
+
+
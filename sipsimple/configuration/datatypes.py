@@ -7,7 +7,7 @@ __all__ = [
            # Generic datatypes
            'ContentType', 'ContentTypeList', 'CountryCode', 'NonNegativeInteger', 'PositiveInteger', 'SIPAddress',
            # Custom datatypes
-           'PJSIPLogLevel',
+           'PJSIPLogLevel', 'FileSyncPolicy',
            # Audio datatypes
            'AudioCodecList', 'SampleRate',
            # Video datatypes
@@ -203,6 +203,16 @@ class PJSIPLogLevel(int):
         return value
 
 
+class FileSyncPolicy(str):
+    available_values = ('none', 'end', 'always')
+
+    def __new__(cls, value):
+        value = str(value)
+        if value not in cls.available_values:
+            raise ValueError("illegal value for file sync policy: %s" % value)
+        return value
+
+
 class CodecList(List):
     type = str
     available_values = None    # to be defined in a subclass
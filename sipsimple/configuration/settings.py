@@ -7,7 +7,7 @@ Definition of general (non-account related) settings.
 
 from sipsimple import __version__
 from sipsimple.configuration import CorrelatedSetting, RuntimeSetting, Setting, SettingsGroup, SettingsObject
-from sipsimple.configuration.datatypes import NonNegativeInteger, PJSIPLogLevel
+from sipsimple.configuration.datatypes import NonNegativeInteger, PositiveInteger, PJSIPLogLevel, FileSyncPolicy
 from sipsimple.configuration.datatypes import AudioCodecList, SampleRate, VideoCodecList
 from sipsimple.configuration.datatypes import Port, PortRange, SIPTransportList
 from sipsimple.configuration.datatypes import Path
@@ -56,6 +56,11 @@ class ScreenSharingSettings(SettingsGroup):
 
 class FileTransferSettings(SettingsGroup):
     directory = Setting(type=Path, default=Path('~/Downloads'))
+    chunk_size = Setting(type=PositiveInteger, default=64*1024)
+    window_size = Setting(type=PositiveInteger, default=16)
+    write_buffer_size = Setting(type=PositiveInteger, default=1024*1024)
+    preallocate = Setting(type=bool, default=False)
+    sync_policy = Setting(type=FileSyncPolicy, default='none')
 
 
 class LogsSettings(SettingsGroup):
@@ -68,6 +73,8 @@ class LogsSettings(SettingsGroup):
 class RTPSettings(SettingsGroup):
     port_range = Setting(type=PortRange, default=PortRange(50000, 50500))
     timeout = Setting(type=NonNegativeInteger, default=30)
+    transport_pool_size = Setting(type=NonNegativeInteger, default=0)
+    transport_pool_max_age = Setting(type=PositiveInteger, default=60)
     audio_codec_list = Setting(type=AudioCodecList, default=AudioCodecList(('opus', 'G722', 'PCMU', 'PCMA', 'speex', 'iLBC', 'GSM')))
     video_codec_list = Setting(type=VideoCodecList, default=VideoCodecList(('H264', 'VP8', 'VP9')))
 
@@ -2,13 +2,16 @@
 # C types
 
 cdef struct _core_event:
-    _core_event *prev
-    _core_event *next
     int is_log
     int level
     void *data
     int len
 
+cdef struct _core_event_buffer:
+    _core_event *events
+    int count
+    int size
+
 cdef struct _handler:
     _handler *next
     _handler *prev
@@ -22,89 +25,107 @@ cdef struct _handler_queue:
 # callback functions
 
 cdef void _cb_log(int level, char_ptr_const data, int len):
-    cdef _core_event *event
-    event = <_core_event *> malloc(sizeof(_core_event))
-    if event != NULL:
-        event.data = malloc(len)
-        if event.data == NULL:
-            free(event)
-            return
-        event.is_log = 1
-        event.level = level
-        memcpy(event.data, data, len)
-        event.len = len
-        if _event_queue_append(event) != 0:
-            free(event.data)
-            free(event)
+    cdef void *event_data
+    event_data = malloc(len)
+    if event_data == NULL:
+        return
+    memcpy(event_data, data, len)
+    if _event_queue_append(1, level, event_data, len) != 0:
+        free(event_data)
 
 # functions
 
 cdef int _add_event(object event_name, dict params) except -1:
     cdef tuple data
-    cdef _core_event *event
     cdef int status
-    event = <_core_event *> malloc(sizeof(_core_event))
-    if event == NULL:
-        raise MemoryError()
     data = (event_name, params)
-    event.is_log = 0
-    event.data = <void *> data
-    status = _event_queue_append(event)
-    if status != 0:
+    status = _event_queue_append(0, 0, <void *> data, 0)
+    if status == -1:
+        raise MemoryError()
+    elif status != 0:
         raise PJSIPError("Could not obtain lock", status)
     Py_INCREF(data)
     return 0
 
-cdef int _event_queue_append(_core_event *event):
-    global _event_queue_head, _event_queue_tail, _event_queue_lock
+cdef int _event_buffer_reserve(_core_event_buffer *buffer) nogil:
+    # Make room for one more event, growing the buffer geometrically when it is full
+    cdef _core_event *events
+    cdef int size
+    if buffer.count < buffer.size:
+        return 0
+    size = buffer.size * 2 if buffer.size > 0 else _EVENT_BUFFER_INITIAL_SIZE
+    events = <_core_event *> realloc(buffer.events, size * sizeof(_core_event))
+    if events == NULL:
+        return -1
+    buffer.events = events
+    buffer.size = size
+    return 0
+
+cdef int _event_queue_append(int is_log, int level, void *data, int len) nogil:
+    # Events are stored in one of two preallocated buffers. Producers append to the active
+    # buffer while the engine thread drains the other one, so no allocation happens per event
+    # and the lock is only held for the time it takes to store a few fields.
+    global _event_buffer_index, _event_queue_lock
+    cdef _core_event_buffer *buffer
+    cdef _core_event *event
     cdef int locked = 0, status
-    event.next = NULL
     if _event_queue_lock != NULL:
         status = pj_mutex_lock(_event_queue_lock)
         if status != 0:
             return status
         locked = 1
-    if _event_queue_head == NULL:
-        event.prev = NULL
-        _event_queue_head = event
-        _event_queue_tail = event
-    else:
-        _event_queue_tail.next = event
-        event.prev = _event_queue_tail
-        _event_queue_tail = event
+    buffer = &_event_buffers[_event_buffer_index]
+    status = _event_buffer_reserve(buffer)
+    if status == 0:
+        event = &buffer.events[buffer.count]
+        event.is_log = is_log
+        event.level = level
+        event.data = data
+        event.len = len
+        buffer.count += 1
     if locked:
         pj_mutex_unlock(_event_queue_lock)
-    return 0
+    if status == 0:
+        _signal_wakeup()
+    return status
 
 cdef list _get_clear_event_queue():
-    global _re_log, _event_queue_head, _event_queue_tail, _event_queue_lock
-    cdef object events = []
+    # Swap the active buffer and convert the whole drained batch at once. This must only be
+    # called from the thread running PJSIPUA.poll, as it is the single consumer of the queue.
+    global _event_buffer_index, _event_queue_lock
+    cdef list events
+    cdef _core_event_buffer *buffer
     cdef _core_event *event
-    cdef _core_event *event_free
     cdef object event_tup
-    cdef object event_params, log_msg, log_match
-    cdef int locked = 0
+    cdef object event_params, log_msg
+    cdef int locked = 0, status, index
     if _event_queue_lock != NULL:
         status = pj_mutex_lock(_event_queue_lock)
         if status != 0:
-            return status
+            raise PJSIPError("Could not obtain lock", status)
         locked = 1
-    event = _event_queue_head
-    _event_queue_head = _event_queue_tail = NULL
+    buffer = &_event_buffers[_event_buffer_index]
+    _event_buffer_index ^= 1
     if locked:
         pj_mutex_unlock(_event_queue_lock)
-    while event != NULL:
+    events = [None] * buffer.count
+    for index in range(buffer.count):
+        event = &buffer.events[index]
         if event.is_log:
             log_msg = _pj_buf_len_to_str(<char *> event.data, event.len)
+            free(event.data)
             event_params = dict(level=event.level, message=log_msg)
-            events.append(("SIPEngineLog", event_params))
+            events[index] = ("SIPEngineLog", event_params)
         else:
             event_tup = <object> event.data
             Py_DECREF(event_tup)
-            events.append(event_tup)
-        event_free = event
-        event = event.next
-        free(event_free)
+            events[index] = event_tup
+    buffer.count = 0
+    if buffer.size > _EVENT_BUFFER_MAX_IDLE_SIZE:
+        # release the memory used by an exceptional burst of events
+        free(buffer.events)
+        buffer.events = NULL
+        buffer.size = 0
     return events
 
 cdef int _add_handler(int func(object obj) except -1, object obj, _handler_queue *queue) except -1:
@@ -164,8 +185,13 @@ cdef int _process_handler_queue(PJSIPUA ua, _handler_queue *queue) except -1:
 # globals
 
 cdef pj_mutex_t *_event_queue_lock = NULL
-cdef _core_event *_event_queue_head = NULL
-cdef _core_event *_event_queue_tail = NULL
+cdef int _EVENT_BUFFER_INITIAL_SIZE = 1024
+cdef int _EVENT_BUFFER_MAX_IDLE_SIZE = 65536
+cdef _core_event_buffer _event_buffers[2]
+cdef int _event_buffer_index = 0
+_event_buffers[0].events = _event_buffers[1].events = NULL
+_event_buffers[0].count = _event_buffers[1].count = 0
+_event_buffers[0].size = _event_buffers[1].size = 0
 cdef _handler_queue _post_poll_handler_queue
 _post_poll_handler_queue.head = NULL
 _post_poll_handler_queue.tail = NULL
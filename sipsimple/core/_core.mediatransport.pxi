@@ -61,6 +61,7 @@ cdef class RTPTransport:
                 pjmedia_transport_close(transport)
             self._obj = NULL
             self._wrapped_transport = NULL
+        self._release_rtp_port(ua)
         ua.release_memory_pool(self._pool)
         self._pool = NULL
         if self._lock != NULL:
@@ -83,6 +84,12 @@ cdef class RTPTransport:
             self._pool = NULL
             return None
 
+    cdef int _release_rtp_port(self, PJSIPUA ua) except -1:
+        if self._rtp_port != 0:
+            ua._release_rtp_port(self._rtp_port, self._rtp_port_generation)
+            self._rtp_port = 0
+        return 0
+
     cdef void _get_info(self, pjmedia_transport_info *info):
         cdef int status
         cdef pjmedia_transport *transport
@@ -554,15 +561,24 @@ cdef class RTPTransport:
                     if status != 0:
                         raise PJSIPError("Could not create ICE media transport", status)
                 else:
-                    status = PJ_EBUG
-                    for i in xrange(ua._rtp_port_index, ua._rtp_port_index + ua._rtp_port_usable_count, 2):
-                        port = ua._rtp_port_start + i % ua._rtp_port_usable_count
+                    status = PJ_ETOOMANY
+                    for i in xrange(ua._rtp_port_usable_count // 2):
+                        port = ua._allocate_rtp_port()
+                        if port == -1:
+                            break
                         with nogil:
                             status = pjmedia_transport_udp_create3(media_endpoint, af, NULL, local_ip_address,
                                                                    port, 0, transport_address)
+                        if status == 0:
+                            self._rtp_port = port
+                            self._rtp_port_generation = ua._rtp_port_generation
+                            break
                         if status != PJ_ERRNO_START_SYS + EADDRINUSE:
-                            ua._rtp_port_index = (i + 2) % ua._rtp_port_usable_count
+                            ua._release_rtp_port(port, ua._rtp_port_generation, 0)
                             break
+                        # the port is used by someone else, keep it in quarantine for a while
+                        ua._release_rtp_port(port, ua._rtp_port_generation)
+                        ua._rtp_port_bind_failures += 1
                     if status != 0:
                         raise PJSIPError("Could not create UDP/RTP media transport", status)
                 self._obj.user_data = <void *> self.weakref
@@ -580,6 +596,7 @@ cdef class RTPTransport:
                             with nogil:
                                 pjmedia_transport_close(wrapped_transport)
                             self._wrapped_transport = NULL
+                            self._release_rtp_port(ua)
                             raise PJSIPError("Could not create SRTP media transport", status)
                     elif self._encryption == 'zrtp':
                         with nogil:
@@ -594,6 +611,7 @@ cdef class RTPTransport:
                             with nogil:
                                 pjmedia_transport_close(wrapped_transport)
                             self._wrapped_transport = NULL
+                            self._release_rtp_port(ua)
                             raise PJSIPError("Could not create ZRTP media transport", status)
                     else:
                         raise RuntimeError('invalid SRTP key negotiation specified: %s' % self._encryption)
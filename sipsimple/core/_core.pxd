@@ -7,8 +7,8 @@ cdef extern from *:
 
 # system imports
 
-from libc.stdlib cimport malloc, free
-from libc.string cimport memcpy
+from libc.stdlib cimport malloc, realloc, free
+from libc.string cimport memcpy, memset
 
 
 # Python C imports
@@ -19,6 +19,7 @@ from cpython.bytes cimport PyBytes_FromString, PyBytes_FromStringAndSize, PyByte
 
 cdef extern from "Python.h":
     object PyUnicode_FromString(const char *u)
+    unsigned long PyThread_get_thread_ident() nogil
 
 
 # PJSIP imports
@@ -107,7 +108,24 @@ cdef extern from "pjlib.h":
     # sockets
     enum:
         PJ_INET6_ADDRSTRLEN
+    enum:
+        PJ_INVALID_SOCKET
+    enum:
+        PJ_EPENDING
+    ctypedef long pj_sock_t
+    ctypedef long pj_ssize_t
     struct pj_ioqueue_t
+    struct pj_ioqueue_key_t
+    struct pj_ioqueue_op_key_t:
+        void *user_data
+    struct pj_ioqueue_callback:
+        void on_read_complete(pj_ioqueue_key_t *key, pj_ioqueue_op_key_t *op_key, pj_ssize_t bytes_read) nogil
+    int pj_sock_send(pj_sock_t sockfd, void *buf, pj_ssize_t *len, unsigned int flags) nogil
+    int pj_ioqueue_register_sock(pj_pool_t *pool, pj_ioqueue_t *ioque, pj_sock_t sock, void *user_data,
+                                 pj_ioqueue_callback *cb, pj_ioqueue_key_t **key) nogil
+    int pj_ioqueue_unregister(pj_ioqueue_key_t *key) nogil
+    void pj_ioqueue_op_key_init(pj_ioqueue_op_key_t *op_key, int size) nogil
+    int pj_ioqueue_recv(pj_ioqueue_key_t *key, pj_ioqueue_op_key_t *op_key, void *buffer, pj_ssize_t *length, unsigned int flags) nogil
     struct pj_addr_hdr:
         unsigned int sa_family
     struct pj_sockaddr_in:
@@ -153,6 +171,7 @@ cdef extern from "pjlib.h":
         void *next
     void pj_list_init(pj_list *node) nogil
     void pj_list_insert_after(pj_list *pos, pj_list *node) nogil
+    void pj_list_insert_before(pj_list *pos, pj_list *node) nogil
 
     # random
     void pj_srand(unsigned int seed) nogil
@@ -305,7 +324,11 @@ cdef extern from "pjmedia.h":
         int denum
 
     # frame
+    enum pjmedia_frame_type:
+        PJMEDIA_FRAME_TYPE_NONE
+        PJMEDIA_FRAME_TYPE_AUDIO
     struct pjmedia_frame:
+        pjmedia_frame_type type
         void *buf
         int size
     ctypedef pjmedia_frame *pjmedia_frame_ptr_const "const pjmedia_frame *"
@@ -850,6 +873,20 @@ cdef extern from "pjmedia.h":
     int pjmedia_wav_player_set_eof_cb(pjmedia_port *port, void *user_data,
                                       int cb(pjmedia_port *port, void *usr_data) with gil) nogil
     int pjmedia_wav_player_port_set_pos(pjmedia_port *port, unsigned int offset) nogil
+    int pjmedia_port_get_frame(pjmedia_port *port, pjmedia_frame *frame) nogil
+
+    # memory player
+    enum:
+        PJMEDIA_MEM_NO_LOOP
+    int pjmedia_mem_player_create(pj_pool_t *pool, void *buffer, int size, unsigned int clock_rate,
+                                  unsigned int channel_count, unsigned int samples_per_frame,
+                                  unsigned int bits_per_sample, unsigned int options, pjmedia_port **p_port) nogil
+    int pjmedia_mem_player_set_eof_cb(pjmedia_port *port, void *user_data,
+                                      int cb(pjmedia_port *port, void *usr_data) with gil) nogil
+
+    # resample port
+    int pjmedia_resample_port_create(pj_pool_t *pool, pjmedia_port *dn_port, unsigned int clock_rate,
+                                     unsigned int options, pjmedia_port **p_port) nogil
 
     # wav recorder
     enum pjmedia_file_writer_option:
@@ -1089,6 +1126,7 @@ cdef extern from "pjsip.h":
     enum:
         PJSIP_PARSE_URI_AS_NAMEADDR
     pjsip_uri *pjsip_parse_uri(pj_pool_t *pool, char *buf, unsigned int size, unsigned int options) nogil
+    pjsip_msg *pjsip_parse_msg(pj_pool_t *pool, char *buf, unsigned int size, void *err_list) nogil
     void pjsip_method_init_np(pjsip_method *m, pj_str_t *str) nogil
     pj_str_t *pjsip_get_status_text(int status_code) nogil
     int pjsip_print_body(pjsip_msg_body *msg_body, char **buf, int *len)
@@ -1117,6 +1155,7 @@ cdef extern from "pjsip.h":
     pj_pool_t *pjsip_endpt_create_pool(pjsip_endpoint *endpt, char *pool_name, int initial, int increment) nogil
     void pjsip_endpt_release_pool(pjsip_endpoint *endpt, pj_pool_t *pool) nogil
     int pjsip_endpt_handle_events(pjsip_endpoint *endpt, pj_time_val *max_timeout) nogil
+    pj_ioqueue_t *pjsip_endpt_get_ioqueue(pjsip_endpoint *endpt) nogil
     int pjsip_endpt_register_module(pjsip_endpoint *endpt, pjsip_module *module) nogil
     int pjsip_endpt_schedule_timer(pjsip_endpoint *endpt, pj_timer_entry *entry, pj_time_val *delay) nogil
     void pjsip_endpt_cancel_timer(pjsip_endpoint *endpt, pj_timer_entry *entry) nogil
@@ -1414,6 +1453,20 @@ cdef class PJSTR(object):
     cdef pj_str_t pj_str
     cdef object str
 
+cdef class MessageHeaders(object):
+    # attributes
+    cdef object __weakref__
+    cdef pj_pool_t *_pool
+    cdef pj_list _headers
+    cdef dict _names
+    cdef dict _converted
+    cdef int _complete
+
+    # private methods
+    cdef object _convert(self, object name)
+    cdef int _convert_all(self) except -1
+    cdef int _release(self) except -1
+
 # core.lib
 
 cdef class PJLIB(object):
@@ -1791,6 +1844,9 @@ cdef object _str_as_size(object string)
 
 cdef dict _pjsip_param_to_dict(pjsip_param *param_list)
 cdef int _dict_to_pjsip_param(object params, pjsip_param *param_list, pj_pool_t *pool)
+cdef object _pjsip_hdr_to_object(pjsip_hdr *header, object header_name)
+cdef MessageHeaders MessageHeaders_create(pjsip_msg *msg)
+cdef int _release_message_headers() except -1
 cdef int _pjsip_msg_to_dict(pjsip_msg *msg, dict info_dict) except -1
 cdef int _is_valid_ip(int af, object ip) except -1
 cdef int _get_ip_version(object ip) except -1
@@ -1805,6 +1861,7 @@ ctypedef int (*timer_callback)(object, object) except -1
 cdef class Timer(object):
     # attributes
     cdef int _scheduled
+    cdef int _heap_index
     cdef double schedule_time
     cdef timer_callback callback
     cdef object obj
@@ -1824,6 +1881,8 @@ cdef class PJSIPUA(object):
     cdef object _threads
     cdef object _event_handler
     cdef list _timers
+    cdef unsigned long _timers_fired
+    cdef unsigned long _timers_cancelled
     cdef PJLIB _pjlib
     cdef PJCachingPool _caching_pool
     cdef PJSIPEndpoint _pjsip_endpoint
@@ -1849,6 +1908,13 @@ cdef class PJSIPUA(object):
     cdef int _rtp_port_count
     cdef int _rtp_port_usable_count
     cdef int _rtp_port_index
+    cdef int _rtp_port_generation
+    cdef int _rtp_ports_reserved
+    cdef bytearray _rtp_port_bitmap
+    cdef object _rtp_port_quarantine
+    cdef double _rtp_port_quarantine_time
+    cdef unsigned long _rtp_port_allocations
+    cdef unsigned long _rtp_port_bind_failures
     cdef pj_stun_config _stun_cfg
     cdef int _fatal_error
     cdef set _incoming_events
@@ -1858,6 +1924,8 @@ cdef class PJSIPUA(object):
     cdef list old_devices
     cdef list old_video_devices
     cdef object _zrtp_cache
+    cdef object _wakeup_socket
+    cdef float _poll_timeout
 
     # private methods
     cdef object _get_sound_devices(self, int is_output)
@@ -1868,8 +1936,15 @@ cdef class PJSIPUA(object):
     cdef int _handle_exception(self, int is_fatal) except -1
     cdef int _check_self(self) except -1
     cdef int _check_thread(self) except -1
+    cdef int _init_wakeup(self) except -1
     cdef int _add_timer(self, Timer timer) except -1
     cdef int _remove_timer(self, Timer timer) except -1
+    cdef Timer _pop_timer(self)
+    cdef int _sift_timer_up(self, int index) except -1
+    cdef int _sift_timer_down(self, int index) except -1
+    cdef int _allocate_rtp_port(self) except -2
+    cdef int _release_rtp_port(self, int port, int generation, int quarantine=*) except -1
+    cdef int _expire_rtp_port_quarantine(self) except -1
     cdef int _cb_rx_request(self, pjsip_rx_data *rdata) except 0
 
     cdef pj_pool_t* create_memory_pool(self, bytes name, int initial_size, int resize_size)
@@ -1877,6 +1952,7 @@ cdef class PJSIPUA(object):
     cdef void reset_memory_pool(self, pj_pool_t* pool)
 
 cdef int _PJSIPUA_cb_rx_request(pjsip_rx_data *rdata) with gil
+cdef void _cb_wakeup_read(pj_ioqueue_key_t *key, pj_ioqueue_op_key_t *op_key, pj_ssize_t bytes_read) nogil
 cdef void _cb_detect_nat_type(void *user_data, pj_stun_nat_detect_result_ptr_const res) with gil
 cdef int _cb_opus_fix_tx(pjsip_tx_data *tdata) with gil
 cdef int _cb_trace_rx(pjsip_rx_data *rdata) with gil
@@ -1885,6 +1961,8 @@ cdef int _cb_add_user_agent_hdr(pjsip_tx_data *tdata) with gil
 cdef int _cb_add_server_hdr(pjsip_tx_data *tdata) with gil
 cdef PJSIPUA _get_ua()
 cdef int deallocate_weakref(object weak_ref, object timer) except -1 with gil
+cdef void _start_wakeup_read() nogil
+cdef void _signal_wakeup() nogil
 
 # core.sound
 
@@ -1900,7 +1978,7 @@ cdef class AudioMixer(object):
     cdef pjmedia_master_port *_master_port
     cdef pjmedia_port *_null_port
     cdef pjmedia_snd_port *_snd
-    cdef list _connected_slots
+    cdef set _connected_slots
     cdef readonly int ec_tail_length
     cdef readonly int sample_rate
     cdef readonly int slot_count
@@ -1963,6 +2041,24 @@ cdef class WaveFile(object):
     cdef int _stop(self, PJSIPUA ua, int notify) except -1
     cdef int _cb_eof(self, timer) except -1
 
+cdef class MemoryPlayer(object):
+    # attributes
+    cdef object __weakref__
+    cdef object weakref
+    cdef int _slot
+    cdef int _volume
+    cdef pj_mutex_t *_lock
+    cdef pj_pool_t *_pool
+    cdef pjmedia_port *_port
+    cdef readonly object data
+    cdef readonly int sample_rate
+    cdef readonly AudioMixer mixer
+
+    # private methods
+    cdef PJSIPUA _check_ua(self)
+    cdef int _stop(self, PJSIPUA ua, int notify) except -1
+    cdef int _cb_eof(self, timer) except -1
+
 cdef class MixerPort(object):
     cdef int _slot
     cdef int _was_started
@@ -1977,6 +2073,7 @@ cdef class MixerPort(object):
 
 cdef int _AudioMixer_dealloc_handler(object obj) except -1
 cdef int cb_play_wav_eof(pjmedia_port *port, void *user_data) with gil
+cdef int cb_play_memory_eof(pjmedia_port *port, void *user_data) with gil
 
 # core.video
 
@@ -2046,8 +2143,10 @@ cdef void _stop_video_port(pjmedia_vid_port *port)
 # core.event
 
 cdef struct _core_event
+cdef struct _core_event_buffer
 cdef struct _handler_queue
-cdef int _event_queue_append(_core_event *event)
+cdef int _event_buffer_reserve(_core_event_buffer *buffer) nogil
+cdef int _event_queue_append(int is_log, int level, void *data, int len) nogil
 cdef void _cb_log(int level, char_ptr_const data, int len)
 cdef int _add_event(object event_name, dict params) except -1
 cdef list _get_clear_event_queue()
@@ -2555,6 +2654,8 @@ cdef class RTPTransport(object):
     cdef pjmedia_transport *_wrapped_transport
     cdef ICECheck _rtp_valid_pair
     cdef object _encryption
+    cdef int _rtp_port
+    cdef int _rtp_port_generation
     cdef readonly object ice_stun_address
     cdef readonly object ice_stun_port
     cdef readonly object state
@@ -2562,6 +2663,7 @@ cdef class RTPTransport(object):
 
     # private methods
     cdef PJSIPUA _check_ua(self)
+    cdef int _release_rtp_port(self, PJSIPUA ua) except -1
     cdef void _get_info(self, pjmedia_transport_info *info)
     cdef int _init_local_sdp(self, BaseSDPSession local_sdp, BaseSDPSession remote_sdp, int sdp_index)
     cdef int _ice_active(self)
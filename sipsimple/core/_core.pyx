@@ -27,7 +27,7 @@ CORE_REVISION = 210
 
 __all__ = ["PJ_VERSION", "PJ_SVN_REVISION", "CORE_REVISION",
            "SIPCoreError", "PJSIPError", "PJSIPTLSError", "SIPCoreInvalidStateError",
-           "AudioMixer", "ToneGenerator", "RecordingWaveFile", "WaveFile", "MixerPort",
+           "AudioMixer", "ToneGenerator", "RecordingWaveFile", "WaveFile", "MemoryPlayer", "MixerPort", "read_wave_file",
            "VideoCamera", "FrameBufferVideoRenderer",
            "sip_status_messages",
            "BaseCredentials", "Credentials", "FrozenCredentials", "BaseSIPURI", "SIPURI", "FrozenSIPURI",
@@ -7,7 +7,7 @@ cdef class AudioMixer:
     def __cinit__(self, *args, **kwargs):
         cdef int status
 
-        self._connected_slots = list()
+        self._connected_slots = set()
         self._input_volume = 100
         self._output_volume = 100
 
@@ -235,7 +235,7 @@ cdef class AudioMixer:
                 status = pjmedia_conf_connect_port(conf_bridge, src_slot, dst_slot, 0)
             if status != 0:
                 raise PJSIPError("Could not connect slots on audio mixer", status)
-            self._connected_slots.append(connection)
+            self._connected_slots.add(connection)
         finally:
             with nogil:
                 pj_mutex_unlock(lock)
@@ -490,7 +490,7 @@ cdef class AudioMixer:
                 status = pjmedia_conf_remove_port(conf_bridge, slot)
             if status != 0:
                 raise PJSIPError("Could not remove audio object from audio mixer", status)
-            self._connected_slots = [connection for connection in self._connected_slots if slot not in connection]
+            self._connected_slots = set(connection for connection in self._connected_slots if slot not in connection)
             self.used_slot_count -= 1
             if self.used_slot_count == 0 and not (self.input_device is None and self.output_device is None):
                 timer = Timer()
@@ -1221,6 +1221,225 @@ cdef class WaveFile:
                 pj_mutex_unlock(lock)
 
 
+cdef class MemoryPlayer:
+    def __cinit__(self, *args, **kwargs):
+        cdef int status
+
+        self.weakref = weakref.ref(self)
+        Py_INCREF(self.weakref)
+
+        status = pj_mutex_create_recursive(_get_ua()._pjsip_endpoint._pool, "memory_player_lock", &self._lock)
+        if status != 0:
+            raise PJSIPError("failed to create lock", status)
+
+        self._slot = -1
+        self._volume = 100
+
+    def __init__(self, AudioMixer mixer, bytes data, int sample_rate):
+        if self.data is not None:
+            raise SIPCoreError("MemoryPlayer.__init__() was already called")
+        if mixer is None:
+            raise ValueError("mixer argument may not be None")
+        if data is None:
+            raise ValueError("data argument may not be None")
+        if sample_rate <= 0 or sample_rate % 50:
+            raise ValueError("sample_rate argument should be a positive integer dividable by 50")
+        if not data or len(data) % 2:
+            raise ValueError("data argument must contain 16 bit PCM samples")
+        self.mixer = mixer
+        self.data = data
+        self.sample_rate = sample_rate
+
+    cdef PJSIPUA _check_ua(self):
+        cdef PJSIPUA ua
+        try:
+            ua = _get_ua()
+            return ua
+        except:
+            self._pool = NULL
+            self._port = NULL
+            self._slot = -1
+            return None
+
+    property is_active:
+
+        def __get__(self):
+            self._check_ua()
+            return self._port != NULL
+
+    property slot:
+
+        def __get__(self):
+            self._check_ua()
+            if self._slot == -1:
+                return None
+            else:
+                return self._slot
+
+    property volume:
+
+        def __get__(self):
+            return self._volume
+
+        def __set__(self, value):
+            cdef int slot
+            cdef int status
+            cdef int volume
+            cdef pj_mutex_t *lock = self._lock
+            cdef pjmedia_conf *conf_bridge
+            cdef PJSIPUA ua
+
+            ua = self._check_ua()
+
+            if ua is not None:
+                with nogil:
+                    status = pj_mutex_lock(lock)
+                if status != 0:
+                    raise PJSIPError("failed to acquire lock", status)
+            try:
+                conf_bridge = self.mixer._obj
+                slot = self._slot
+
+                if value < 0:
+                    raise ValueError("volume attribute cannot be negative")
+                if ua is not None and self._slot != -1:
+                    volume = int(value * 1.28 - 128)
+                    with nogil:
+                        status = pjmedia_conf_adjust_rx_level(conf_bridge, slot, volume)
+                    if status != 0:
+                        raise PJSIPError("Could not set volume of memory player", status)
+                self._volume = value
+            finally:
+                if ua is not None:
+                    with nogil:
+                        pj_mutex_unlock(lock)
+
+    def start(self):
+        cdef int status
+        cdef int sample_rate
+        cdef int data_size
+        cdef void *weakref
+        cdef void *buffer
+        cdef pj_pool_t *pool
+        cdef pj_mutex_t *lock = self._lock
+        cdef pjmedia_port **port_address
+        cdef bytes pool_name
+        cdef PJSIPUA ua
+
+        ua = _get_ua()
+
+        with nogil:
+            status = pj_mutex_lock(lock)
+        if status != 0:
+            raise PJSIPError("failed to acquire lock", status)
+        try:
+            # the port plays directly from the buffer of the data object, which is kept alive by our reference to it
+            buffer = <void *> PyBytes_AsString(self.data)
+            data_size = len(self.data)
+            sample_rate = self.sample_rate
+            port_address = &self._port
+            weakref = <void *> self.weakref
+
+            if self._port != NULL:
+                raise SIPCoreError("MemoryPlayer is already playing")
+            pool_name = b"MemoryPlayer_%d" % id(self)
+            pool = ua.create_memory_pool(pool_name, 4096, 4096)
+            self._pool = pool
+            try:
+                with nogil:
+                    status = pjmedia_mem_player_create(pool, buffer, data_size, sample_rate, 1, <unsigned int>(sample_rate / 50), 16, PJMEDIA_MEM_NO_LOOP, port_address)
+                if status != 0:
+                    raise PJSIPError("Could not create memory player", status)
+                with nogil:
+                    status = pjmedia_mem_player_set_eof_cb(port_address[0], weakref, cb_play_memory_eof)
+                if status != 0:
+                    raise PJSIPError("Could not set memory player EOF callback", status)
+                self._slot = self.mixer._add_port(ua, self._pool, self._port)
+                if self._volume != 100:
+                    self.volume = self._volume
+            except:
+                self._stop(ua, 0)
+                raise
+        finally:
+            with nogil:
+                pj_mutex_unlock(lock)
+
+    cdef int _stop(self, PJSIPUA ua, int notify) except -1:
+        cdef int was_active
+        cdef pjmedia_port *port
+
+        port = self._port
+        was_active = 0
+
+        if self._slot != -1:
+            was_active = 1
+            self.mixer._remove_port(ua, self._slot)
+            self._slot = -1
+        if self._port != NULL:
+            with nogil:
+                pjmedia_port_destroy(port)
+            self._port = NULL
+            was_active = 1
+        ua.release_memory_pool(self._pool)
+        self._pool = NULL
+        if notify and was_active:
+            _add_event("MemoryPlayerDidFinishPlaying", dict(obj=self))
+
+    def stop(self):
+        cdef int status
+        cdef pj_mutex_t *lock = self._lock
+        cdef PJSIPUA ua
+
+        ua = self._check_ua()
+        if ua is None:
+            return
+
+        with nogil:
+            status = pj_mutex_lock(lock)
+        if status != 0:
+            raise PJSIPError("failed to acquire lock", status)
+        try:
+            self._stop(ua, 1)
+        finally:
+            with nogil:
+                pj_mutex_unlock(lock)
+
+    def __dealloc__(self):
+        cdef PJSIPUA ua
+        cdef Timer timer
+        try:
+            ua = _get_ua()
+        except:
+            return
+        self._stop(ua, 0)
+        timer = Timer()
+        try:
+            timer.schedule(60, deallocate_weakref, self.weakref)
+        except SIPCoreError:
+            pass
+        if self._lock != NULL:
+            pj_mutex_destroy(self._lock)
+
+    cdef int _cb_eof(self, timer) except -1:
+        cdef int status
+        cdef pj_mutex_t *lock = self._lock
+        cdef PJSIPUA ua
+
+        ua = self._check_ua()
+        if ua is None:
+            return 0
+
+        with nogil:
+            status = pj_mutex_lock(lock)
+        if status != 0:
+            raise PJSIPError("failed to acquire lock", status)
+        try:
+            self._stop(ua, 1)
+        finally:
+            with nogil:
+                pj_mutex_unlock(lock)
+
+
 cdef class MixerPort:
     def __cinit__(self, *args, **kwargs):
         cdef int status
@@ -1350,6 +1569,73 @@ cdef class MixerPort:
             pj_mutex_destroy(self._lock)
 
 
+# functions
+
+def read_wave_file(object filename, int sample_rate, int max_size=0):
+    """
+    Read a mono WAV file and return its audio as 16 bit PCM samples at the
+    given sample rate, resampling it if needed. If max_size is not 0 and the
+    decoded audio would be larger than max_size bytes, ValueError is raised.
+    """
+    cdef int status
+    cdef int frame_size
+    cdef char *c_filename
+    cdef char *buffer
+    cdef pj_pool_t *pool
+    cdef pjmedia_port *wav_port = NULL
+    cdef pjmedia_port *port = NULL
+    cdef pjmedia_frame frame
+    cdef list chunks = []
+    cdef PJSIPUA ua
+
+    ua = _get_ua()
+
+    if sample_rate <= 0 or sample_rate % 50:
+        raise ValueError("sample_rate argument should be a positive integer dividable by 50")
+    if isinstance(filename, unicode):
+        filename = filename.encode(sys.getfilesystemencoding())
+    c_filename = PyBytes_AsString(filename)
+    frame_size = sample_rate // 50 * 2
+    size = 0
+    pool = ua.create_memory_pool(b"read_wave_file", 4096, 4096)
+    try:
+        with nogil:
+            status = pjmedia_wav_player_port_create(pool, c_filename, 0, PJMEDIA_FILE_NO_LOOP, 0, &wav_port)
+        if status != 0:
+            raise PJSIPError("Could not open WAV file", status)
+        port = wav_port
+        if wav_port.info.fmt.det.aud.channel_count != 1:
+            raise SIPCoreError("Only mono WAV files are supported")
+        if wav_port.info.fmt.det.aud.clock_rate != sample_rate:
+            # destroying the resample port also destroys the WAV port
+            with nogil:
+                status = pjmedia_resample_port_create(pool, wav_port, sample_rate, 0, &port)
+            if status != 0:
+                port = wav_port
+                raise PJSIPError("Could not create resample port", status)
+        buffer = <char *> pj_pool_alloc(pool, frame_size)
+        if buffer == NULL:
+            raise MemoryError()
+        while True:
+            frame.type = PJMEDIA_FRAME_TYPE_AUDIO
+            frame.buf = buffer
+            frame.size = frame_size
+            with nogil:
+                status = pjmedia_port_get_frame(port, &frame)
+            if status != 0 or frame.type != PJMEDIA_FRAME_TYPE_AUDIO or frame.size <= 0:
+                break
+            size += frame.size
+            if max_size and size > max_size:
+                raise ValueError("the audio in %s is larger than %d bytes" % (filename.decode(sys.getfilesystemencoding()), max_size))
+            chunks.append(PyBytes_FromStringAndSize(buffer, frame.size))
+    finally:
+        if port != NULL:
+            with nogil:
+                pjmedia_port_destroy(port)
+        ua.release_memory_pool(pool)
+    return b''.join(chunks)
+
+
 # callback functions
 
 cdef int _AudioMixer_dealloc_handler(object obj) except -1:
@@ -1364,7 +1650,7 @@ cdef int _AudioMixer_dealloc_handler(object obj) except -1:
         raise PJSIPError("failed to acquire lock", status)
     try:
         mixer._stop_sound_device(ua)
-        mixer._connected_slots = list()
+        mixer._connected_slots = set()
         mixer.used_slot_count = 0
     finally:
         pj_mutex_unlock(mixer._lock)
@@ -1380,3 +1666,14 @@ cdef int cb_play_wav_eof(pjmedia_port *port, void *user_data) with gil:
     # do not return PJ_SUCCESS because if you do pjsip will access the just deallocated port
     return 1
 
+cdef int cb_play_memory_eof(pjmedia_port *port, void *user_data) with gil:
+    cdef Timer timer
+    cdef MemoryPlayer player
+
+    player = (<object> user_data)()
+    if player is not None:
+        timer = Timer()
+        timer.schedule(0, <timer_callback>player._cb_eof, player)
+    # do not return PJ_SUCCESS because if you do pjsip will access the just deallocated port
+    return 1
+
@@ -1,16 +1,21 @@
 
 import errno
-import heapq
 import re
 import random
+import socket
 import sys
 import time
 import traceback
 import os
 import tempfile
 
+from collections import deque
+
 
 cdef class Timer:
+    def __cinit__(self, *args, **kwargs):
+        self._heap_index = -1
+
     cdef int schedule(self, float delay, timer_callback callback, object obj) except -1:
         cdef PJSIPUA ua = _get_ua()
         if delay < 0:
@@ -66,6 +71,9 @@ cdef class PJSIPUA:
         _ua = <void *> self
         self._threads = []
         self._timers = list()
+        self._timers_fired = 0
+        self._timers_cancelled = 0
+        self._rtp_port_quarantine = deque()
         self._events = {}
         self._incoming_events = set()
         self._incoming_requests = set()
@@ -180,6 +188,7 @@ cdef class PJSIPUA:
         self._enable_colorbar_device = int(bool(kwargs["enable_colorbar_device"]))
         self._user_agent = PJSTR(kwargs["user_agent"].encode())
         self.rtp_port_range = kwargs["rtp_port_range"]
+        self.rtp_port_quarantine = kwargs["rtp_port_quarantine"]
         self.zrtp_cache = kwargs["zrtp_cache"].encode() if kwargs["zrtp_cache"] else None
 
         status = pjmedia_aud_dev_set_observer_cb(_cb_audio_dev_process_event);
@@ -210,6 +219,9 @@ cdef class PJSIPUA:
                             pjmedia_endpt_get_ioqueue(self._pjmedia_endpoint._obj),
                             pjsip_endpt_get_timer_heap(self._pjsip_endpoint._obj))
 
+        self.poll_timeout = kwargs["poll_timeout"]
+        self._init_wakeup()
+
     property trace_sip:
 
         def __get__(self):
@@ -621,6 +633,35 @@ cdef class PJSIPUA:
             self._rtp_port_count = _rtp_port_count
             self._rtp_port_usable_count = _rtp_port_usable_count
             self._rtp_port_index = 0
+            # ports allocated with the previous range are not returned to the new bitmap
+            self._rtp_port_generation += 1
+            self._rtp_port_bitmap = bytearray((_rtp_port_usable_count // 2 + 7) // 8)
+            self._rtp_port_quarantine.clear()
+            self._rtp_ports_reserved = 0
+
+    property rtp_port_quarantine:
+
+        def __get__(self):
+            self._check_self()
+            return self._rtp_port_quarantine_time
+
+        def __set__(self, value):
+            self._check_self()
+            if value < 0:
+                raise ValueError("rtp_port_quarantine must be a non-negative number")
+            self._rtp_port_quarantine_time = value
+
+    property rtp_port_statistics:
+
+        def __get__(self):
+            self._check_self()
+            self._expire_rtp_port_quarantine()
+            return dict(total=self._rtp_port_usable_count // 2,
+                        used=self._rtp_ports_reserved - len(self._rtp_port_quarantine),
+                        quarantined=len(self._rtp_port_quarantine),
+                        free=self._rtp_port_usable_count // 2 - self._rtp_ports_reserved,
+                        allocations=self._rtp_port_allocations,
+                        bind_failures=self._rtp_port_bind_failures)
 
     property user_agent:
 
@@ -751,6 +792,44 @@ cdef class PJSIPUA:
                                                   max_framerate,
                                                   max_bitrate or 0.0)
 
+    property poll_timeout:
+
+        def __get__(self):
+            self._check_self()
+            return self._poll_timeout
+
+        def __set__(self, value):
+            self._check_self()
+            if value <= 0:
+                raise ValueError("poll_timeout must be a positive number")
+            self._poll_timeout = value
+
+    def wakeup(self):
+        # Interrupt a blocking poll. This can be called from any thread.
+        _signal_wakeup()
+
+    cdef int _init_wakeup(self) except -1:
+        # A socket pair registered with the SIP endpoint ioqueue is used to interrupt
+        # pjsip_endpt_handle_events when other threads have work for the poll loop.
+        global _wakeup_key, _wakeup_sock
+        cdef object reader
+        cdef int status
+        reader, self._wakeup_socket = socket.socketpair()
+        reader.setblocking(False)
+        self._wakeup_socket.setblocking(False)
+        status = pj_ioqueue_register_sock(self._pjsip_endpoint._pool, pjsip_endpt_get_ioqueue(self._pjsip_endpoint._obj),
+                                          reader.fileno(), NULL, &_wakeup_callback, &_wakeup_key)
+        if status != 0:
+            reader.close()
+            self._wakeup_socket.close()
+            self._wakeup_socket = None
+            raise PJSIPError("Could not register wakeup socket", status)
+        reader.detach() # the ioqueue owns the socket from now on and will close it when it is unregistered
+        pj_ioqueue_op_key_init(&_wakeup_op_key, sizeof(pj_ioqueue_op_key_t))
+        _start_wakeup_read()
+        _wakeup_sock = self._wakeup_socket.fileno()
+        return 0
+
     property zrtp_cache:
 
         def __get__(self):
@@ -767,7 +846,7 @@ cdef class PJSIPUA:
         self.dealloc()
 
     def dealloc(self):
-        global _ua, _dealloc_handler_queue, _event_queue_lock
+        global _ua, _dealloc_handler_queue, _event_queue_lock, _wakeup_key, _wakeup_sock
         if _ua == NULL:
             return
         self._check_thread()
@@ -779,10 +858,18 @@ cdef class PJSIPUA:
             pj_mutex_destroy(self.video_lock)
             self.video_lock = NULL
         _process_handler_queue(self, &_dealloc_handler_queue)
+        _wakeup_sock = PJ_INVALID_SOCKET
+        if _wakeup_key != NULL:
+            pj_ioqueue_unregister(_wakeup_key)
+            _wakeup_key = NULL
+        if self._wakeup_socket is not None:
+            self._wakeup_socket.close()
+            self._wakeup_socket = None
         if _event_queue_lock != NULL:
             pj_mutex_lock(_event_queue_lock)
             pj_mutex_destroy(_event_queue_lock)
             _event_queue_lock = NULL
+        _release_message_headers()
         self._pjsip_endpoint = None
         self._pjmedia_endpoint = None
         self._caching_pool = None
@@ -791,15 +878,13 @@ cdef class PJSIPUA:
         self._poll_log()
 
     cdef int _poll_log(self) except -1:
-        cdef object event_name
-        cdef dict event_params
         cdef list events
         events = _get_clear_event_queue()
-        for event_name, event_params in events:
-            self._event_handler(event_name, **event_params)
+        if events:
+            self._event_handler(events)
 
     def poll(self):
-        global _post_poll_handler_queue
+        global _post_poll_handler_queue, _poll_thread_ident
         cdef int status
         cdef double now
         cdef object retval = None
@@ -810,14 +895,13 @@ cdef class PJSIPUA:
 
         self._check_self()
 
-        max_timeout = 0.100
-        while self._timers:
-            if not (<Timer>self._timers[0])._scheduled:
-                # timer was cancelled
-                heapq.heappop(self._timers)
-            else:
-                max_timeout = min(max((<Timer>self._timers[0]).schedule_time - time.time(), 0.0), max_timeout)
-                break
+        # Any thread that needs the loop's attention signals the wakeup socket, so the poll can
+        # block up to poll_timeout when there is nothing else to do. The pending flag is cleared
+        # by the read callback once the socket was drained.
+        _poll_thread_ident = PyThread_get_thread_ident()
+        max_timeout = self._poll_timeout
+        if self._timers:
+            max_timeout = min(max((<Timer>self._timers[0]).schedule_time - time.time(), 0.0), max_timeout)
         pj_max_timeout.sec = int(max_timeout)
         pj_max_timeout.msec = int(max_timeout * 1000) % 1000
         with nogil:
@@ -832,16 +916,9 @@ cdef class PJSIPUA:
 
         timers = list()
         now = time.time()
-        while self._timers:
-            if not (<Timer>self._timers[0])._scheduled:
-                # timer was cancelled
-                heapq.heappop(self._timers)
-            elif (<Timer>self._timers[0]).schedule_time <= now:
-                # timer needs to be processed
-                timer = heapq.heappop(self._timers)
-                timers.append(timer)
-            else:
-                break
+        while self._timers and (<Timer>self._timers[0]).schedule_time <= now:
+            timers.append(self._pop_timer())
+        self._timers_fired += len(timers)
         for timer in timers:
             timer.call()
 
@@ -872,15 +949,146 @@ cdef class PJSIPUA:
     cdef int _check_thread(self) except -1:
         if not pj_thread_is_registered():
             self._threads.append(PJSIPThread())
+        _signal_wakeup()
+        return 0
+
+    property timer_statistics:
+
+        def __get__(self):
+            self._check_self()
+            return dict(scheduled=len(self._timers), fired=self._timers_fired, cancelled=self._timers_cancelled)
+
+    # The RTP ports are handed out in even/odd pairs and every pair is a bit in a bitmap,
+    # so finding a free pair skips over fully used bytes instead of trying to bind each
+    # port in turn. Released pairs are kept in quarantine for rtp_port_quarantine seconds
+    # before they can be used again, so that late packets from a call do not reach the
+    # next one, unless there is no other free pair left.
+
+    cdef int _allocate_rtp_port(self) except -2:
+        cdef unsigned char *bitmap
+        cdef int slot_count = self._rtp_port_usable_count // 2
+        cdef int slot
+        self._expire_rtp_port_quarantine()
+        if self._rtp_ports_reserved < slot_count:
+            bitmap = self._rtp_port_bitmap
+            slot = self._rtp_port_index
+            while bitmap[slot >> 3] & (1 << (slot & 7)):
+                if bitmap[slot >> 3] == 0xff:
+                    slot = (slot | 7) + 1
+                else:
+                    slot += 1
+                if slot >= slot_count:
+                    slot = 0
+            bitmap[slot >> 3] |= 1 << (slot & 7)
+            self._rtp_ports_reserved += 1
+        elif self._rtp_port_quarantine:
+            slot = self._rtp_port_quarantine.popleft()[1]
+        else:
+            return -1
+        self._rtp_port_index = (slot + 1) % slot_count
+        self._rtp_port_allocations += 1
+        return self._rtp_port_start + 2 * slot
+
+    cdef int _release_rtp_port(self, int port, int generation, int quarantine=1) except -1:
+        cdef unsigned char *bitmap
+        cdef int slot
+        if generation != self._rtp_port_generation:
+            return 0
+        slot = (port - self._rtp_port_start) // 2
+        if quarantine and self._rtp_port_quarantine_time > 0:
+            self._rtp_port_quarantine.append((time.time() + self._rtp_port_quarantine_time, slot))
+        else:
+            bitmap = self._rtp_port_bitmap
+            bitmap[slot >> 3] &= ~(1 << (slot & 7))
+            self._rtp_ports_reserved -= 1
+        return 0
+
+    cdef int _expire_rtp_port_quarantine(self) except -1:
+        cdef unsigned char *bitmap = self._rtp_port_bitmap
+        cdef int slot
+        cdef double now = time.time()
+        quarantine = self._rtp_port_quarantine
+        while quarantine and quarantine[0][0] <= now:
+            slot = quarantine.popleft()[1]
+            bitmap[slot >> 3] &= ~(1 << (slot & 7))
+            self._rtp_ports_reserved -= 1
         return 0
 
+    # The scheduled timers are kept in a binary heap ordered by schedule_time. Every timer
+    # knows its position in the heap, so cancelled timers are removed right away instead
+    # of lingering in the heap until they reach the top.
+
     cdef int _add_timer(self, Timer timer) except -1:
-        heapq.heappush(self._timers, timer)
+        timer._heap_index = len(self._timers)
+        self._timers.append(timer)
+        self._sift_timer_up(timer._heap_index)
+        if timer._heap_index == 0:
+            _signal_wakeup()
         return 0
 
     cdef int _remove_timer(self, Timer timer) except -1:
-        # Don't remove it from the heap, just mark it as not scheduled
+        cdef int index = timer._heap_index
+        cdef Timer last
+        if index < 0:
+            return 0
+        last = self._timers.pop()
+        timer._heap_index = -1
         timer._scheduled = 0
+        if last is not timer:
+            self._timers[index] = last
+            last._heap_index = index
+            self._sift_timer_down(index)
+            self._sift_timer_up(last._heap_index)
+        self._timers_cancelled += 1
+        return 0
+
+    cdef Timer _pop_timer(self):
+        cdef Timer timer = self._timers[0]
+        cdef Timer last = self._timers.pop()
+        if last is not timer:
+            self._timers[0] = last
+            last._heap_index = 0
+            self._sift_timer_down(0)
+        timer._heap_index = -1
+        return timer
+
+    cdef int _sift_timer_up(self, int index) except -1:
+        cdef list timers = self._timers
+        cdef Timer timer = timers[index]
+        cdef Timer parent
+        cdef int parent_index
+        while index > 0:
+            parent_index = (index - 1) >> 1
+            parent = timers[parent_index]
+            if parent.schedule_time <= timer.schedule_time:
+                break
+            timers[index] = parent
+            parent._heap_index = index
+            index = parent_index
+        timers[index] = timer
+        timer._heap_index = index
+        return 0
+
+    cdef int _sift_timer_down(self, int index) except -1:
+        cdef list timers = self._timers
+        cdef int count = len(timers)
+        cdef Timer timer = timers[index]
+        cdef Timer child
+        cdef int child_index
+        while True:
+            child_index = 2 * index + 1
+            if child_index >= count:
+                break
+            if child_index + 1 < count and (<Timer>timers[child_index + 1]).schedule_time < (<Timer>timers[child_index]).schedule_time:
+                child_index += 1
+            child = timers[child_index]
+            if timer.schedule_time <= child.schedule_time:
+                break
+            timers[index] = child
+            child._heap_index = index
+            index = child_index
+        timers[index] = timer
+        timer._heap_index = index
         return 0
 
     cdef int _cb_rx_request(self, pjsip_rx_data *rdata) except 0:
@@ -1035,6 +1243,13 @@ cdef void _cb_audio_dev_process_event(pjmedia_aud_dev_event event) with gil:
     except:
         ua._handle_exception(1)
 
+cdef void _cb_wakeup_read(pj_ioqueue_key_t *key, pj_ioqueue_op_key_t *op_key, pj_ssize_t bytes_read) nogil:
+    global _wakeup_pending
+    # Always leave a read pending, even after an error, or the poll could not be woken up anymore.
+    # The flag is cleared only after draining, so a signal sent from now on results in a new wakeup.
+    _start_wakeup_read()
+    _wakeup_pending = 0
+
 cdef void _cb_detect_nat_type(void *user_data, pj_stun_nat_detect_result_ptr_const res) with gil:
     cdef PJSIPUA ua
     cdef dict event_dict
@@ -1232,10 +1447,39 @@ cdef PJSIPUA _get_ua():
 cdef int deallocate_weakref(object weak_ref, object timer) except -1 with gil:
     Py_DECREF(weak_ref)
 
+cdef void _start_wakeup_read() nogil:
+    # Drain the wakeup socket and leave an asynchronous read pending on it
+    cdef pj_ssize_t length
+    cdef int status = 0
+    while status == 0:
+        length = sizeof(_wakeup_buffer)
+        status = pj_ioqueue_recv(_wakeup_key, &_wakeup_op_key, _wakeup_buffer, &length, 0)
+        if status == 0 and length <= 0:
+            break
+
+cdef void _signal_wakeup() nogil:
+    # Wake up the thread blocked in PJSIPUA.poll, unless it is the caller or it was already signaled
+    global _wakeup_pending
+    cdef pj_ssize_t length = 1
+    if _wakeup_sock == PJ_INVALID_SOCKET or _wakeup_pending or PyThread_get_thread_ident() == _poll_thread_ident:
+        return
+    _wakeup_pending = 1
+    pj_sock_send(_wakeup_sock, &_wakeup_byte, &length, 0)
+
 
 # globals
 
 cdef void *_ua = NULL
+cdef pj_ioqueue_key_t *_wakeup_key = NULL
+cdef pj_ioqueue_op_key_t _wakeup_op_key
+cdef pj_ioqueue_callback _wakeup_callback
+memset(&_wakeup_callback, 0, sizeof(pj_ioqueue_callback))
+_wakeup_callback.on_read_complete = _cb_wakeup_read
+cdef char _wakeup_buffer[64]
+cdef char _wakeup_byte = 0
+cdef pj_sock_t _wakeup_sock = PJ_INVALID_SOCKET
+cdef int _wakeup_pending = 0
+cdef unsigned long _poll_thread_ident = 0
 cdef PJSTR _user_agent_hdr_name = PJSTR(b"User-Agent")
 cdef PJSTR _server_hdr_name = PJSTR(b"Server")
 cdef PJSTR _event_hdr_name = PJSTR(b"Event")
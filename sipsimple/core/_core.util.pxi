@@ -2,6 +2,7 @@
 import platform
 import re
 import sys
+import weakref
 
 from application.version import Version
 
@@ -153,6 +154,131 @@ cdef class frozendict:
         return list(self.dict.values())
 
 
+cdef class MessageHeaders:
+    """
+    Read-only mapping of the headers of a SIP message. The headers are copied
+    when the message is received or sent, but they are only converted to
+    header objects when they are accessed.
+    """
+
+    def __cinit__(self, *args, **kwargs):
+        self._pool = NULL
+        pj_list_init(&self._headers)
+        self._names = dict()
+        self._converted = dict()
+        self._complete = 0
+
+    def __dealloc__(self):
+        cdef PJSIPUA ua
+        if self._pool == NULL:
+            return
+        try:
+            ua = _get_ua()
+        except:
+            return
+        ua.release_memory_pool(self._pool)
+        self._pool = NULL
+
+    def __reduce__(self):
+        self._convert_all()
+        return (dict, (self._converted,), None)
+
+    def __repr__(self):
+        self._convert_all()
+        return "MessageHeaders(%r)" % self._converted
+
+    def __len__(self):
+        self._convert_all()
+        return len(self._converted)
+
+    def __iter__(self):
+        self._convert_all()
+        return iter(self._converted)
+
+    def __contains__(self, name):
+        return self._convert(name) is not None
+
+    def __getitem__(self, name):
+        value = self._convert(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __richcmp__(MessageHeaders self, other, op):
+        if isinstance(other, MessageHeaders):
+            other = dict(other)
+        self._convert_all()
+        if op == 2:
+            return self._converted == other
+        elif op == 3:
+            return self._converted != other
+        else:
+            return NotImplemented
+
+    def copy(self):
+        self._convert_all()
+        return dict(self._converted)
+
+    def get(self, name, default=None):
+        value = self._convert(name)
+        return default if value is None else value
+
+    def items(self):
+        self._convert_all()
+        return list(self._converted.items())
+
+    def keys(self):
+        self._convert_all()
+        return list(self._converted.keys())
+
+    def values(self):
+        self._convert_all()
+        return list(self._converted.values())
+
+    cdef object _convert(self, object name):
+        cdef pjsip_hdr *header
+        if self._complete or name in self._converted or name not in self._names:
+            return self._converted.get(name)
+        multi_header = name in _multi_header_names
+        value = [] if multi_header else None
+        header = <pjsip_hdr *> self._headers.next
+        while header != <pjsip_hdr *> &self._headers:
+            if _pj_str_to_str(header.name) == name:
+                header_data = _pjsip_hdr_to_object(header, name)
+                if header_data is not None:
+                    if not multi_header:
+                        value = header_data
+                        break
+                    value.append(header_data)
+            header = <pjsip_hdr *> (<pj_list *> header).next
+        if multi_header and not value:
+            value = None
+        self._converted[name] = value
+        return value
+
+    cdef int _convert_all(self) except -1:
+        cdef dict headers
+        if self._complete:
+            return 0
+        headers = dict()
+        for name in self._names:
+            value = self._convert(name)
+            if value is not None:
+                headers[name] = value
+        self._converted = headers
+        self._complete = 1
+        return 0
+
+    cdef int _release(self) except -1:
+        cdef PJSIPUA ua
+        if self._pool != NULL:
+            ua = _get_ua()
+            pj_list_init(&self._headers)
+            ua.release_memory_pool(self._pool)
+            self._pool = NULL
+        return 0
+
+
 # functions
 
 cdef int _str_to_pj_str(object string, pj_str_t *pj_str) except -1:
@@ -221,89 +347,149 @@ cdef int _dict_to_pjsip_param(object params, pjsip_param *param_list, pj_pool_t
         pj_list_insert_after(<pj_list *> param_list, <pj_list *> param)
     return 0
 
-cdef int _pjsip_msg_to_dict(pjsip_msg *msg, dict info_dict) except -1:
-    cdef pjsip_msg_body *body
-    cdef pjsip_hdr *header
+cdef object _pjsip_hdr_to_object(pjsip_hdr *header, object header_name):
     cdef pjsip_generic_array_hdr *array_header
-    cdef pjsip_ctype_hdr *ctype_header
     cdef pjsip_cseq_hdr *cseq_header
-    cdef char *buf
-    cdef int buf_len, status
-    headers = {}
+    header_data = None
+    if header_name in ("Accept", "Allow", "Require", "Supported", "Unsupported", "Allow-Events"):
+        array_header = <pjsip_generic_array_hdr *> header
+        header_data = []
+        if array_header.count < 128:
+            for i from 0 <= i < array_header.count:
+                header_data.append(_pj_str_to_bytes(array_header.values[i]))
+    elif header_name == "Contact":
+        header_data = FrozenContactHeader_create(<pjsip_contact_hdr *> header)
+    elif header_name == "Content-Length":
+        header_data = (<pjsip_clen_hdr *> header).len
+    elif header_name == "Content-Type":
+        header_data = FrozenContentTypeHeader_create(<pjsip_ctype_hdr *> header)
+    elif header_name == "CSeq":
+        cseq_header = <pjsip_cseq_hdr *> header
+        hvalue = _pj_str_to_str(cseq_header.method.name)
+        header_data = (cseq_header.cseq, hvalue)
+    elif header_name in ("Expires", "Max-Forwards", "Min-Expires"):
+        header_data = (<pjsip_generic_int_hdr *> header).ivalue
+    elif header_name == "From":
+        header_data = FrozenFromHeader_create(<pjsip_fromto_hdr *> header)
+    elif header_name == "To":
+        header_data = FrozenToHeader_create(<pjsip_fromto_hdr *> header)
+    elif header_name == "Route":
+        header_data = FrozenRouteHeader_create(<pjsip_routing_hdr *> header)
+    elif header_name == "Reason":
+        value = _pj_str_to_str((<pjsip_generic_string_hdr *>header).hvalue)
+        protocol, sep, params_str = value.partition(';')
+        params = frozendict([(name, value or None) for name, sep, value in [param.partition('=') for param in params_str.split(';')]])
+        header_data = FrozenReasonHeader(protocol, params)
+    elif header_name == "Record-Route":
+        header_data = FrozenRecordRouteHeader_create(<pjsip_routing_hdr *> header)
+    elif header_name == "Retry-After":
+        header_data = FrozenRetryAfterHeader_create(<pjsip_retry_after_hdr *> header)
+    elif header_name == "Via":
+        header_data = FrozenViaHeader_create(<pjsip_via_hdr *> header)
+    elif header_name == "Warning":
+        match = _re_warning_hdr.match(_pj_str_to_str((<pjsip_generic_string_hdr *>header).hvalue))
+        if match is not None:
+            warning_params = match.groupdict()
+            warning_params['code'] = int(warning_params['code'])
+            header_data = FrozenWarningHeader(**warning_params)
+    elif header_name == "Event":
+        header_data = FrozenEventHeader_create(<pjsip_event_hdr *> header)
+    elif header_name == "Subscription-State":
+        header_data = FrozenSubscriptionStateHeader_create(<pjsip_sub_state_hdr *> header)
+    elif header_name == "Refer-To":
+        header_data = FrozenReferToHeader_create(<pjsip_generic_string_hdr *> header)
+    elif header_name == "Subject":
+        header_data = FrozenSubjectHeader_create(<pjsip_generic_string_hdr *> header)
+    elif header_name == "Replaces":
+        header_data = FrozenReplacesHeader_create(<pjsip_replaces_hdr *> header)
+    else:
+        header_data = FrozenHeader(header_name, _pj_str_to_str((<pjsip_generic_string_hdr *> header).hvalue))
+    return header_data
+
+cdef MessageHeaders MessageHeaders_create(pjsip_msg *msg):
+    cdef MessageHeaders headers
+    cdef pjsip_hdr *header
+    cdef pjsip_hdr *header_copy
+    cdef PJSIPUA ua = _get_ua()
+    headers = MessageHeaders()
+    headers._pool = ua.create_memory_pool(b"MessageHeaders", 4096, 4096)
     header = <pjsip_hdr *> (<pj_list *> &msg.hdr).next
     while header != &msg.hdr:
         header_name = _pj_str_to_str(header.name)
-        header_data = None
-        multi_header = False
-        if header_name in ("Accept", "Allow", "Require", "Supported", "Unsupported", "Allow-Events"):
-            array_header = <pjsip_generic_array_hdr *> header
-            header_data = []
-            if array_header.count < 128:
-                for i from 0 <= i < array_header.count:
-                    header_data.append(_pj_str_to_bytes(array_header.values[i]))
-        elif header_name == "Contact":
-            multi_header = True
-            header_data = FrozenContactHeader_create(<pjsip_contact_hdr *> header)
-        elif header_name == "Content-Length":
-            header_data = (<pjsip_clen_hdr *> header).len
-        elif header_name == "Content-Type":
-            header_data = FrozenContentTypeHeader_create(<pjsip_ctype_hdr *> header)
-        elif header_name == "CSeq":
-            cseq_header = <pjsip_cseq_hdr *> header
-            hvalue = _pj_str_to_str(cseq_header.method.name)
-            header_data = (cseq_header.cseq, hvalue)
-        elif header_name in ("Expires", "Max-Forwards", "Min-Expires"):
-            header_data = (<pjsip_generic_int_hdr *> header).ivalue
-        elif header_name == "From":
-            header_data = FrozenFromHeader_create(<pjsip_fromto_hdr *> header)
-        elif header_name == "To":
-            header_data = FrozenToHeader_create(<pjsip_fromto_hdr *> header)
-        elif header_name == "Route":
-            multi_header = True
-            header_data = FrozenRouteHeader_create(<pjsip_routing_hdr *> header)
-        elif header_name == "Reason":
-            value = _pj_str_to_str((<pjsip_generic_string_hdr *>header).hvalue)
-            protocol, sep, params_str = value.partition(';')
-            params = frozendict([(name, value or None) for name, sep, value in [param.partition('=') for param in params_str.split(';')]])
-            header_data = FrozenReasonHeader(protocol, params)
-        elif header_name == "Record-Route":
-            multi_header = True
-            header_data = FrozenRecordRouteHeader_create(<pjsip_routing_hdr *> header)
-        elif header_name == "Retry-After":
-            header_data = FrozenRetryAfterHeader_create(<pjsip_retry_after_hdr *> header)
-        elif header_name == "Via":
-            multi_header = True
-            header_data = FrozenViaHeader_create(<pjsip_via_hdr *> header)
-        elif header_name == "Warning":
-            match = _re_warning_hdr.match(_pj_str_to_str((<pjsip_generic_string_hdr *>header).hvalue))
-            if match is not None:
-                warning_params = match.groupdict()
-                warning_params['code'] = int(warning_params['code'])
-                header_data = FrozenWarningHeader(**warning_params)
-        elif header_name == "Event":
-            header_data = FrozenEventHeader_create(<pjsip_event_hdr *> header)
-        elif header_name == "Subscription-State":
-            header_data = FrozenSubscriptionStateHeader_create(<pjsip_sub_state_hdr *> header)
-        elif header_name == "Refer-To":
-            header_data = FrozenReferToHeader_create(<pjsip_generic_string_hdr *> header)
-        elif header_name == "Subject":
-            header_data = FrozenSubjectHeader_create(<pjsip_generic_string_hdr *> header)
-        elif header_name == "Replaces":
-            header_data = FrozenReplacesHeader_create(<pjsip_replaces_hdr *> header)
-        # skip the following headers:
-        elif header_name not in ("Authorization", "Proxy-Authenticate", "Proxy-Authorization", "WWW-Authenticate"):
-            hvalue = (<pjsip_generic_string_hdr *> header).hvalue
-            header_value = _pj_str_to_str(hvalue)
-            header_data = FrozenHeader(header_name, header_value)
-
-        if header_data is not None:
-            if multi_header:
-                headers.setdefault(header_name, []).append(header_data)
-            else:
-                if header_name not in headers:
-                    headers[header_name] = header_data
+        if header_name not in _skipped_header_names:
+            header_copy = <pjsip_hdr *> pjsip_hdr_clone(headers._pool, header)
+            pj_list_insert_before(&headers._headers, <pj_list *> header_copy)
+            headers._names[header_name] = None
         header = <pjsip_hdr *> (<pj_list *> header).next
-    info_dict["headers"] = headers
+    _message_headers.add(headers)
+    return headers
+
+cdef int _release_message_headers() except -1:
+    # The memory pools are destroyed along with the SIP endpoint, so the headers that
+    # are still alive at that point must be converted while they can still be read
+    for headers in list(_message_headers):
+        (<MessageHeaders> headers)._convert_all()
+        (<MessageHeaders> headers)._release()
+    return 0
+
+def _time_message_headers(bytes message, int iterations=10000, names=()):
+    # Measures the cost per message of converting all the headers eagerly, as was done
+    # before MessageHeaders (the first value of a single value header wins), against
+    # copying them and converting only the given names. The copies are released when they
+    # are deallocated, like those of the received messages
+    cdef MessageHeaders headers
+    cdef pjsip_msg *msg
+    cdef pjsip_hdr *header
+    cdef pj_pool_t *pool
+    cdef PJSIPUA ua = _get_ua()
+    cdef int i
+    pool = ua.create_memory_pool(b"benchmark", 4096, 4096)
+    try:
+        msg = pjsip_parse_msg(pool, message, len(message), NULL)
+        if msg == NULL:
+            raise SIPCoreError("Could not parse SIP message")
+        start = time.perf_counter()
+        for i in range(iterations):
+            converted = dict()
+            header = <pjsip_hdr *> (<pj_list *> &msg.hdr).next
+            while header != &msg.hdr:
+                header_name = _pj_str_to_str(header.name)
+                if header_name not in _skipped_header_names:
+                    header_data = _pjsip_hdr_to_object(header, header_name)
+                    if header_data is not None:
+                        if header_name in _multi_header_names:
+                            converted.setdefault(header_name, []).append(header_data)
+                        elif header_name not in converted:
+                            converted[header_name] = header_data
+                header = <pjsip_hdr *> (<pj_list *> header).next
+        eager = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(iterations):
+            headers = MessageHeaders_create(msg)
+        headers = None
+        copy = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(iterations):
+            headers = MessageHeaders_create(msg)
+            for name in names:
+                headers.get(name)
+        headers = None
+        lazy = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(iterations):
+            headers = MessageHeaders_create(msg)
+            headers._convert_all()
+        headers = None
+        lazy_all = time.perf_counter() - start
+    finally:
+        ua.release_memory_pool(pool)
+    return dict(eager=eager/iterations, copy=copy/iterations, lazy=lazy/iterations, lazy_all=lazy_all/iterations)
+
+cdef int _pjsip_msg_to_dict(pjsip_msg *msg, dict info_dict) except -1:
+    cdef pjsip_msg_body *body
+    cdef char *buf
+    cdef int buf_len, status
+    info_dict["headers"] = MessageHeaders_create(msg)
     body = msg.body
 
     if body == NULL:
@@ -434,6 +620,9 @@ def decode_device_name(device_name):
 # globals
 
 cdef object _re_pj_status_str_def = re.compile("^.*\((.*)\)$")
+cdef object _multi_header_names = frozenset(["Contact", "Record-Route", "Route", "Via"])
+cdef object _skipped_header_names = frozenset(["Authorization", "Proxy-Authenticate", "Proxy-Authorization", "WWW-Authenticate"])
+cdef object _message_headers = weakref.WeakSet()
 cdef object _re_warning_hdr = re.compile('(?P<code>[0-9]{3}) (?P<agent>.*?) "(?P<text>.*?)"')
 sip_status_messages = SIPStatusMessages()
 
@@ -32,7 +32,9 @@ class Engine(Thread, metaclass=Singleton):
                              "log_level": 0,
                              "trace_sip": False,
                              "detect_sip_loops": True,
+                             "poll_timeout": 0.1,
                              "rtp_port_range": (50000, 50500),
+                             "rtp_port_quarantine": 5.0,
                              "zrtp_cache": None,
                              "codecs": ["G722", "speex", "PCMU", "PCMA"],
                              "video_codecs": ["H264", "H263-1998", "VP8"],
@@ -46,7 +48,8 @@ class Engine(Thread, metaclass=Singleton):
                                         "refer":           ["message/sipfrag;version=2.0"],
                                         "xcap-diff":       ["application/xcap-diff+xml"]},
                              "incoming_events": set(),
-                             "incoming_requests": set()}
+                             "incoming_requests": set(),
+                             "batched_events": set()}
 
     def __init__(self):
         self.notification_center = NotificationCenter()
@@ -54,6 +57,7 @@ class Engine(Thread, metaclass=Singleton):
         self._thread_stopping = False
         self._lock = RLock()
         self._options = None
+        self._batched_events = frozenset()
         atexit.register(self.stop)
         super(Engine, self).__init__()
         self.daemon = True
@@ -95,6 +99,9 @@ class Engine(Thread, metaclass=Singleton):
                 return
             if self._thread_started:
                 self._thread_stopping = True
+                ua = getattr(self, '_ua', None)
+                if ua is not None:
+                    ua.wakeup()
 
     # worker thread
     def run(self):
@@ -110,7 +117,8 @@ class Engine(Thread, metaclass=Singleton):
             init_options['events'][k] = list(v.encode() if isinstance(v, str) else v for v in init_options['events'][k])
 
         try:
-            self._ua = PJSIPUA(self._handle_event, **init_options)
+            self._batched_events = frozenset(init_options.pop('batched_events'))
+            self._ua = PJSIPUA(self._handle_events, **init_options)
         except Exception:
             log.exception('Exception occurred while starting the Engine')
             exc_type, exc_val, exc_tb = sys.exc_info()
@@ -139,9 +147,19 @@ class Engine(Thread, metaclass=Singleton):
         del self._ua
         self.notification_center.post_notification('SIPEngineDidEnd', sender=self)
 
-    def _handle_event(self, event_name, **kwargs):
-        sender = kwargs.pop("obj", None)
-        if sender is None:
-            sender = self
-        self.notification_center.post_notification(event_name, sender, NotificationData(**kwargs))
+    def _handle_events(self, events):
+        # Events listed in the batched_events start option are not posted individually, they are
+        # collected and delivered with a single SIPEngineEventBatch notification per poll cycle.
+        post_notification = self.notification_center.post_notification
+        batch = []
+        for event_name, kwargs in events:
+            sender = kwargs.pop("obj", None)
+            if sender is None:
+                sender = self
+            if event_name in self._batched_events:
+                batch.append((event_name, sender, NotificationData(**kwargs)))
+            else:
+                post_notification(event_name, sender, NotificationData(**kwargs))
+        if batch:
+            post_notification('SIPEngineEventBatch', sender=self, data=NotificationData(events=batch))
 
@@ -9,6 +9,7 @@ resources prior the starting of a SIP session.
 
 
 import re
+from collections import OrderedDict
 from itertools import chain
 from time import time
 from urllib.parse import urlparse
@@ -45,7 +46,7 @@ if ('_set_polling_backend' in dir(dns.query)):
     dns.query._set_polling_backend(dns.query._select_for)
 
 from application.notification import IObserver, NotificationCenter, NotificationData
-from application.python import Null, limit
+from application.python import Null
 from application.python.decorator import decorator, preserve_signature
 from application.python.types import Singleton
 from dns import exception, rdatatype
@@ -90,26 +91,61 @@ class DNSLookupError(Exception):
 
 class DNSCache(object):
     """
-    A simple DNS cache which uses twisted's timers to invalidate its expired
-    data.
+    A bounded DNS cache which discards the least recently used answers when
+    it is full. Expired answers are discarded when they are accessed, rather
+    than having a timer for each of them.
+
+    Negative answers (NXDOMAIN and responses without any records of the
+    requested type) are cached as well, for the time given by the SOA record
+    of the response as described in RFC 2308, but no longer than
+    max_negative_ttl seconds.
     """
-    def __init__(self):
-        self.data = {}
+
+    def __init__(self, max_size=10000, max_ttl=3600, max_negative_ttl=900):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self.max_negative_ttl = max_negative_ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def statistics(self):
+        return dict(size=len(self.data), hits=self.hits, misses=self.misses, evictions=self.evictions, expirations=self.expirations)
 
     def get(self, key):
-        return self.data.get(key, None)
+        try:
+            expiration, value = self.data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        if expiration <= time():
+            del self.data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
 
     def put(self, key, value):
-        expiration = value.expiration-time()
-        if expiration > 0:
-            self.data[key] = value
-            reactor.callLater(limit(expiration, max=3600), self.data.pop, key, None)
+        now = time()
+        max_ttl = self.max_negative_ttl if value.rrset is None else self.max_ttl
+        expiration = min(value.expiration, now+max_ttl)
+        if expiration > now:
+            self.data[key] = expiration, value
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+                self.evictions += 1
 
     def flush(self, key=None):
         if key is not None:
             self.data.pop(key, None)
         else:
-            self.data = {}
+            self.data.clear()
 
 
 class InternalResolver(dns.resolver.Resolver):
@@ -124,9 +160,9 @@ class DNSResolver(dns.resolver.Resolver):
     """
     The resolver used by DNSLookup.
 
-    The lifetime setting on it applies to all the queries made on this resolver.
-    Each time a query is performed, its duration is subtracted from the lifetime
-    value.
+    The lifetime setting on it applies to all the queries made on this resolver,
+    including the ones running concurrently. Setting it starts a deadline and
+    each query is given the time left until that deadline is reached.
     """
 
     def __init__(self):
@@ -136,12 +172,23 @@ class DNSResolver(dns.resolver.Resolver):
         self.domain = dns_manager.domain
         self.nameservers = dns_manager.nameservers
 
+    @property
+    def lifetime(self):
+        return self._lifetime
+
+    @lifetime.setter
+    def lifetime(self, value):
+        self._lifetime = value
+        self._deadline = time() + value
+
+    @property
+    def remaining_lifetime(self):
+        return max(self._deadline - time(), 0)
+
     def query(self, *args, **kw):
-        start_time = time()
-        try:
-            return dns.resolver.Resolver.query(self, *args, **kw)
-        finally:
-            self.lifetime -= min(self.lifetime, time()-start_time)
+        # dnspython measures the lifetime from the start of each query, so pass it what is left of the shared one
+        kw.setdefault('lifetime', self.remaining_lifetime)
+        return dns.resolver.Resolver.query(self, *args, **kw)
 
 
 class SRVResult(object):
@@ -175,14 +222,15 @@ class DNSLookup(object):
 
     @run_in_waitable_green_thread
     @post_dns_lookup_notifications
-    def lookup_service(self, uri, service, timeout=3.0, lifetime=15.0):
+    def lookup_service(self, uri, service, timeout=3.0, lifetime=15.0, ipv6=False):
         """
         Performs an SRV query to determine the servers used for the specified
         service from the domain in uri.host. If this fails and falling back is
         supported, also performs an A query on uri.host, returning the default
         port of the service along with the IP addresses in the answer.
 
-        The services supported are `stun' and 'msrprelay'.
+        The services supported are `stun' and 'msrprelay'. If ipv6 is True,
+        AAAA queries are performed alongside the A queries.
 
         The DNSLookupDidSucceed notification contains a result attribute which
         is a list of (address, port) tuples. The DNSLookupDidFail notification
@@ -208,11 +256,11 @@ class DNSLookup(object):
             resolver.lifetime = lifetime
 
             record_name = '%s.%s' % (service_prefix, uri.host.decode())
-            services = self._lookup_srv_records(resolver, [record_name], log_context=log_context)
+            services = self._lookup_srv_records(resolver, [record_name], log_context=log_context, ipv6=ipv6)
             if services[record_name]:
                 return [(result.address, result.port) for result in services[record_name]]
             elif service_fallback:
-                addresses = self._lookup_a_records(resolver, [uri.host.decode()], log_context=log_context)
+                addresses = self._lookup_address_records(resolver, [uri.host.decode()], log_context=log_context, ipv6=ipv6)
                 if addresses[uri.host.decode()]:
                     return [(addr, service_port) for addr in addresses[uri.host.decode()]]
         except dns.resolver.Timeout:
@@ -223,7 +271,7 @@ class DNSLookup(object):
 
     @run_in_waitable_green_thread
     @post_dns_lookup_notifications
-    def lookup_sip_proxy(self, uri, supported_transports, timeout=10.0, lifetime=30.0, tls_name=None):
+    def lookup_sip_proxy(self, uri, supported_transports, timeout=10.0, lifetime=30.0, tls_name=None, ipv6=False):
         """
         Performs an RFC 3263 compliant lookup of transport/ip/port combinations
         for a particular SIP URI. As arguments it takes a SIPURI object
@@ -235,7 +283,9 @@ class DNSLookup(object):
         is a list of Route objects. The DNSLookupDidFail notification contains
         an error attribute describing the error encountered.
         
-        Set tls_name to the Common Name the server must present
+        Set tls_name to the Common Name the server must present. If ipv6 is
+        True, AAAA queries are performed alongside the A queries. Independent
+        queries are performed concurrently and all of them share the lifetime.
         """
 
         naptr_service_transport_map = {"sips+d2t": "tls",
@@ -276,7 +326,7 @@ class DNSLookup(object):
                 transport = 'tls' if uri.secure else transport.lower()
                 if transport not in supported_transports:
                     raise DNSLookupError("Host transport %s dictated by URI is not supported" % transport)
-                addresses = self._lookup_a_records(resolver, [uri.host.decode()], log_context=log_context)
+                addresses = self._lookup_address_records(resolver, [uri.host.decode()], log_context=log_context, ipv6=ipv6)
                 if addresses[uri.host.decode()]:
                     return [Route(address=addr, port=uri.port, transport=transport, tls_name=tls_name or uri.host) for addr in addresses[uri.host.decode()]]
 
@@ -288,12 +338,12 @@ class DNSLookup(object):
                 if uri.secure and transport != 'tls':
                     raise DNSLookupError("Requested lookup for SIPS URI, but with %s transport parameter" % transport)
                 record_name = '%s.%s' % (transport_service_map[transport], uri.host.decode())
-                services = self._lookup_srv_records(resolver, [record_name], log_context=log_context)
+                services = self._lookup_srv_records(resolver, [record_name], log_context=log_context, ipv6=ipv6)
                 if services[record_name]:
                     return [Route(address=result.address, port=result.port, transport=transport, tls_name=tls_name or uri.host) for result in services[record_name]]
                 else:
                     # If SRV lookup fails, try A lookup
-                    addresses = self._lookup_a_records(resolver, [uri.host.decode()], log_context=log_context)
+                    addresses = self._lookup_address_records(resolver, [uri.host.decode()], log_context=log_context, ipv6=ipv6)
                     port = 5061 if transport=='tls' else 5060
                     if addresses[uri.host.decode()]:
                         return [Route(address=addr, port=port, transport=transport, tls_name=tls_name or uri.host) for addr in addresses[uri.host.decode()]]
@@ -308,29 +358,28 @@ class DNSLookup(object):
                 # First try NAPTR lookup
                 naptr_services = [service for service, transport in list(naptr_service_transport_map.items()) if transport in supported_transports]
                 try:
-                    pointers = self._lookup_naptr_record(resolver, uri.host.decode(), naptr_services, log_context=log_context)
+                    pointers = self._lookup_naptr_record(resolver, uri.host.decode(), naptr_services, log_context=log_context, ipv6=ipv6)
                 except dns.resolver.Timeout:
                     pointers = []
                 if pointers:
                     return [Route(address=result.address, port=result.port, transport=naptr_service_transport_map[result.service], tls_name=tls_name or uri.host) for result in pointers]
                 else:
-                    # If that fails, try SRV lookup
-                    routes = []
-                    for transport in supported_transports:
+                    # If that fails, try SRV lookup for all the transports at the same time
+                    def lookup_transport_routes(transport):
                         record_name = '%s.%s' % (transport_service_map[transport], uri.host.decode())
                         try:
-                            services = self._lookup_srv_records(resolver, [record_name], log_context=log_context)
+                            services = self._lookup_srv_records(resolver, [record_name], log_context=log_context, ipv6=ipv6)
                         except dns.resolver.Timeout:
-                            continue
-                        if services[record_name]:
-                            routes.extend(Route(address=result.address, port=result.port, transport=transport, tls_name=tls_name or uri.host) for result in services[record_name])
+                            return []
+                        return [Route(address=result.address, port=result.port, transport=transport, tls_name=tls_name or uri.host) for result in services[record_name]]
+                    routes = list(chain.from_iterable(self._run_concurrently(lookup_transport_routes, [(transport,) for transport in supported_transports])))
                     if routes:
                         return routes
                     else:
                         # If SRV lookup fails, try A lookup
                         transport = 'tls' if uri.secure else 'udp'
                         if transport in supported_transports:
-                            addresses = self._lookup_a_records(resolver, [uri.host.decode()], log_context=log_context)
+                            addresses = self._lookup_address_records(resolver, [uri.host.decode()], log_context=log_context, ipv6=ipv6)
                             port = 5061 if transport=='tls' else 5060
                             if addresses[uri.host.decode()]:
                                 return [Route(address=addr, port=port, transport=transport, tls_name=tls_name or uri.host) for addr in addresses[uri.host.decode()]]
@@ -381,69 +430,87 @@ class DNSLookup(object):
             raise DNSLookupError('Timeout in lookup for XCAP servers for domain %s' % uri.host.decode())
 
 
-    def _lookup_a_records(self, resolver, hostnames, additional_records=[], log_context={}):
+    def _query(self, resolver, name, rdtype, log_context={}):
         notification_center = NotificationCenter()
-        additional_addresses = dict((rset.name.to_text(), rset) for rset in additional_records if rset.rdtype == rdatatype.A)
+        query_type = rdatatype.to_text(rdtype)
+        try:
+            answer = resolver.query(name, rdtype)
+        except dns.resolver.Timeout as e:
+            notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type=query_type, query_name=str(name), nameservers=resolver.nameservers, answer=None, error=e, **log_context))
+            raise
+        except exception.DNSException as e:
+            notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type=query_type, query_name=str(name), nameservers=resolver.nameservers, answer=None, error=e, **log_context))
+            return None
+        else:
+            notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type=query_type, query_name=str(name), nameservers=resolver.nameservers, answer=answer, error=None, **log_context))
+            return answer
+
+
+    def _run_concurrently(self, func, arguments):
+        """
+        Call func with each of the argument tuples in a separate green thread
+        and return the list of results once all the calls finished. If any of
+        the calls timed out, the timeout is raised only after all of them are
+        done, so that no query is left running behind the caller's back.
+        """
+        if len(arguments) <= 1:
+            return [func(*args) for args in arguments]
+        results = proc.waitall([proc.spawn(self._trap_timeout, func, *args) for args in arguments])
+        for result in results:
+            if isinstance(result, dns.resolver.Timeout):
+                raise result
+        return results
+
+    @staticmethod
+    def _trap_timeout(func, *args):
+        try:
+            return func(*args)
+        except dns.resolver.Timeout as e:
+            return e
+
+
+    def _lookup_address_records(self, resolver, hostnames, additional_records=[], log_context={}, ipv6=False):
+        address_types = (rdatatype.A, rdatatype.AAAA) if ipv6 else (rdatatype.A,)
+        hostnames = list(dict.fromkeys(hostnames))
+        additional_addresses = dict(((rset.name.to_text(), rset.rdtype), rset) for rset in additional_records if rset.rdtype in address_types)
+        queries = [(hostname, rdtype) for hostname in hostnames for rdtype in address_types if (hostname, rdtype) not in additional_addresses]
+        answers = dict(zip(queries, self._run_concurrently(self._query, [(resolver, hostname, rdtype, log_context) for hostname, rdtype in queries])))
         addresses = {}
         for hostname in hostnames:
-            if hostname in additional_addresses:
-                addresses[hostname] = [r.address for r in additional_addresses[hostname]]
-            else:
-                try:
-                    answer = resolver.query(hostname, rdatatype.A)
-                except dns.resolver.Timeout as e:
-                    notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type='A', query_name=str(hostname), nameservers=resolver.nameservers, answer=None, error=e, **log_context))
-                    raise
-                except exception.DNSException as e:
-                    notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type='A', query_name=str(hostname), nameservers=resolver.nameservers, answer=None, error=e, **log_context))
-                    addresses[hostname] = []
-                else:
-                    notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type='A', query_name=str(hostname), nameservers=resolver.nameservers, answer=answer, error=None, **log_context))
-                    addresses[hostname] = [r.address for r in answer.rrset]
+            addresses[hostname] = []
+            for rdtype in address_types:
+                if (hostname, rdtype) in additional_addresses:
+                    addresses[hostname].extend(r.address for r in additional_addresses[hostname, rdtype])
+                elif answers[hostname, rdtype] is not None:
+                    addresses[hostname].extend(r.address for r in answers[hostname, rdtype].rrset)
         return addresses
 
 
-    def _lookup_srv_records(self, resolver, srv_names, additional_records=[], log_context={}):
-        notification_center = NotificationCenter()
+    def _lookup_srv_records(self, resolver, srv_names, additional_records=[], log_context={}, ipv6=False):
+        srv_names = list(dict.fromkeys(srv_names))
         additional_services = dict((rset.name.to_text(), rset) for rset in additional_records if rset.rdtype == rdatatype.SRV)
-        services = {}
-        for srv_name in srv_names:
-            services[srv_name] = []
-            if srv_name in additional_services:
-                addresses = self._lookup_a_records(resolver, [r.target.to_text() for r in additional_services[srv_name]], additional_records)
-                for record in additional_services[srv_name]:
-                    services[srv_name].extend(SRVResult(record.priority, record.weight, record.port, addr) for addr in addresses.get(record.target.to_text(), ()))
-            else:
-                try:
-                    answer = resolver.query(srv_name, rdatatype.SRV)
-                except dns.resolver.Timeout as e:
-                    notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type='SRV', query_name=str(srv_name), nameservers=resolver.nameservers, answer=None, error=e, **log_context))
-                    raise
-                except exception.DNSException as e:
-                    notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type='SRV', query_name=str(srv_name), nameservers=resolver.nameservers, answer=None, error=e, **log_context))
-                else:
-                    notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type='SRV', query_name=str(srv_name), nameservers=resolver.nameservers, answer=answer, error=None, **log_context))
-                    addresses = self._lookup_a_records(resolver, [r.target.to_text() for r in answer.rrset], answer.response.additional, log_context)
-                    for record in answer.rrset:
-                        services[srv_name].extend(SRVResult(record.priority, record.weight, record.port, addr) for addr in addresses.get(record.target.to_text(), ()))
-            services[srv_name].sort(key=lambda result: (result.priority, -result.weight))
-        return services
-
-
-    def _lookup_naptr_record(self, resolver, domain, services, log_context={}):
-        notification_center = NotificationCenter()
+        results = self._run_concurrently(self._lookup_srv_record, [(resolver, srv_name, additional_services.get(srv_name), additional_records, log_context, ipv6) for srv_name in srv_names])
+        return dict(zip(srv_names, results))
+
+    def _lookup_srv_record(self, resolver, srv_name, records, additional_records, log_context, ipv6):
+        if records is None:
+            answer = self._query(resolver, srv_name, rdatatype.SRV, log_context)
+            if answer is None:
+                return []
+            records = answer.rrset
+            additional_records = answer.response.additional
+        addresses = self._lookup_address_records(resolver, [r.target.to_text() for r in records], additional_records, log_context, ipv6)
+        results = [SRVResult(record.priority, record.weight, record.port, addr) for record in records for addr in addresses.get(record.target.to_text(), ())]
+        results.sort(key=lambda result: (result.priority, -result.weight))
+        return results
+
+
+    def _lookup_naptr_record(self, resolver, domain, services, log_context={}, ipv6=False):
         pointers = []
-        try:
-            answer = resolver.query(domain, rdatatype.NAPTR)
-        except dns.resolver.Timeout as e:
-            notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type='NAPTR', query_name=str(domain), nameservers=resolver.nameservers, answer=None, error=e, **log_context))
-            raise
-        except exception.DNSException as e:
-            notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type='NAPTR', query_name=str(domain), nameservers=resolver.nameservers, answer=None, error=e, **log_context))
-        else:
-            notification_center.post_notification('DNSLookupTrace', sender=self, data=NotificationData(query_type='NAPTR', query_name=str(domain), nameservers=resolver.nameservers, answer=answer, error=None, **log_context))
+        answer = self._query(resolver, domain, rdatatype.NAPTR, log_context)
+        if answer is not None:
             records = [r for r in answer.rrset if r.service.decode().lower() in services]
-            services = self._lookup_srv_records(resolver, [r.replacement.to_text() for r in records], answer.response.additional, log_context)
+            services = self._lookup_srv_records(resolver, [r.replacement.to_text() for r in records], answer.response.additional, log_context, ipv6)
 
             for record in records:
                 pointers.extend(NAPTRResult(record.service.decode().lower(), record.order, record.preference, r.priority, r.weight, r.port, r.address) for r in services.get(record.replacement.to_text(), ()))
@@ -485,8 +552,14 @@ class DNSManager(object, metaclass=Singleton):
         if old_value is Null:
             NotificationCenter().post_notification('DNSResolverDidInitialize', sender=self, data=NotificationData(nameservers=value))
         elif value != old_value:
+            # answers obtained from the previous nameservers, negative ones in particular, may no longer apply
+            DNSLookup.cache.flush()
             NotificationCenter().post_notification('DNSNameserversDidChange', sender=self, data=NotificationData(nameservers=value))
 
+    @property
+    def cache_statistics(self):
+        return DNSLookup.cache.statistics
+
     def start(self):
         self._proc = proc.spawn(self._run)
         self._channel.send(Command('probe_dns'))
@@ -32,8 +32,8 @@ class FileStorage(object):
     """Store/read SIP Simple data to/from files"""
 
 
-    def __init__(self, directory):
-        self.configuration_backend = ConfigurationFileBackend(os.path.join(directory, 'config'))
+    def __init__(self, directory, configuration_snapshot=False):
+        self.configuration_backend = ConfigurationFileBackend(os.path.join(directory, 'config'), snapshot=configuration_snapshot)
         self.xcap_storage_factory  = partial(XCAPFileStorage, os.path.join(directory, 'xcap'))
         self.directory = directory
 
@@ -17,11 +17,11 @@ from application.notification import IObserver, NotificationCenter, Notification
 from application.python import Null
 from application.python.types import Singleton
 from application.system import openfile
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
 from email.message import Message as EmailMessage
 from email.parser import Parser as EmailParser
 from eventlib.coros import queue
-from eventlib.proc import spawn, ProcExit
+from eventlib.proc import spawn
 from functools import partial
 from msrplib.protocol import FailureReportHeader, SuccessReportHeader, UseNicknameHeader
 from msrplib.session import MSRPSession, contains_mime_type
@@ -323,6 +323,8 @@ class ChatStream(MSRPStreamBase):
     prefer_cpim = True
     start_otr = True
 
+    _message_arguments = frozenset(['content', 'content_type', 'recipients', 'courtesy_recipients', 'subject', 'timestamp', 'required', 'additional_headers'])
+
     def __init__(self):
         super(ChatStream, self).__init__(direction='sendrecv')
         self.message_queue = queue()
@@ -330,6 +332,7 @@ class ChatStream(MSRPStreamBase):
         self.incoming_queue = defaultdict(list)
         self.message_queue_thread = None
         self.encryption = OTREncryption(self)
+        self._content_type_support = {}
 
     @classmethod
     def new_from_sdp(cls, session, remote_sdp, stream_index):
@@ -520,84 +523,102 @@ class ChatStream(MSRPStreamBase):
         else:
             notification_center.post_notification('ChatStreamDidNotSetNickname', sender=self, data=NotificationData(message_id=message_id, message=response, code=response.code, reason=response.comment))
 
+    def _get_content_type_support(self, content_type):
+        # returns whether the content type can be sent as is and whether it can be sent wrapped in CPIM, which
+        # doesn't change once the stream started, so it is only computed once for each content type
+        try:
+            return self._content_type_support[content_type]
+        except KeyError:
+            support = self._content_type_support[content_type] = (contains_mime_type(self.remote_accept_types, content_type), contains_mime_type(self.remote_accept_wrapped_types, content_type))
+            return support
+
     def _message_queue_handler(self):
         notification_center = NotificationCenter()
+        pending_messages = deque()
         try:
             while True:
-                message = self.message_queue.wait()
+                # Take all the queued messages at once, so that the work that doesn't depend on the message is done once
+                # for the whole batch and the chunks are written back to back, without waiting for any responses.
+                pending_messages.append(self.message_queue.wait())
+                while self.message_queue:
+                    pending_messages.append(self.message_queue.wait())
                 if self.msrp_session is None:
-                    if message.notify_progress:
-                        data = NotificationData(message_id=message.id, message=None, code=0, reason='Stream ended')
-                        notification_center.post_notification('ChatStreamDidNotDeliverMessage', sender=self, data=data)
                     break
 
-                try:
-                    if isinstance(message.content, str):
-                        message.content = message.content.encode('utf8')
-                        charset = 'utf8'
+                local_identity = self.local_identity
+                remote_identity = self.remote_identity
+
+                while pending_messages:
+                    message = pending_messages[0]
+                    try:
+                        if isinstance(message.content, str):
+                            message.content = message.content.encode('utf8')
+                            charset = 'utf8'
+                        else:
+                            charset = None
+
+                        if not isinstance(message, QueuedOTRInternalMessage):
+                            try:
+                                message.content = self.encryption.otr_session.handle_output(message.content, message.content_type)
+                            except OTRError as e:
+                                raise ChatStreamError(str(e))
+
+                        custom_sender = message.sender is not None and message.sender != local_identity
+                        custom_recipients = bool(message.recipients) and message.recipients != [remote_identity]
+                        message.sender = message.sender or local_identity
+                        message.recipients = message.recipients or [remote_identity]
+
+                        # check if we MUST use CPIM
+                        need_cpim = (custom_sender or custom_recipients or
+                                     message.courtesy_recipients or message.subject or message.timestamp or message.required or message.additional_headers)
+
+                        accepted, wrapped_accepted = self._get_content_type_support(message.content_type)
+
+                        if need_cpim or not accepted:
+                            if not wrapped_accepted:
+                                raise ChatStreamError('Unsupported content_type for outgoing message: %r' % message.content_type)
+                            if not self.cpim_enabled:
+                                raise ChatStreamError('Additional message meta-data cannot be sent, because the CPIM wrapper is not used')
+                            if not self.private_messages_allowed and custom_recipients:
+                                raise ChatStreamError('The remote end does not support private messages')
+                            if message.timestamp is None:
+                                message.timestamp = ISOTimestamp.now()
+                            payload = CPIMPayload(charset=charset, **{name: getattr(message, name) for name in Message.__slots__})
+                        elif self.prefer_cpim and self.cpim_enabled and wrapped_accepted:
+                            if message.timestamp is None:
+                                message.timestamp = ISOTimestamp.now()
+                            payload = CPIMPayload(charset=charset, **{name: getattr(message, name) for name in Message.__slots__})
+                        else:
+                            payload = SimplePayload(message.content, message.content_type, charset)
+                    except ChatStreamError as e:
+                        pending_messages.popleft()
+                        if message.notify_progress:
+                            data = NotificationData(message_id=message.id, message=None, code=0, reason=e.args[0])
+                            notification_center.post_notification('ChatStreamDidNotDeliverMessage', sender=self, data=data)
+                        continue
                     else:
-                        charset = None
-
-                    if not isinstance(message, QueuedOTRInternalMessage):
-                        try:
-                            message.content = self.encryption.otr_session.handle_output(message.content, message.content_type)
-                        except OTRError as e:
-                            raise ChatStreamError(str(e))
-
-                    message.sender = message.sender or self.local_identity
-                    message.recipients = message.recipients or [self.remote_identity]
-
-                    # check if we MUST use CPIM
-                    need_cpim = (message.sender != self.local_identity or message.recipients != [self.remote_identity] or
-                                 message.courtesy_recipients or message.subject or message.timestamp or message.required or message.additional_headers)
-
-                    if need_cpim or not contains_mime_type(self.remote_accept_types, message.content_type):
-                        if not contains_mime_type(self.remote_accept_wrapped_types, message.content_type):
-                            raise ChatStreamError('Unsupported content_type for outgoing message: %r' % message.content_type)
-                        if not self.cpim_enabled:
-                            raise ChatStreamError('Additional message meta-data cannot be sent, because the CPIM wrapper is not used')
-                        if not self.private_messages_allowed and message.recipients != [self.remote_identity]:
-                            raise ChatStreamError('The remote end does not support private messages')
-                        if message.timestamp is None:
-                            message.timestamp = ISOTimestamp.now()
-                        payload = CPIMPayload(charset=charset, **{name: getattr(message, name) for name in Message.__slots__})
-                    elif self.prefer_cpim and self.cpim_enabled and contains_mime_type(self.remote_accept_wrapped_types, message.content_type):
-                        if message.timestamp is None:
-                            message.timestamp = ISOTimestamp.now()
-                        payload = CPIMPayload(charset=charset, **{name: getattr(message, name) for name in Message.__slots__})
+                        content, content_type = payload.encode()
+
+                    message_id = message.id
+                    notify_progress = message.notify_progress
+                    report = 'yes' if notify_progress else 'no'
+
+                    chunk = self.msrp_session.make_message(content, content_type=content_type, message_id=message_id)
+                    chunk.add_header(FailureReportHeader(report))
+                    chunk.add_header(SuccessReportHeader(report))
+
+                    try:
+                        self.msrp_session.send_chunk(chunk, response_cb=partial(self._on_transaction_response, message_id))
+                    except Exception as e:
+                        pending_messages.popleft()
+                        if notify_progress:
+                            data = NotificationData(message_id=message_id, message=None, code=0, reason=str(e))
+                            notification_center.post_notification('ChatStreamDidNotDeliverMessage', sender=self, data=data)
                     else:
-                        payload = SimplePayload(message.content, message.content_type, charset)
-                except ChatStreamError as e:
-                    if message.notify_progress:
-                        data = NotificationData(message_id=message.id, message=None, code=0, reason=e.args[0])
-                        notification_center.post_notification('ChatStreamDidNotDeliverMessage', sender=self, data=data)
-                    continue
-                else:
-                    content, content_type = payload.encode()
-
-                message_id = message.id
-                notify_progress = message.notify_progress
-                report = 'yes' if notify_progress else 'no'
-
-                chunk = self.msrp_session.make_message(content, content_type=content_type, message_id=message_id)
-                chunk.add_header(FailureReportHeader(report))
-                chunk.add_header(SuccessReportHeader(report))
-
-                try:
-                    self.msrp_session.send_chunk(chunk, response_cb=partial(self._on_transaction_response, message_id))
-                except Exception as e:
-                    if notify_progress:
-                        data = NotificationData(message_id=message_id, message=None, code=0, reason=str(e))
-                        notification_center.post_notification('ChatStreamDidNotDeliverMessage', sender=self, data=data)
-                except ProcExit:
-                    if notify_progress:
-                        data = NotificationData(message_id=message_id, message=None, code=0, reason='Stream ended')
-                        notification_center.post_notification('ChatStreamDidNotDeliverMessage', sender=self, data=data)
-                    raise
-                else:
-                    if notify_progress:
-                        self.sent_messages.add(message_id)
-                        notification_center.post_notification('ChatStreamDidSendMessage', sender=self, data=NotificationData(message=chunk))
+                        pending_messages.popleft()
+                        if notify_progress:
+                            self.sent_messages.add(message_id)
+                            notification_center.post_notification('ChatStreamDidSendMessage', sender=self, data=NotificationData(message=chunk))
         finally:
             self.message_queue_thread = None
             while self.sent_messages:
@@ -606,19 +627,26 @@ class ChatStream(MSRPStreamBase):
                 notification_center.post_notification('ChatStreamDidNotDeliverMessage', sender=self, data=data)
             message_queue, self.message_queue = self.message_queue, queue()
             while message_queue:
-                message = message_queue.wait()
+                pending_messages.append(message_queue.wait())
+            for message in pending_messages:
                 if message.notify_progress:
                     data = NotificationData(message_id=message.id, message=None, code=0, reason='Stream ended')
                     notification_center.post_notification('ChatStreamDidNotDeliverMessage', sender=self, data=data)
 
-    @run_in_twisted_thread
     def _enqueue_message(self, message):
+        self._enqueue_messages([message])
+
+    @run_in_twisted_thread
+    def _enqueue_messages(self, messages):
         if self._done:
-            if message.notify_progress:
-                data = NotificationData(message_id=message.id, message=None, code=0, reason='Stream ended')
-                NotificationCenter().post_notification('ChatStreamDidNotDeliverMessage', sender=self, data=data)
+            notification_center = NotificationCenter()
+            for message in messages:
+                if message.notify_progress:
+                    data = NotificationData(message_id=message.id, message=None, code=0, reason='Stream ended')
+                    notification_center.post_notification('ChatStreamDidNotDeliverMessage', sender=self, data=data)
         else:
-            self.message_queue.send(message)
+            for message in messages:
+                self.message_queue.send(message)
 
     @run_in_green_thread
     def _set_local_nickname(self, nickname, message_id):
@@ -638,10 +666,29 @@ class ChatStream(MSRPStreamBase):
         self._enqueue_message(message)
 
     def send_message(self, content, content_type='text/plain', recipients=None, courtesy_recipients=None, subject=None, timestamp=None, required=None, additional_headers=None):
-        message = QueuedMessage(content, content_type, recipients=recipients, courtesy_recipients=courtesy_recipients, subject=subject, timestamp=timestamp, required=required, additional_headers=additional_headers, notify_progress=True)
+        message = self._create_message(content, content_type, recipients, courtesy_recipients, subject, timestamp, required, additional_headers)
         self._enqueue_message(message)
         return message.id
 
+    def send_messages(self, messages):
+        """
+        Send several messages at once. Each item is a dictionary with the
+        arguments accepted by send_message. The messages are queued together
+        and are sent back to back. Returns the list of message ids.
+        """
+        queued_messages = []
+        for message in messages:
+            unknown_arguments = set(message).difference(self._message_arguments)
+            if unknown_arguments:
+                raise TypeError('send_messages() got unexpected message arguments: %s' % ', '.join(sorted(unknown_arguments)))
+            queued_messages.append(self._create_message(**message))
+        self._enqueue_messages(queued_messages)
+        return [message.id for message in queued_messages]
+
+    @staticmethod
+    def _create_message(content, content_type='text/plain', recipients=None, courtesy_recipients=None, subject=None, timestamp=None, required=None, additional_headers=None):
+        return QueuedMessage(content, content_type, recipients=recipients, courtesy_recipients=courtesy_recipients, subject=subject, timestamp=timestamp, required=required, additional_headers=additional_headers, notify_progress=True)
+
     def send_composing_indication(self, state, refresh=None, last_active=None, recipients=None):
         content = IsComposingDocument.create(state=State(state), refresh=Refresh(refresh) if refresh is not None else None, last_active=LastActive(last_active) if last_active is not None else None, content_type=ContentType('text'))
         message = QueuedMessage(content, IsComposingDocument.content_type, recipients=recipients, notify_progress=False)
@@ -774,6 +821,11 @@ class CPIMPayload(object):
     subject_re = re.compile(r'^(?:;lang=([a-z]{1,8}(?:-[a-z0-9]{1,8})*)\s+)?(.*)$')
     namespace_re = re.compile(r'^(?:(\S+) ?)?<(.*)>$')
 
+    # The MIME part only depends on the content, so when the same message is sent to many streams it is only built once
+    mime_cache = OrderedDict()
+    mime_cache_size = 256
+    mime_cache_max_content_size = 16*1024
+
     def __init__(self, content, content_type, charset=None, sender=None, recipients=None, courtesy_recipients=None, subject=None, timestamp=None, required=None, additional_headers=None):
         self.content = content
         self.content_type = content_type
@@ -816,14 +868,32 @@ class CPIMPayload(object):
 
         headers = '\r\n'.join(header_list)
 
-        mime_message = ChatMimeMessage()
-        mime_message.set_payload(self.content)
-        mime_message.set_type(self.content_type)
+        return headers + '\r\n\r\n' + self._encode_mime_part(self.content, self.content_type, self.charset), 'message/cpim'
 
-        if self.charset is not None:
-            mime_message.set_param('charset', self.charset)
+    @classmethod
+    def _encode_mime_part(cls, content, content_type, charset):
+        cacheable = len(content) <= cls.mime_cache_max_content_size
+        if cacheable:
+            key = content, content_type, charset
+            try:
+                cls.mime_cache.move_to_end(key)
+                return cls.mime_cache[key]
+            except KeyError:
+                pass
 
-        return headers + '\r\n\r\n' + mime_message.as_string(), 'message/cpim'
+        mime_message = ChatMimeMessage()
+        mime_message.set_payload(content)
+        mime_message.set_type(content_type)
+
+        if charset is not None:
+            mime_message.set_param('charset', charset)
+
+        mime_part = mime_message.as_string()
+        if cacheable:
+            cls.mime_cache[key] = mime_part
+            while len(cls.mime_cache) > cls.mime_cache_size:
+                cls.mime_cache.popitem(last=False)
+        return mime_part
 
     @classmethod
     def decode(cls, message):
@@ -11,11 +11,13 @@ import mimetypes
 import os
 import random
 import re
+import sqlite3
 import time
 import uuid
 import traceback
 
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 from application.notification import NotificationCenter, NotificationData, IObserver
 from application.python.threadpool import ThreadPool, run_in_threadpool
 from application.python.types import MarkerType
@@ -24,8 +26,8 @@ from itertools import count
 from msrplib.protocol import FailureReportHeader, SuccessReportHeader, ContentTypeHeader, IntegerHeaderType, MSRPNamedHeader, HeaderParsingError
 from msrplib.session import MSRPSession
 from msrplib.transport import make_response
-from queue import Queue
-from threading import Event, Lock
+from queue import Empty, Queue
+from threading import Condition, Event, Lock
 from zope.interface import implementer
 
 from sipsimple.configuration.settings import SIPSimpleSettings
@@ -149,10 +151,10 @@ class UniqueFilenameGenerator(object):
 
 
 class FileMetadataEntry(object):
-    def __init__(self, hash, filename, partial_hash=None):
+    def __init__(self, hash, filename, partial_hash=None, mtime=None):
         self.hash = hash
         self.filename = filename
-        self.mtime = os.path.getmtime(self.filename)
+        self.mtime = mtime if mtime is not None else os.path.getmtime(self.filename)
         self.partial_hash = partial_hash
 
     @classmethod
@@ -161,11 +163,137 @@ class FileMetadataEntry(object):
 
 
 class FileTransfersMetadata(object):
-    __filename__ = 'transfer_metadata'
+    """
+    Persistent store of the partially received files that can be resumed,
+    indexed by file hash. When used as a context manager it returns itself
+    and the changes made inside the block are committed as one transaction
+    when the block exits normally. Entries are validated when they are
+    looked up and the expired ones are removed in the background.
+    """
+
+    __filename__ = 'transfer_metadata.db'
+    __legacy_filename__ = 'transfer_metadata'
     __lifetime__ = 60*60*24*7
 
     def __init__(self):
-        self.data = {}
+        self.connection = None
+        self.lock = Lock()
+        self.directory = None
+
+    def _load(self):
+        if self.connection is not None:
+            return
+        from sipsimple.application import SIPApplication
+        if ISIPSimpleApplicationDataStorage.providedBy(SIPApplication.storage):
+            self.directory = SIPApplication.storage.directory
+        if self.directory is not None:
+            try:
+                self.connection = self._connect(os.path.join(self.directory, self.__filename__))
+                self._import_legacy_data()
+            except sqlite3.Error:
+                self.connection = None
+        if self.connection is None:
+            self.connection = self._connect(':memory:')
+        self._expire()
+
+    @staticmethod
+    def _connect(database):
+        connection = sqlite3.connect(database, check_same_thread=False)
+        connection.execute('CREATE TABLE IF NOT EXISTS transfers (hash TEXT PRIMARY KEY, filename TEXT NOT NULL, mtime REAL NOT NULL, partial_hash BLOB)')
+        connection.execute('CREATE INDEX IF NOT EXISTS transfers_mtime ON transfers (mtime)')
+        connection.commit()
+        return connection
+
+    def _import_legacy_data(self):
+        filename = os.path.join(self.directory, self.__legacy_filename__)
+        if not os.path.exists(filename):
+            return
+        try:
+            with open(filename, 'rb') as f:
+                data = pickle.loads(f.read())
+        except Exception:
+            data = {}
+        for hash, entry in data.items():
+            self[hash] = entry
+        self.connection.commit()
+        unlink(filename)
+
+    @run_in_thread('file-io')
+    def _expire(self):
+        with self.lock:
+            self.connection.execute('DELETE FROM transfers WHERE mtime < ?', (time.time() - self.__lifetime__,))
+            self.connection.commit()
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self._load()
+        except:
+            self.lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if None is exc_type is exc_val is exc_tb:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.lock.release()
+
+    def __contains__(self, hash):
+        try:
+            self[hash]
+        except KeyError:
+            return False
+        else:
+            return True
+
+    def __getitem__(self, hash):
+        row = self.connection.execute('SELECT filename, mtime, partial_hash FROM transfers WHERE hash = ?', (hash,)).fetchone()
+        if row is None:
+            raise KeyError(hash)
+        filename, mtime, partial_hash = row
+        try:
+            if os.path.getmtime(filename) != mtime or time.time() - mtime > self.__lifetime__:
+                raise ValueError('file was modified or expired')
+            partial_hash = pickle.loads(partial_hash) if partial_hash is not None else None
+        except Exception:
+            del self[hash]
+            raise KeyError(hash)
+        return FileMetadataEntry(hash, filename, partial_hash, mtime=mtime)
+
+    def __setitem__(self, hash, entry):
+        partial_hash = pickle.dumps(entry.partial_hash) if entry.partial_hash is not None else None
+        self.connection.execute('INSERT OR REPLACE INTO transfers (hash, filename, mtime, partial_hash) VALUES (?, ?, ?, ?)', (hash, entry.filename, entry.mtime, partial_hash))
+
+    def __delitem__(self, hash):
+        self.connection.execute('DELETE FROM transfers WHERE hash = ?', (hash,))
+
+    def get(self, hash, default=None):
+        try:
+            return self[hash]
+        except KeyError:
+            return default
+
+    def pop(self, hash, *args):
+        try:
+            entry = self[hash]
+        except KeyError:
+            if args:
+                return args[0]
+            raise
+        del self[hash]
+        return entry
+
+
+class FileHashCache(object):
+    __filename__ = 'transfer_hashes'
+    __maxsize__ = 1000
+
+    def __init__(self):
+        self.data = OrderedDict()
         self.lock = Lock()
         self.loaded = False
         self.directory = None
@@ -179,19 +307,9 @@ class FileTransfersMetadata(object):
         if self.directory is not None:
             try:
                 with open(os.path.join(self.directory, self.__filename__), 'rb') as f:
-                    data = pickle.loads(f.read())
+                    self.data.update(pickle.loads(f.read()))
             except Exception:
-                data = {}
-            now = time.time()
-            for hash, entry in list(data.items()):
-                try:
-                    mtime = os.path.getmtime(entry.filename)
-                except OSError:
-                    data.pop(hash)
-                else:
-                    if mtime != entry.mtime or now - mtime > self.__lifetime__:
-                        data.pop(hash)
-            self.data.update(data)
+                pass
         self.loaded = True
 
     @run_in_thread('file-io')
@@ -200,15 +318,49 @@ class FileTransfersMetadata(object):
             with open(os.path.join(self.directory, self.__filename__), 'wb') as f:
                 f.write(data)
 
-    def __enter__(self):
-        self.lock.acquire()
-        self._load()
-        return self.data
-
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if None is exc_type is exc_val is exc_tb:
+    def get(self, path, stat):
+        """Return the hash of the file if it was not modified since it was stored, None otherwise"""
+        with self.lock:
+            self._load()
+            try:
+                size, mtime, inode, hash = self.data[path]
+            except KeyError:
+                return None
+            if (size, mtime, inode) != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+                return None
+            self.data.move_to_end(path)
+            return hash
+
+    def put(self, path, stat, hash):
+        with self.lock:
+            self._load()
+            self.data.pop(path, None)
+            self.data[path] = stat.st_size, stat.st_mtime_ns, stat.st_ino, str(hash)
+            while len(self.data) > self.__maxsize__:
+                self.data.popitem(last=False)
             self._save(pickle.dumps(self.data))
-        self.lock.release()
+
+
+class ProgressThrottle(object):
+    """
+    Limits progress notifications to one every interval seconds or, if step
+    is specified, every step bytes, whichever comes first. The notification
+    for the final update is always allowed.
+    """
+
+    def __init__(self, interval, step=None):
+        self.interval = interval
+        self.step = step
+        self.last_time = 0
+        self.last_processed = 0
+
+    def __call__(self, processed, total):
+        now = time.monotonic()
+        if processed >= total or now - self.last_time >= self.interval or (self.step is not None and processed - self.last_processed >= self.step):
+            self.last_time = now
+            self.last_processed = processed
+            return True
+        return False
 
 
 @implementer(IObserver)
@@ -217,6 +369,9 @@ class FileTransferHandler(object, metaclass=ABCMeta):
     threadpool = ThreadPool(name='FileTransfers', min_threads=0, max_threads=100)
     threadpool.start()
 
+    progress_interval = 0.25
+    progress_step = None
+
     def __init__(self):
         self.stream = None
         self.session = None
@@ -317,6 +472,7 @@ class EndTransfer(metaclass=MarkerType): pass
 
 class IncomingFileTransferHandler(FileTransferHandler):
     metadata = FileTransfersMetadata()
+    write_delay = 1.0   # how long received data can wait in memory for more data before it is written
 
     def __init__(self):
         super(IncomingFileTransferHandler, self).__init__()
@@ -397,31 +553,77 @@ class IncomingFileTransferHandler(FileTransferHandler):
     def start(self):
         notification_center = NotificationCenter()
         notification_center.post_notification('FileTransferHandlerDidStart', sender=self)
+        settings = SIPSimpleSettings()
+        write_buffer_size = settings.file_transfer.write_buffer_size
+        sync_policy = settings.file_transfer.sync_policy
         file_selector = self.stream.file_selector
         fd = file_selector.fd
+        preallocate = settings.file_transfer.preallocate and 'a' not in getattr(fd, 'mode', 'a')  # writes in append mode would go after the preallocated space
+        preallocated = False
+        throttle = ProgressThrottle(self.progress_interval, self.progress_step)
+
+        # Consecutive chunks are merged into writes of up to write_buffer_size bytes, which are hashed
+        # right after they are written. Hashing is not moved to another threadpool job, as jobs that
+        # wait on each other could take up all the threads of the shared threadpool.
+        buffer = []
+        buffered_bytes = 0
+        transferred_bytes = 0
+        total_bytes = file_selector.size
+        finished = False
+        failure_reason = None
 
-        while True:
-            chunk = self.queue.get()
+        while not finished:
+            try:
+                chunk = self.queue.get(timeout=self.write_delay) if buffer else self.queue.get()
+            except Empty:
+                chunk = None
             if chunk is EndTransfer:
-                break
-            data = chunk.data
+                finished = True
+            elif chunk is not None:
+                buffer.append(chunk.data)
+                buffered_bytes += chunk.size
+                transferred_bytes = chunk.byte_range.start + chunk.size - 1
+                total_bytes = file_selector.size = chunk.byte_range.total
+                if transferred_bytes == total_bytes:
+                    finished = True
+                elif buffered_bytes < write_buffer_size:
+                    continue
+            if not buffer:
+                continue
+            data = b''.join(buffer) if len(buffer) > 1 else buffer[0]
             try:
+                if preallocate and not preallocated:
+                    preallocated = True
+                    self._preallocate(fd, total_bytes)
                 fd.write(data)
+                if sync_policy == 'always':
+                    fd.flush()
+                    os.fsync(fd.fileno())
             except EnvironmentError as e:
-                fd.close()
-                notification_center.post_notification('FileTransferHandlerError', sender=self, data=NotificationData(error=str(e)))
-                notification_center.post_notification('FileTransferHandlerDidEnd', sender=self, data=NotificationData(error=True, reason=str(e)))
-                return
-            self.hash.update(data)
-            self.offset += chunk.size
-            transferred_bytes = chunk.byte_range.start + chunk.size - 1
-            total_bytes = file_selector.size = chunk.byte_range.total
-            notification_center.post_notification('FileTransferHandlerProgress', sender=self, data=NotificationData(transferred_bytes=transferred_bytes, total_bytes=total_bytes))
-            if transferred_bytes == total_bytes:
+                failure_reason = str(e)
                 break
+            self.hash.update(data)
+            self.offset += buffered_bytes
+            buffer = []
+            buffered_bytes = 0
+            if throttle(transferred_bytes, total_bytes):
+                notification_center.post_notification('FileTransferHandlerProgress', sender=self, data=NotificationData(transferred_bytes=transferred_bytes, total_bytes=total_bytes))
 
+        try:
+            if preallocated:
+                fd.truncate()  # drop the preallocated space that was not written if the transfer is incomplete
+            if sync_policy != 'none':
+                fd.flush()
+                os.fsync(fd.fileno())
+        except EnvironmentError as e:
+            failure_reason = failure_reason or str(e)
         fd.close()
 
+        if failure_reason is not None:
+            notification_center.post_notification('FileTransferHandlerError', sender=self, data=NotificationData(error=failure_reason))
+            notification_center.post_notification('FileTransferHandlerDidEnd', sender=self, data=NotificationData(error=True, reason=failure_reason))
+            return
+
         # Transfer is finished
 
         if self.offset != self.stream.file_selector.size:
@@ -434,6 +636,17 @@ class IncomingFileTransferHandler(FileTransferHandler):
 
         notification_center.post_notification('FileTransferHandlerDidEnd', sender=self, data=NotificationData(error=False, reason=None))
 
+    @staticmethod
+    def _preallocate(fd, size):
+        if size is None or not hasattr(os, 'posix_fallocate'):
+            return
+        position = fd.tell()
+        if size > position:
+            try:
+                os.posix_fallocate(fd.fileno(), position, size - position)
+            except OSError:
+                pass  # not supported by the filesystem
+
     def _NH_MediaStreamDidNotInitialize(self, notification):
         if self.stream.file_selector.fd is not None:
             position = self.stream.file_selector.fd.tell()
@@ -455,7 +668,8 @@ class IncomingFileTransferHandler(FileTransferHandler):
 
 
 class OutgoingFileTransferHandler(FileTransferHandler):
-    file_part_size = 64*1024
+    file_part_size = 1024*1024
+    hash_cache = FileHashCache()
 
     def __init__(self):
         super(OutgoingFileTransferHandler, self).__init__()
@@ -464,6 +678,8 @@ class OutgoingFileTransferHandler(FileTransferHandler):
         self.file_offset_event = Event()
         self.message_id = '%x' % random.getrandbits(64)
         self.offset = 0
+        self.window_condition = Condition()
+        self.pending_chunks = 0
 
     def initialize(self, stream, session):
         super(OutgoingFileTransferHandler, self).initialize(stream, session)
@@ -481,28 +697,48 @@ class OutgoingFileTransferHandler(FileTransferHandler):
 
     @run_in_threadpool(FileTransferHandler.threadpool)
     def _calculate_file_hash(self):
+        notification_center = NotificationCenter()
+        file_selector = self.stream.file_selector
+        fd = file_selector.fd
+
+        # The stat is taken before hashing, so that a file modified while it is hashed doesn't match the cache later
+        try:
+            path = os.path.realpath(file_selector.name)
+            stat = os.fstat(fd.fileno())
+        except (EnvironmentError, TypeError, ValueError):
+            path = stat = None
+        else:
+            file_hash = self.hash_cache.get(path, stat)
+            if file_hash is not None:
+                file_selector.hash = file_hash
+                notification_center.post_notification('FileTransferHandlerDidInitialize', sender=self)
+                return
+
         file_hash = hashlib.sha1()
         processed = 0
+        buffer = bytearray(self.file_part_size)
+        view = memoryview(buffer)
+        throttle = ProgressThrottle(self.progress_interval)
 
-        notification_center = NotificationCenter()
-        notification_center.post_notification('FileTransferHandlerHashProgress', sender=self, data=NotificationData(processed=0, total=self.stream.file_selector.size))
+        notification_center.post_notification('FileTransferHandlerHashProgress', sender=self, data=NotificationData(processed=0, total=file_selector.size))
 
-        file_selector = self.stream.file_selector
-        fd = file_selector.fd
         while not self.stop_event.is_set():
             try:
-                content = fd.read(self.file_part_size)
+                length = fd.readinto(buffer)
             except EnvironmentError as e:
                 fd.close()
                 notification_center.post_notification('FileTransferHandlerDidNotInitialize', sender=self, data=NotificationData(reason=str(e)))
                 return
-            if not content:
+            if not length:
                 file_selector.hash = file_hash
+                if stat is not None:
+                    self.hash_cache.put(path, stat, file_selector.hash)
                 notification_center.post_notification('FileTransferHandlerDidInitialize', sender=self)
                 break
-            file_hash.update(content)
-            processed += len(content)
-            notification_center.post_notification('FileTransferHandlerHashProgress', sender=self, data=NotificationData(processed=processed, total=file_selector.size))
+            file_hash.update(view[:length])
+            processed += length
+            if throttle(processed, file_selector.size):
+                notification_center.post_notification('FileTransferHandlerHashProgress', sender=self, data=NotificationData(processed=processed, total=file_selector.size))
         else:
             fd.close()
             notification_center.post_notification('FileTransferHandlerDidNotInitialize', sender=self, data=NotificationData(reason='Interrupted transfer'))
@@ -510,6 +746,22 @@ class OutgoingFileTransferHandler(FileTransferHandler):
     def end(self):
         self.stop_event.set()
         self.file_offset_event.set()    # in case we are busy waiting on it
+        with self.window_condition:     # or on a free slot in the window
+            self.window_condition.notify_all()
+
+    def _acquire_window_slot(self, window_size):
+        with self.window_condition:
+            while self.pending_chunks >= window_size and not self.stop_event.is_set():
+                self.window_condition.wait()
+            if self.stop_event.is_set():
+                return False
+            self.pending_chunks += 1
+            return True
+
+    def _release_window_slot(self):
+        with self.window_condition:
+            self.pending_chunks -= 1
+            self.window_condition.notify()
 
     @run_in_threadpool(FileTransferHandler.threadpool)
     def start(self):
@@ -520,19 +772,28 @@ class OutgoingFileTransferHandler(FileTransferHandler):
             self._send_file_offset_chunk()
             self.file_offset_event.wait()
 
+        settings = SIPSimpleSettings()
+        chunk_size = settings.file_transfer.chunk_size
+        window_size = settings.file_transfer.window_size
+
         finished = False
         failure_reason = None
         fd = self.stream.file_selector.fd
         fd.seek(self.offset)
 
+        # Only read ahead as many chunks as fit in the window. A slot is freed when the response to
+        # the chunk that took it arrives, so a slow link throttles reading instead of piling up the
+        # whole file in the transport buffers.
         try:
-            while not self.stop_event.is_set():
+            while self._acquire_window_slot(window_size):
                 try:
-                    data = fd.read(self.file_part_size)
+                    data = fd.read(chunk_size)
                 except EnvironmentError as e:
+                    self._release_window_slot()
                     failure_reason = str(e)
                     break
                 if not data:
+                    self._release_window_slot()
                     finished = True
                     break
                 self._send_chunk(data)
@@ -551,6 +812,7 @@ class OutgoingFileTransferHandler(FileTransferHandler):
             notification_center.post_notification('FileTransferHandlerDidEnd', sender=self, data=NotificationData(error=True, reason='Incomplete transfer'))
 
     def _on_transaction_response(self, response):
+        self._release_window_slot()
         if self.stop_event.is_set():
             return
         if response.code != 200:
@@ -574,6 +836,7 @@ class OutgoingFileTransferHandler(FileTransferHandler):
         try:
             self.stream.msrp_session.send_chunk(chunk, response_cb=self._on_transaction_response)
         except Exception as e:
+            self._release_window_slot()
             NotificationCenter().post_notification('FileTransferHandlerError', sender=self, data=NotificationData(error=str(e)))
         else:
             self.offset += data_len
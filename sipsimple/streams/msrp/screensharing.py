@@ -9,6 +9,7 @@ __all__ = ['ScreenSharingStream', 'VNCConnectionError', 'ScreenSharingHandler',
 from abc import ABCMeta, abstractmethod, abstractproperty
 from application.notification import NotificationCenter, NotificationData, IObserver
 from application.python.descriptor import WriteOnceAttribute
+from eventlib import api
 from eventlib.coros import queue
 from eventlib.greenio import GreenSocket
 from eventlib.proc import spawn
@@ -29,6 +30,7 @@ class VNCConnectionError(Exception): pass
 
 @implementer(IObserver)
 class ScreenSharingHandler(object, metaclass=ABCMeta):
+    read_size = 64*1024
 
     def __init__(self):
         self.incoming_msrp_queue = None
@@ -49,6 +51,13 @@ class ScreenSharingHandler(object, metaclass=ABCMeta):
     def _msrp_reader(self):
         raise NotImplementedError
 
+    def _wait_incoming_data(self):
+        # return the next piece of data received over MSRP along with everything that is already queued
+        data = [self.incoming_msrp_queue.wait()]
+        while self.incoming_msrp_queue.ready():
+            data.append(self.incoming_msrp_queue.wait())
+        return b''.join(data) if len(data) > 1 else data[0]
+
     @abstractmethod
     def _msrp_writer(self):
         raise NotImplementedError
@@ -89,7 +98,7 @@ class InternalVNCViewerHandler(ScreenSharingViewerHandler):
     def _msrp_reader(self):
         notification_center = NotificationCenter()
         while True:
-            data = self.incoming_msrp_queue.wait()
+            data = self._wait_incoming_data()
             notification_center.post_notification('ScreenSharingStreamGotData', sender=self, data=NotificationData(data=data))
 
     def _msrp_writer(self):
@@ -104,7 +113,7 @@ class InternalVNCServerHandler(ScreenSharingServerHandler):
     def _msrp_reader(self):
         notification_center = NotificationCenter()
         while True:
-            data = self.incoming_msrp_queue.wait()
+            data = self._wait_incoming_data()
             notification_center.post_notification('ScreenSharingStreamGotData', sender=self, data=NotificationData(data=data))
 
     def _msrp_writer(self):
@@ -128,7 +137,7 @@ class ExternalVNCViewerHandler(ScreenSharingViewerHandler):
     def _msrp_reader(self):
         while True:
             try:
-                data = self.incoming_msrp_queue.wait()
+                data = self._wait_incoming_data()
                 self.vnc_socket.sendall(data)
             except Exception as e:
                 self.msrp_reader_thread = None # avoid issues caused by the notification handler killing this greenlet during post_notification
@@ -138,7 +147,7 @@ class ExternalVNCViewerHandler(ScreenSharingViewerHandler):
     def _msrp_writer(self):
         while True:
             try:
-                data = self.vnc_socket.recv(2048)
+                data = self.vnc_socket.recv(self.read_size)
                 if not data:
                     raise VNCConnectionError("connection with the VNC viewer was closed")
                 self.outgoing_msrp_queue.send(data)
@@ -185,7 +194,7 @@ class ExternalVNCServerHandler(ScreenSharingServerHandler):
     def _msrp_reader(self):
         while True:
             try:
-                data = self.incoming_msrp_queue.wait()
+                data = self._wait_incoming_data()
                 self.vnc_socket.sendall(data)
             except Exception as e:
                 self.msrp_reader_thread = None # avoid issues caused by the notification handler killing this greenlet during post_notification
@@ -195,7 +204,7 @@ class ExternalVNCServerHandler(ScreenSharingServerHandler):
     def _msrp_writer(self):
         while True:
             try:
-                data = self.vnc_socket.recv(2048)
+                data = self.vnc_socket.recv(self.read_size)
                 if not data:
                     raise VNCConnectionError("connection to the VNC server was closed")
                 self.outgoing_msrp_queue.send(data)
@@ -242,6 +251,10 @@ class ScreenSharingStream(MSRPStreamBase):
     ServerHandler = InternalVNCServerHandler
     ViewerHandler = InternalVNCViewerHandler
 
+    # outgoing data is coalesced into chunks of up to max_chunk_size bytes, waiting at most coalesce_delay seconds for more data
+    max_chunk_size = 64*1024
+    coalesce_delay = 0.005
+
     handler = WriteOnceAttribute()
 
     def __init__(self, mode):
@@ -313,10 +326,22 @@ class ScreenSharingStream(MSRPStreamBase):
                 NotificationCenter().post_notification('MediaStreamDidFail', sender=self, data=NotificationData(context='reading', reason=self._failure_reason))
                 break
 
+    def _wait_outgoing_data(self):
+        data = [self.outgoing_queue.wait()]
+        size = len(data[0])
+        try:
+            with api.timeout(self.coalesce_delay):
+                while size < self.max_chunk_size:
+                    data.append(self.outgoing_queue.wait())
+                    size += len(data[-1])
+        except api.TimeoutError:
+            pass
+        return b''.join(data) if len(data) > 1 else data[0]
+
     def _msrp_writer(self):
         while True:
             try:
-                data = self.outgoing_queue.wait()
+                data = self._wait_outgoing_data()
                 chunk = self.msrp.make_send_request(data=data)
                 chunk.add_header(SuccessReportHeader('no'))
                 chunk.add_header(FailureReportHeader('partial'))
@@ -19,6 +19,7 @@ from sipsimple.configuration.settings import SIPSimpleSettings
 from sipsimple.core import RTPTransport, SIPCoreError, SIPURI
 from sipsimple.lookup import DNSLookup
 from sipsimple.streams import IMediaStream, InvalidStreamError, MediaStreamType, UnknownStreamError
+from sipsimple.streams.rtp.pool import RTPTransportPool
 from sipsimple.threading import run_in_thread
 
 
@@ -456,7 +457,11 @@ class RTPStream(object, metaclass=RTPStreamType):
                 self._try_ice = self.session.account.nat_traversal.use_ice
                 self._srtp_encryption = 'zrtp' if local_encryption_policy == 'opportunistic' else local_encryption_policy
 
-            if self._try_ice:
+            rtp_transport = RTPTransportPool().get(self.session.account, self._srtp_encryption, self._try_ice)
+            if rtp_transport is not None:
+                self.notification_center.add_observer(self, sender=rtp_transport)
+                self._rtp_transport_initialized(rtp_transport)
+            elif self._try_ice:
                 if self.session.account.nat_traversal.stun_server_list:
                     stun_servers = list((server.host, server.port) for server in self.session.account.nat_traversal.stun_server_list)
                     self._init_rtp_transport(stun_servers)
@@ -513,25 +518,7 @@ class RTPStream(object, metaclass=RTPStreamType):
                 return
             del self._rtp_args
             del self._stun_servers
-            remote_sdp = self.__dict__.pop('_incoming_remote_sdp', None)
-            stream_index = self.__dict__.pop('_incoming_stream_index', None)
-            try:
-                if remote_sdp is not None:
-                    transport = self._create_transport(rtp_transport, remote_sdp=remote_sdp, stream_index=stream_index)
-                    self._save_remote_sdp_rtp_info(remote_sdp, stream_index)
-                else:
-                    transport = self._create_transport(rtp_transport)
-            except SIPCoreError as e:
-                self.state = "ENDED"
-                self.notification_center.remove_observer(self, sender=rtp_transport)
-                self.notification_center.post_notification('MediaStreamDidNotInitialize', sender=self, data=NotificationData(reason=e.args[0]))
-                return
-            self._rtp_transport = rtp_transport
-            self._transport = transport
-            self.notification_center.add_observer(self, sender=transport)
-            self._initialized = True
-            self.state = "INITIALIZED"
-            self.notification_center.post_notification('MediaStreamDidInitialize', sender=self)
+            self._rtp_transport_initialized(rtp_transport)
 
     def _NH_RTPTransportDidFail(self, notification):
         self.notification_center.remove_observer(self, sender=notification.sender)
@@ -594,6 +581,27 @@ class RTPStream(object, metaclass=RTPStreamType):
             self.state = "ENDED"
             self.notification_center.post_notification('MediaStreamDidNotInitialize', sender=self, data=NotificationData(reason=failure_reason))
 
+    def _rtp_transport_initialized(self, rtp_transport):
+        remote_sdp = self.__dict__.pop('_incoming_remote_sdp', None)
+        stream_index = self.__dict__.pop('_incoming_stream_index', None)
+        try:
+            if remote_sdp is not None:
+                transport = self._create_transport(rtp_transport, remote_sdp=remote_sdp, stream_index=stream_index)
+                self._save_remote_sdp_rtp_info(remote_sdp, stream_index)
+            else:
+                transport = self._create_transport(rtp_transport)
+        except SIPCoreError as e:
+            self.state = "ENDED"
+            self.notification_center.remove_observer(self, sender=rtp_transport)
+            self.notification_center.post_notification('MediaStreamDidNotInitialize', sender=self, data=NotificationData(reason=e.args[0]))
+            return
+        self._rtp_transport = rtp_transport
+        self._transport = transport
+        self.notification_center.add_observer(self, sender=transport)
+        self._initialized = True
+        self.state = "INITIALIZED"
+        self.notification_center.post_notification('MediaStreamDidInitialize', sender=self)
+
     def _save_remote_sdp_rtp_info(self, remote_sdp, index):
         connection = remote_sdp.media[index].connection or remote_sdp.connection
         self._remote_rtp_address_sdp = connection.address
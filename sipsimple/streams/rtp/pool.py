@@ -0,0 +1,266 @@
+
+"""Pool of initialized RTP transports used to speed up RTP stream setup"""
+
+__all__ = ['RTPTransportPool']
+
+from collections import deque
+from time import monotonic
+
+from application.notification import IObserver, NotificationCenter
+from application.python import Null
+from application.python.types import Singleton
+from threading import RLock
+from twisted.internet import reactor
+from zope.interface import implementer
+
+from sipsimple.account import Account, AccountManager, BonjourAccount
+from sipsimple.configuration.settings import SIPSimpleSettings
+from sipsimple.core import RTPTransport, SIPCoreError, SIPURI
+from sipsimple.lookup import DNSLookup
+from sipsimple.threading import call_in_twisted_thread, run_in_twisted_thread
+
+
+def _transport_key(account, encryption, use_ice):
+    if not use_ice:
+        return encryption, False, None
+    if account.nat_traversal.stun_server_list:
+        stun_source = tuple((server.host, server.port) for server in account.nat_traversal.stun_server_list)
+    elif not isinstance(account, BonjourAccount):
+        stun_source = account.id.domain
+    else:
+        stun_source = None
+    return encryption, True, stun_source
+
+
+@implementer(IObserver)
+class RTPTransportPool(object, metaclass=Singleton):
+    """
+    Keeps a number of RTP transports that already went through set_INIT
+    (sockets bound, SRTP/ZRTP wrapper created and, for ICE, the candidates
+    gathered) for each combination of encryption, ICE usage and STUN servers
+    that the enabled accounts or the RTP streams asked for, so that a stream
+    can skip the initialization when it is set up.
+
+    The number of transports kept for each combination is given by the
+    rtp.transport_pool_size setting (0 disables the pool). Transports are
+    replaced in the background once they get close to rtp.transport_pool_max_age
+    seconds and are discarded when they reach it or when the network
+    conditions change.
+    """
+
+    def __init__(self):
+        self.state = None
+        self._lock = RLock()
+        self._transports = {}   # key -> deque of (creation time, transport)
+        self._pending = {}      # initializing transport -> (key, remaining STUN servers)
+        self._lookups = {}      # STUN server lookup -> (key, count)
+        self._keys = set()
+        self._timer = None
+
+    def start(self):
+        if self.state == 'started':
+            return
+        self.state = 'started'
+        notification_center = NotificationCenter()
+        notification_center.add_observer(self, name='CFGSettingsObjectDidChange')
+        notification_center.add_observer(self, name='NetworkConditionsDidChange')
+        self._reload()
+
+    def stop(self):
+        if self.state != 'started':
+            return
+        self.state = 'stopped'
+        notification_center = NotificationCenter()
+        notification_center.remove_observer(self, name='CFGSettingsObjectDidChange')
+        notification_center.remove_observer(self, name='NetworkConditionsDidChange')
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        with self._lock:
+            self._keys.clear()
+            self._flush()
+
+    def get(self, account, encryption, use_ice):
+        """
+        Return an initialized RTP transport suitable for a stream of the
+        given account that uses the specified SRTP key negotiation and ICE
+        setting, or None if the pool has none available. The caller becomes
+        the owner of the transport and has to observe its notifications.
+        """
+        if self.state != 'started':
+            return None
+        key = _transport_key(account, encryption, use_ice)
+        now = monotonic()
+        max_age = SIPSimpleSettings().rtp.transport_pool_max_age
+        transport = None
+        with self._lock:
+            self._keys.add(key)
+            transports = self._transports.get(key, ())
+            while transports:
+                timestamp, rtp_transport = transports.popleft()
+                NotificationCenter().remove_observer(self, sender=rtp_transport)
+                if now - timestamp < max_age and rtp_transport.state == 'INIT':
+                    transport = rtp_transport
+                    break
+        # refill on a later reactor iteration, so creating the replacements does not delay the stream that asked
+        call_in_twisted_thread(reactor.callLater, 0, self._refill)
+        return transport
+
+    @run_in_twisted_thread
+    def _refill(self):
+        if self.state != 'started':
+            return
+        settings = SIPSimpleSettings()
+        size = settings.rtp.transport_pool_size
+        refresh_age = settings.rtp.transport_pool_max_age * 3 / 4
+        now = monotonic()
+        with self._lock:
+            for key in self._keys:
+                fresh = sum(1 for timestamp, transport in self._transports.get(key, ()) if now - timestamp < refresh_age)
+                pending = sum(1 for pending_key, servers in self._pending.values() if pending_key == key)
+                pending += sum(count for lookup_key, count in self._lookups.values() if lookup_key == key)
+                count = size - fresh - pending
+                if count <= 0:
+                    continue
+                encryption, use_ice, stun_source = key
+                if isinstance(stun_source, str):
+                    lookup = DNSLookup()
+                    self._lookups[lookup] = key, count
+                    NotificationCenter().add_observer(self, sender=lookup)
+                    lookup.lookup_service(SIPURI(stun_source), 'stun')
+                else:
+                    for i in range(count):
+                        self._create_transport(key, list(stun_source or ()) + [(None, None)])
+
+    def _create_transport(self, key, stun_servers):
+        # the STUN servers are tried in order, falling back to no STUN server like RTPStream does
+        notification_center = NotificationCenter()
+        while stun_servers:
+            stun_address, stun_port = stun_servers.pop(0)
+            try:
+                stun_address = stun_address.encode() if stun_address else None
+                rtp_transport = RTPTransport(encryption=key[0], use_ice=key[1], ice_stun_address=stun_address, ice_stun_port=stun_port)
+            except SIPCoreError:
+                continue
+            self._pending[rtp_transport] = key, stun_servers
+            notification_center.add_observer(self, sender=rtp_transport)
+            try:
+                rtp_transport.set_INIT()
+            except SIPCoreError:
+                notification_center.remove_observer(self, sender=rtp_transport)
+                del self._pending[rtp_transport]
+            else:
+                return
+
+    def _discard_expired(self):
+        max_age = SIPSimpleSettings().rtp.transport_pool_max_age
+        now = monotonic()
+        notification_center = NotificationCenter()
+        with self._lock:
+            for transports in self._transports.values():
+                while transports and now - transports[0][0] >= max_age:
+                    timestamp, rtp_transport = transports.popleft()
+                    notification_center.remove_observer(self, sender=rtp_transport)
+
+    def _flush(self):
+        notification_center = NotificationCenter()
+        with self._lock:
+            for transports in self._transports.values():
+                for timestamp, rtp_transport in transports:
+                    notification_center.remove_observer(self, sender=rtp_transport)
+            for rtp_transport in self._pending:
+                notification_center.remove_observer(self, sender=rtp_transport)
+            for lookup in self._lookups:
+                notification_center.remove_observer(self, sender=lookup)
+            self._transports.clear()
+            self._pending.clear()
+            self._lookups.clear()
+
+    def _reload(self):
+        settings = SIPSimpleSettings()
+        with self._lock:
+            self._flush()
+            self._keys.clear()
+            if settings.rtp.transport_pool_size > 0:
+                for account in AccountManager().iter_accounts():
+                    if account.enabled:
+                        policy = account.rtp.encryption.key_negotiation if account.rtp.encryption.enabled else None
+                        encryption = 'zrtp' if policy == 'opportunistic' else policy
+                        self._keys.add(_transport_key(account, encryption, account.nat_traversal.use_ice))
+        self._maintain()
+
+    def _maintain(self):
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+        if self.state != 'started' or SIPSimpleSettings().rtp.transport_pool_size == 0:
+            return
+        self._discard_expired()
+        self._refill()
+        self._timer = reactor.callLater(SIPSimpleSettings().rtp.transport_pool_max_age / 4, self._maintain)
+
+    @run_in_twisted_thread
+    def handle_notification(self, notification):
+        handler = getattr(self, '_NH_%s' % notification.name, Null)
+        handler(notification)
+
+    def _NH_RTPTransportDidInitialize(self, notification):
+        rtp_transport = notification.sender
+        with self._lock:
+            try:
+                key, stun_servers = self._pending.pop(rtp_transport)
+            except KeyError:
+                return
+            if self.state == 'started':
+                self._transports.setdefault(key, deque()).append((monotonic(), rtp_transport))
+            else:
+                notification.center.remove_observer(self, sender=rtp_transport)
+
+    def _NH_RTPTransportDidFail(self, notification):
+        rtp_transport = notification.sender
+        notification.center.remove_observer(self, sender=rtp_transport)
+        with self._lock:
+            try:
+                key, stun_servers = self._pending.pop(rtp_transport)
+            except KeyError:
+                for transports in self._transports.values():
+                    for entry in transports:
+                        if entry[1] is rtp_transport:
+                            transports.remove(entry)
+                            return
+                return
+            if self.state == 'started':
+                self._create_transport(key, stun_servers)
+
+    def _NH_DNSLookupDidSucceed(self, notification):
+        notification.center.remove_observer(self, sender=notification.sender)
+        with self._lock:
+            try:
+                key, count = self._lookups.pop(notification.sender)
+            except KeyError:
+                return
+            for i in range(count):
+                self._create_transport(key, list(notification.data.result) + [(None, None)])
+
+    def _NH_DNSLookupDidFail(self, notification):
+        notification.center.remove_observer(self, sender=notification.sender)
+        with self._lock:
+            try:
+                key, count = self._lookups.pop(notification.sender)
+            except KeyError:
+                return
+            for i in range(count):
+                self._create_transport(key, [(None, None)])
+
+    def _NH_NetworkConditionsDidChange(self, notification):
+        if self.state == 'started':
+            self._reload()
+
+    def _NH_CFGSettingsObjectDidChange(self, notification):
+        if self.state != 'started':
+            return
+        if notification.sender is SIPSimpleSettings():
+            if {'rtp.port_range', 'rtp.transport_pool_size', 'rtp.transport_pool_max_age'}.intersection(notification.data.modified):
+                self._reload()
+        elif isinstance(notification.sender, (Account, BonjourAccount)) and {'enabled', 'nat_traversal.use_ice', 'nat_traversal.stun_server_list', 'rtp.encryption.enabled', 'rtp.encryption.key_negotiation'}.intersection(notification.data.modified):
+            self._reload()
@@ -8,6 +8,7 @@ from libc.stdint cimport uint8_t, uint32_t, uint64_t
 from libc.string cimport memcpy
 from cpython.buffer cimport PyObject_CheckBuffer, PyObject_GetBuffer, PyBuffer_Release
 from cpython.bytes cimport PyBytes_FromStringAndSize, PyBytes_AsString
+from cpython.pythread cimport PyThread_type_lock, PyThread_allocate_lock, PyThread_free_lock, PyThread_acquire_lock, PyThread_release_lock, WAIT_LOCK, NOWAIT_LOCK
 from cpython.unicode cimport PyUnicode_Check
 
 
@@ -23,15 +24,25 @@ cdef extern from "_sha1.h":
         uint32_t index                      # index into buffer
 
     cdef void sha1_init(sha1_context *context)
-    cdef void sha1_update(sha1_context *context, const uint8_t *data, size_t length)
+    cdef void sha1_update(sha1_context *context, const uint8_t *data, size_t length) nogil
     cdef void sha1_digest(sha1_context *context, uint8_t *digest)
 
 
+# Updates with at least this much data release the GIL while hashing (same threshold as hashlib)
+DEF GIL_MINSIZE = 2048
+
+
 cdef class sha1(object):
     cdef sha1_context context
+    cdef PyThread_type_lock lock
 
     def __cinit__(self, *args, **kw):
         sha1_init(&self.context)
+        self.lock = NULL
+
+    def __dealloc__(self):
+        if self.lock != NULL:
+            PyThread_free_lock(self.lock)
 
     def __init__(self, data=b''):
         self.update(data)
@@ -49,7 +60,7 @@ cdef class sha1(object):
             return SHA1_DIGEST_SIZE
 
     def __reduce__(self):
-        state_variables = [self.context.state[<int>i] for i in range(sizeof(self.context.state)/4)]
+        state_variables = [self.context.state[<int>i] for i in range(sizeof(self.context.state)//4)]
         block = PyBytes_FromStringAndSize(<char*>self.context.block, self.context.index)
         return self.__class__, (), (state_variables, self.context.count, block)
 
@@ -61,9 +72,22 @@ cdef class sha1(object):
         self.context.index = len(block)
         memcpy(self.context.block, PyBytes_AsString(block), self.context.index)
 
+    cdef inline void _acquire(self):
+        # the lock only exists once the GIL was released during an update and only then can
+        # another thread be working on the context
+        if self.lock != NULL and not PyThread_acquire_lock(self.lock, NOWAIT_LOCK):
+            with nogil:
+                PyThread_acquire_lock(self.lock, WAIT_LOCK)
+
+    cdef inline void _release(self):
+        if self.lock != NULL:
+            PyThread_release_lock(self.lock)
+
     def copy(self):
         cdef sha1 instance = self.__class__()
+        self._acquire()
         instance.context = self.context
+        self._release()
         return instance
 
     def update(self, data):
@@ -72,8 +96,22 @@ cdef class sha1(object):
         if PyObject_CheckBuffer(data):
             PyObject_GetBuffer(data, &view, 0)
             if view.ndim > 1:
+                PyBuffer_Release(&view)
                 raise BufferError('Buffer must be single dimension')
-            sha1_update(&self.context, <uint8_t*>view.buf, view.len)
+            if view.len >= GIL_MINSIZE:
+                if self.lock == NULL:
+                    self.lock = PyThread_allocate_lock()
+                    if self.lock == NULL:
+                        PyBuffer_Release(&view)
+                        raise MemoryError('cannot allocate lock')
+                self._acquire()
+                with nogil:
+                    sha1_update(&self.context, <uint8_t*>view.buf, view.len)
+                self._release()
+            else:
+                self._acquire()
+                sha1_update(&self.context, <uint8_t*>view.buf, view.len)
+                self._release()
             PyBuffer_Release(&view)
         elif PyUnicode_Check(data):
             raise TypeError('Unicode-objects must be encoded before hashing')
@@ -84,7 +122,9 @@ cdef class sha1(object):
         cdef sha1_context context_copy
         cdef uint8_t digest[SHA1_DIGEST_SIZE]
 
+        self._acquire()
         context_copy = self.context
+        self._release()
         sha1_digest(&context_copy, digest)
         return PyBytes_FromStringAndSize(<char*>digest, SHA1_DIGEST_SIZE)
 